@@ -13,6 +13,8 @@ import pickle
 import numpy as np
 import json
 
+from .voc_eval import class_ground_truth, eval_class
+
 def parse_rec(filename):
   """ Parse cityscapes rec """
   objects = []
@@ -82,6 +84,42 @@ def voc_ap(rec, prec, use_07_metric=False):
   return ap
 
 
+def load_annotations(annopath, imagenames, cachedir):
+  """recs = load_annotations(annopath, imagenames, cachedir)
+
+  Read the ground truth objects of every image, cached as a pickle in
+  cachedir.
+  """
+  # first load gt
+  if not os.path.isdir(cachedir):
+    os.mkdir(cachedir)
+  if 'foggy' in imagenames[0]:
+    cachefile = os.path.join(cachedir, '%s_annots.pkl' % 'cityscapes_foggy')
+  else:
+    cachefile = os.path.join(cachedir, '%s_annots.pkl' % 'cityscapes')
+  if not os.path.isfile(cachefile):
+    # load annotations
+    recs = {}
+    for i, imagename in enumerate(imagenames):
+      recs[imagename] = parse_rec(annopath.format(imagename[:imagename.find('_')], imagename[:imagename.find('leftImg8bit')]))
+      if i % 100 == 0:
+        print('Reading annotation for {:d}/{:d}'.format(
+          i + 1, len(imagenames)))
+    # save
+    print('Saving cached annotations to {:s}'.format(cachefile))
+    with open(cachefile, 'wb') as f:
+      pickle.dump(recs, f)
+  else:
+    # load
+    with open(cachefile, 'rb') as f:
+      try:
+        recs = pickle.load(f)
+      except:
+        recs = pickle.load(f, encoding='bytes')
+
+  return recs
+
+
 def cityscapes_eval(detpath,
              annopath,
              imagesetfile,
@@ -115,52 +153,10 @@ def cityscapes_eval(detpath,
   # assumes imagesetfile is a text file with each line an image name
   # cachedir caches the annotations in a pickle file
 
-  # first load gt
-  if not os.path.isdir(cachedir):
-    os.mkdir(cachedir)
-  if 'foggy' in imagesetfile[0]:
-    cachefile = os.path.join(cachedir, '%s_annots.pkl' % 'cityscapes_foggy')
-  else:
-    cachefile = os.path.join(cachedir, '%s_annots.pkl' % 'cityscapes')
-  # read list of images
-
   imagenames = imagesetfile
+  recs = load_annotations(annopath, imagenames, cachedir)
 
-  if not os.path.isfile(cachefile):
-    # load annotations
-    recs = {}
-    for i, imagename in enumerate(imagenames):
-      recs[imagename] = parse_rec(annopath.format(imagename[:imagename.find('_')], imagename[:imagename.find('leftImg8bit')]))
-      if i % 100 == 0:
-        print('Reading annotation for {:d}/{:d}'.format(
-          i + 1, len(imagenames)))
-    # save
-    print('Saving cached annotations to {:s}'.format(cachefile))
-    with open(cachefile, 'wb') as f:
-      pickle.dump(recs, f)
-  else:
-    # load
-    with open(cachefile, 'rb') as f:
-      try:
-        recs = pickle.load(f)
-      except:
-        recs = pickle.load(f, encoding='bytes')
-
-  # extract gt objects for this class
-  class_recs = {}
-  npos = 0
-  for imagename in imagenames:
-    R = [obj for obj in recs[imagename] if obj['name'] == classname]
-    bbox = np.array([x['bbox'] for x in R])
-    if use_diff:
-      difficult = np.array([False for x in R]).astype(np.bool)
-    else:
-      difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-    det = [False] * len(R)
-    npos = npos + sum(~difficult)
-    class_recs[imagename] = {'bbox': bbox,
-                             'difficult': difficult,
-                             'det': det}
+  class_recs, npos = class_ground_truth(recs, imagenames, classname, use_diff)
 
   # read dets
   detfile = detpath.format(classname)
@@ -173,61 +169,7 @@ def cityscapes_eval(detpath,
   confidence = np.array([float(x[1]) for x in splitlines])
   BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
 
-  nd = len(image_ids)
-  tp = np.zeros(nd)
-  fp = np.zeros(nd)
-
-  if BB.shape[0] > 0:
-    # sort by confidence
-    sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
-    BB = BB[sorted_ind, :]
-    image_ids = [image_ids[x] for x in sorted_ind]
-
-    # go down dets and mark TPs and FPs
-    for d in range(nd):
-      R = class_recs[image_ids[d]]
-      bb = BB[d, :].astype(float)
-      ovmax = -np.inf
-      BBGT = R['bbox'].astype(float)
-
-      if BBGT.size > 0:
-        # compute overlaps
-        # intersection
-        ixmin = np.maximum(BBGT[:, 0], bb[0])
-        iymin = np.maximum(BBGT[:, 1], bb[1])
-        ixmax = np.minimum(BBGT[:, 2], bb[2])
-        iymax = np.minimum(BBGT[:, 3], bb[3])
-        iw = np.maximum(ixmax - ixmin + 1., 0.)
-        ih = np.maximum(iymax - iymin + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
-        ovmax = np.max(overlaps)
-        jmax = np.argmax(overlaps)
-
-      if ovmax > ovthresh:
-        if not R['difficult'][jmax]:
-          if not R['det'][jmax]:
-            tp[d] = 1.
-            R['det'][jmax] = 1
-          else:
-            fp[d] = 1.
-      else:
-        fp[d] = 1.
-
-  # compute precision recall
-  fp = np.cumsum(fp)
-  tp = np.cumsum(tp)
-  rec = tp / float(npos)
-  # avoid divide by zero in case the first detection matches a difficult
-  # ground truth
-  prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
-  ap = voc_ap(rec, prec, use_07_metric)
+  rec, prec, ap, _ = eval_class(image_ids, confidence, BB, class_recs, npos,
+                                ovthresh, use_07_metric)
   print(classname, npos)
   return rec, prec, ap
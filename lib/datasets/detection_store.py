@@ -0,0 +1,262 @@
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+import os
+
+import numpy as np
+
+from utils.array_file import ArrayFile, ArrayFileWriter, save_arrays, is_compact
+
+# The detections of a test run in columns, sorted by image and, within an
+# image, by class: boxes (N x 4 float32), scores (N float32), classes and
+# images (N int32), and offsets (num_images + 1 int64), the first row of
+# every image. They are saved as an array file, whose columns are
+# memory-mapped when it is loaded.
+_COLUMNS = ('boxes', 'scores', 'classes', 'images', 'offsets')
+
+
+class _ClassView(object):
+  """store[cls], indexed by image like all_boxes[cls]."""
+
+  def __init__(self, store, cls):
+    self._store = store
+    self._cls = cls
+
+  def __len__(self):
+    return self._store.num_images
+
+  def __getitem__(self, i):
+    return self._store.detections(self._cls, i)
+
+
+class DetectionStore(object):
+  """Columnar detections of test_net.
+
+  store[cls][image] is the N x 5 array (x1, y1, x2, y2, score) all_boxes
+  holds, so the store can be passed wherever all_boxes is read; the
+  evaluators and apply_nms slice the columns directly instead.
+  """
+
+  def __init__(self, boxes, scores, classes, images, offsets, num_classes):
+    self.boxes = boxes
+    self.scores = scores
+    self.classes = classes
+    self.images = images
+    self.offsets = offsets
+    self.num_classes = num_classes
+    self.num_images = len(offsets) - 1
+
+  @classmethod
+  def load(cls, filename):
+    arrays = ArrayFile(filename)
+    return cls(*[arrays[name] for name in _COLUMNS],
+               num_classes=int(arrays['num_classes']))
+
+  def save(self, filename):
+    save_arrays([(name, getattr(self, name)) for name in _COLUMNS] +
+                [('num_classes', np.array(self.num_classes, dtype=np.int64))],
+                filename)
+
+  def __len__(self):
+    return self.num_classes
+
+  def __getitem__(self, cls):
+    return _ClassView(self, cls)
+
+  def image_slice(self, i):
+    return slice(self.offsets[i], self.offsets[i + 1])
+
+  def detections(self, cls, i):
+    """The N x 5 detections of the class cls in the image i."""
+    rows = self.image_slice(i)
+    keep = np.where(self.classes[rows] == cls)[0] + rows.start
+    return np.hstack((self.boxes[keep], self.scores[keep, np.newaxis]))
+
+  def class_detections(self, cls):
+    """images, scores, boxes = store.class_detections(cls)
+
+    All the detections of the class cls, in the order of the images and,
+    within an image, in the order they were added.
+    """
+    keep = np.where(self.classes == cls)[0]
+    return self.images[keep], self.scores[keep], self.boxes[keep]
+
+
+def _image_rows(dets):
+  """rows, classes = _image_rows(dets)
+
+  The N x 5 rows of the detections dets[cls] of an image, by class, and
+  the class of every row."""
+  dets = [(cls, np.asarray(d, dtype=np.float32).reshape(-1, 5))
+          for cls, d in enumerate(dets)]
+  dets = [(cls, d) for cls, d in dets if d.shape[0] > 0]
+  if not dets:
+    return np.zeros((0, 5), dtype=np.float32), np.zeros(0, dtype=np.int32)
+  rows = np.vstack([d for _, d in dets])
+  classes = np.concatenate([np.full(d.shape[0], cls, dtype=np.int32)
+                            for cls, d in dets])
+  return rows, classes
+
+
+class DetectionWriter(object):
+  """Collect the detections of test_net image by image into the columns of
+  a DetectionStore, in chunks instead of one array per (class, image)."""
+
+  def __init__(self, num_images, num_classes):
+    self.num_images = num_images
+    self.num_classes = num_classes
+    self._chunks = []
+    self._counts = np.zeros(num_images, dtype=np.int64)
+
+  def add(self, i, dets):
+    """Add the detections of the image i, dets[cls] being the N x 5 array
+    of the class (all_boxes[cls][i] of test_net)."""
+    rows, classes = _image_rows(dets)
+    if rows.shape[0] == 0:
+      return
+    self._chunks.append((i, rows, classes))
+    self._counts[i] += rows.shape[0]
+
+  def finish(self):
+    """The DetectionStore of the images added so far."""
+    if self._chunks:
+      # the images may come out of order
+      order = sorted(range(len(self._chunks)), key=lambda k: self._chunks[k][0])
+      rows = np.vstack([self._chunks[k][1] for k in order])
+      classes = np.concatenate([self._chunks[k][2] for k in order])
+      images = np.concatenate([np.full(len(self._chunks[k][2]), self._chunks[k][0],
+                                       dtype=np.int32) for k in order])
+    else:
+      rows = np.zeros((0, 5), dtype=np.float32)
+      classes = np.zeros(0, dtype=np.int32)
+      images = np.zeros(0, dtype=np.int32)
+    offsets = np.concatenate([[0], np.cumsum(self._counts)]).astype(np.int64)
+    return DetectionStore(np.ascontiguousarray(rows[:, :4]),
+                          np.ascontiguousarray(rows[:, 4]),
+                          classes, images, offsets, self.num_classes)
+
+
+class DetectionStreamWriter(object):
+  """Write the detections of a stream of images (e.g. the frames of a
+  video) to a detection store file as they come, without holding them in
+  memory or knowing the number of images ahead. The images must be added
+  in order; the ones skipped have no detections."""
+
+  def __init__(self, filename, num_classes):
+    self.num_classes = num_classes
+    self._writer = ArrayFileWriter(filename)
+    self._counts = []
+    # the columns exist even if nothing is detected
+    self._append(np.zeros((0, 5), dtype=np.float32), np.zeros(0, dtype=np.int32), 0)
+
+  def _append(self, rows, classes, i):
+    self._writer.append('boxes', np.ascontiguousarray(rows[:, :4]))
+    self._writer.append('scores', np.ascontiguousarray(rows[:, 4]))
+    self._writer.append('classes', classes)
+    self._writer.append('images', np.full(rows.shape[0], i, dtype=np.int32))
+
+  def add(self, i, dets):
+    """Add the detections of the image i, as DetectionWriter.add."""
+    assert i >= len(self._counts), 'The images must be added in order'
+    self._counts.extend([0] * (i - len(self._counts)))
+    rows, classes = _image_rows(dets)
+    self._append(rows, classes, i)
+    self._counts.append(rows.shape[0])
+
+  def close(self, num_images=None, named_arrays=()):
+    """Write the file, of num_images images (by default up to the last one
+    added), with the extra (name, numpy array) pairs of named_arrays."""
+    num_images = len(self._counts) if num_images is None else num_images
+    counts = self._counts + [0] * (num_images - len(self._counts))
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    self._writer.close([('offsets', offsets),
+                        ('num_classes', np.array(self.num_classes, dtype=np.int64))] +
+                       list(named_arrays))
+
+  def discard(self):
+    """Drop the detections added, without writing the file."""
+    self._writer.discard()
+
+
+def detection_store(all_boxes):
+  """The DetectionStore of the all_boxes list of lists of test_net."""
+  num_classes = len(all_boxes)
+  num_images = len(all_boxes[0])
+  writer = DetectionWriter(num_images, num_classes)
+  for i in range(num_images):
+    writer.add(i, [all_boxes[cls][i] for cls in range(num_classes)])
+  return writer.finish()
+
+
+def merge_detection_stores(stores):
+  """The DetectionStore of all the detections of stores, which hold
+  detections of the same images, e.g. the shards of a test run."""
+  num_images, num_classes = stores[0].num_images, stores[0].num_classes
+  assert all(s.num_images == num_images and s.num_classes == num_classes for s in stores), \
+    'The stores do not cover the same images and classes'
+  images = np.concatenate([s.images for s in stores])
+  classes = np.concatenate([s.classes for s in stores])
+  # by image and, within an image, by class, in the order of the stores
+  order = np.lexsort((classes, images))
+  counts = np.sum([np.diff(s.offsets) for s in stores], axis=0)
+  return DetectionStore(np.concatenate([s.boxes for s in stores])[order],
+                        np.concatenate([s.scores for s in stores])[order],
+                        classes[order], images[order],
+                        np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                        num_classes)
+
+
+def load_detections(output_dir):
+  """Load the detections test_net saved in output_dir: detections.dets,
+  memory-mapped, or the detections.pkl of older runs."""
+  filename = os.path.join(output_dir, 'detections.dets')
+  if os.path.exists(filename) and is_compact(filename):
+    return DetectionStore.load(filename)
+  with open(os.path.join(output_dir, 'detections.pkl'), 'rb') as f:
+    return pickle.load(f)
+
+
+class RawOutputs(object):
+  """The raw im_detect outputs of test_net: scores[rows] (R x num_classes)
+  and boxes[rows] (R x 4 num_classes, decoded and clipped) of every image,
+  rows = image_slice(i), memory-mapped from the file of RawOutputWriter."""
+
+  def __init__(self, filename):
+    arrays = ArrayFile(filename)
+    self.scores = arrays['scores']
+    self.boxes = arrays['boxes']
+    self.offsets = arrays['offsets']
+    self.num_images = len(self.offsets) - 1
+
+  def image_slice(self, i):
+    return slice(self.offsets[i], self.offsets[i + 1])
+
+  def image(self, i):
+    """scores, boxes = raw.image(i), as im_detect returned them."""
+    rows = self.image_slice(i)
+    return np.asarray(self.scores[rows]), np.asarray(self.boxes[rows])
+
+
+class RawOutputWriter(object):
+  """Spool the im_detect outputs of the images, in order, to filename."""
+
+  def __init__(self, filename):
+    self._writer = ArrayFileWriter(filename)
+    self._counts = [0]
+
+  def add(self, scores, boxes):
+    self._writer.append('scores', scores.astype(np.float32, copy=False))
+    self._writer.append('boxes', boxes.astype(np.float32, copy=False))
+    self._counts.append(scores.shape[0])
+
+  def close(self):
+    self._writer.close([('offsets', np.cumsum(self._counts).astype(np.int64))])
@@ -0,0 +1,137 @@
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import scipy.sparse
+
+from utils.array_file import ArrayFile, save_arrays, is_compact
+
+# The ground truth objects of an image set in columns, in the order of the
+# images and, within an image, of the annotation file: boxes (M x 4
+# float64, as annotated), labels (M int32, index in label_names, the raw
+# names of the annotations), difficult (M uint8) and diff_lev (M int8, the
+# KITTI difficulty level of parse_rec_KITTI, -1 for the other datasets),
+# plus image_names and offsets (num_images + 1 int64), the first object of
+# every image. They are saved as an array file, memory-mapped when loaded.
+_COLUMNS = ('image_names', 'offsets', 'boxes', 'labels', 'label_names',
+            'difficult', 'diff_lev')
+
+
+class GTIndex(object):
+  """Ground truth of an image set, shared by the roidb of training and the
+  evaluators."""
+
+  def __init__(self, image_names, offsets, boxes, labels, label_names,
+               difficult, diff_lev):
+    self.image_names = image_names
+    self.offsets = offsets
+    self.boxes = boxes
+    self.labels = labels
+    self.label_names = label_names
+    self.difficult = difficult
+    self.diff_lev = diff_lev
+    self.num_images = len(offsets) - 1
+
+  @classmethod
+  def load(cls, filename):
+    arrays = ArrayFile(filename)
+    return cls(*[arrays[name] for name in _COLUMNS])
+
+  def save(self, filename):
+    save_arrays([(name, np.asarray(getattr(self, name))) for name in _COLUMNS],
+                filename)
+
+  @classmethod
+  def from_recs(cls, image_names, recs):
+    """The index of recs, mapping every image name to its objects as the
+    parse_rec functions return them."""
+    objs = [obj for name in image_names for obj in recs[name]]
+    counts = [len(recs[name]) for name in image_names]
+    label_names = sorted(set(obj['name'] for obj in objs))
+    label_to_ind = dict(zip(label_names, range(len(label_names))))
+    return cls(np.array(image_names),
+               np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+               np.array([obj['bbox'] for obj in objs], dtype=np.float64).reshape(-1, 4),
+               np.array([label_to_ind[obj['name']] for obj in objs], dtype=np.int32),
+               np.array(label_names),
+               np.array([obj['difficult'] for obj in objs], dtype=np.uint8),
+               np.array([obj.get('diffLev', -1) for obj in objs], dtype=np.int8))
+
+  def image_slice(self, i):
+    return slice(self.offsets[i], self.offsets[i + 1])
+
+  def class_ids(self, classes, lower=False):
+    """Index in classes of the label of every object, -1 for the labels
+    that are not a class. lower compares the labels lowercased and
+    stripped."""
+    class_to_ind = dict(zip(classes, range(len(classes))))
+    names = [name.lower().strip() if lower else name for name in self.label_names.tolist()]
+    lut = np.array([class_to_ind.get(name, -1) for name in names] + [-1], dtype=np.int32)
+    return lut[self.labels]
+
+  def pack(self, imagenames, classes, use_diff=False):
+    """The flat ground truth of voc_eval.pack_ground_truth."""
+    assert self.image_names.tolist() == list(imagenames), \
+      'The ground truth index does not list the evaluated images'
+    gt = {'boxes': np.asarray(self.boxes, dtype=np.float64),
+          'classes': self.class_ids(classes).astype(np.int64),
+          'difficult': (np.zeros(len(self.labels), dtype=np.bool_) if use_diff
+                        else self.difficult.astype(np.bool_)),
+          'images': np.repeat(np.arange(self.num_images), np.diff(self.offsets)),
+          'num_images': self.num_images}
+    # the KITTI difficulty levels, when every box has one
+    if len(self.diff_lev) > 0 and (self.diff_lev >= 0).all():
+      gt['diffLev'] = self.diff_lev.astype(np.int64)
+    return gt
+
+  def gt_roidb(self, classes, lower=False):
+    """The ground-truth roidb of the objects of classes, for training."""
+    num_classes = len(classes)
+    keep = self.class_ids(classes, lower)
+    gt_roidb = []
+    for i in range(self.num_images):
+      rows = self.image_slice(i)
+      inds = np.where(keep[rows] >= 0)[0] + rows.start
+      boxes = self.boxes[inds].astype(np.float32)
+      gt_classes = keep[inds]
+      assert (boxes >= 0).all(), 'negative box in {}'.format(self.image_names[i])
+      assert (boxes[:, 0] <= boxes[:, 2]).all() and (boxes[:, 1] <= boxes[:, 3]).all()
+      overlaps = np.zeros((len(inds), num_classes), dtype=np.float32)
+      overlaps[np.arange(len(inds)), gt_classes] = 1.0
+      # "Seg" area is just the box area
+      seg_areas = ((self.boxes[inds, 2] - self.boxes[inds, 0] + 1) *
+                   (self.boxes[inds, 3] - self.boxes[inds, 1] + 1)).astype(np.float32)
+      gt_roidb.append({'boxes': boxes,
+                       'gt_classes': gt_classes,
+                       'gt_overlaps': scipy.sparse.csr_matrix(overlaps),
+                       'flipped': False,
+                       'seg_areas': seg_areas})
+    return gt_roidb
+
+
+def load_gt_index(cache_file, image_names, parse):
+  """Load the GTIndex of image_names cached in cache_file, building it
+  first with parse(image_name), which returns the objects of an image."""
+  if os.path.exists(cache_file) and is_compact(cache_file):
+    index = GTIndex.load(cache_file)
+    if index.image_names.tolist() == list(image_names):
+      return index
+    print('{} lists other images, rebuilding it'.format(cache_file))
+
+  recs = {}
+  for i, image_name in enumerate(image_names):
+    recs[image_name] = parse(image_name)
+    if i % 100 == 0:
+      print('Reading annotation for {:d}/{:d}'.format(i + 1, len(image_names)))
+  tmp_file = cache_file + '.tmp'
+  GTIndex.from_recs(image_names, recs).save(tmp_file)
+  os.rename(tmp_file, cache_file)
+  print('wrote gt index to {}'.format(cache_file))
+  return GTIndex.load(cache_file)
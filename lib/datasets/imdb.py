@@ -10,11 +10,67 @@ from __future__ import print_function
 
 import os
 import os.path as osp
+import pickle
 import PIL
 from utils.bbox import bbox_overlaps
 import numpy as np
 import scipy.sparse
+from collections import OrderedDict
 from model.config import cfg
+from datasets.voc_eval import eval_sweep, summarize, IncrementalEvaluator, COCO_OVTHRESHS
+
+
+# Area ranges of the ground truth boxes for evaluate_recall
+RECALL_AREA_RANGES = OrderedDict([('all', [0 ** 2, 1e5 ** 2]),
+                                  ('small', [0 ** 2, 32 ** 2]),
+                                  ('medium', [32 ** 2, 96 ** 2]),
+                                  ('large', [96 ** 2, 1e5 ** 2]),
+                                  ('96-128', [96 ** 2, 128 ** 2]),
+                                  ('128-256', [128 ** 2, 256 ** 2]),
+                                  ('256-512', [256 ** 2, 512 ** 2]),
+                                  ('512-inf', [512 ** 2, 1e5 ** 2])])
+
+
+def greedy_coverage(overlaps):
+  """IoU with which every gt box (column of the P x G overlaps) is covered
+  by a proposal (row), assigning them one to one greedily: the best
+  covered gt box first, then the best covered of the others with the
+  proposals left, etc. Ties go to the first gt box and the first proposal.
+
+  A gt box can only lose the proposals taken by the k = min(P, G) boxes
+  matched before it, so only its k best proposals are kept, sorted. Each
+  box keeps a pointer into them, moved past the proposals taken by the
+  other boxes, and a step only compares the current candidate of every
+  box instead of searching the whole matrix. The gt boxes left without a
+  proposal have a coverage of 0.
+  """
+  num_boxes, num_gt = overlaps.shape
+  coverage = np.zeros(num_gt)
+  k = min(num_boxes, num_gt)
+  if k == 0:
+    return coverage
+  # the proposals at least as good as the k-th best of every gt box
+  kth = -np.partition(-overlaps, k - 1, axis=0)[k - 1]
+  box_inds, gt_inds = np.nonzero(overlaps >= kth)
+  order = np.lexsort((box_inds, -overlaps[box_inds, gt_inds], gt_inds))
+  sorted_boxes = box_inds[order]
+  gt_range = np.arange(num_gt)
+  pointer = np.searchsorted(gt_inds[order], gt_range)
+  candidate = sorted_boxes[pointer]
+  box_used = np.zeros(num_boxes, dtype=np.bool_)
+  gt_done = np.zeros(num_gt, dtype=np.bool_)
+  for _ in range(k):
+    stale = np.where(~gt_done & box_used[candidate])[0]
+    while len(stale) > 0:
+      pointer[stale] += 1
+      candidate[stale] = sorted_boxes[pointer[stale]]
+      stale = stale[box_used[candidate[stale]]]
+    best = np.where(gt_done, -np.inf, overlaps[candidate, gt_range])
+    gt_ind = best.argmax()
+    coverage[gt_ind] = best[gt_ind]
+    box_used[candidate[gt_ind]] = True
+    gt_done[gt_ind] = True
+  return coverage
 
 
 class imdb(object):
@@ -91,7 +147,106 @@ class imdb(object):
   def default_roidb(self):
     raise NotImplementedError
 
-  def evaluate_detections(self, all_boxes, output_dir=None):
+  def _write_voc_results_file(self, all_boxes):
+    for cls_ind, cls in enumerate(self.classes):
+      if cls == '__background__':
+        continue
+      print('Writing {} results file'.format(cls))
+      filename = self._get_voc_results_file_template().format(cls)
+      with open(filename, 'wt') as f:
+        for im_ind, index in enumerate(self.image_index):
+          dets = all_boxes[cls_ind][im_ind]
+          if len(dets) == 0:
+            continue
+          # the VOCdevkit expects 1-based indices
+          for k in range(dets.shape[0]):
+            f.write('{:s} {:.3f} {:.1f} {:.1f} {:.1f} {:.1f}\n'.
+                    format(index, dets[k, -1],
+                           dets[k, 0] + 1, dets[k, 1] + 1,
+                           dets[k, 2] + 1, dets[k, 3] + 1))
+
+  def _eval_annotations(self):
+    """The ground truth objects of every image of the set: a dict of the
+    objects of every image (see voc_eval.load_annotations) or a GTIndex."""
+    raise NotImplementedError
+
+  def _eval_options(self):
+    """ovthreshs, settings, use_07_metric = self._eval_options()"""
+    ovthreshs = list(cfg.TEST.EVAL_OVTHRESHS)
+    settings = ['all']
+    if cfg.TEST.EVAL_COCO:
+      ovthreshs += [t for t in COCO_OVTHRESHS if t not in ovthreshs]
+      settings += ['small', 'medium', 'large']
+    return ovthreshs, settings, False
+
+  def streaming_evaluator(self):
+    """
+    The IncrementalEvaluator test_net feeds the detections of every image as
+    they come, or None when the detections are needed for the results files.
+    """
+    if not self.config['cleanup'] or self.config['matlab_eval']:
+      return None
+    ovthreshs, settings, use_07_metric = self._eval_options()
+    return IncrementalEvaluator(self._classes, self.image_index,
+                                self._eval_annotations(), ovthreshs=ovthreshs,
+                                use_07_metric=use_07_metric,
+                                use_diff=self.config['use_diff'],
+                                settings=settings)
+
+  def _do_python_eval(self, all_boxes, output_dir='output', evaluator=None):
+    aps = []
+    ovthreshs, settings, use_07_metric = self._eval_options()
+    print('VOC07 metric? ' + ('Yes' if use_07_metric else 'No'))
+    if not os.path.isdir(output_dir):
+      os.mkdir(output_dir)
+    if evaluator is not None:
+      # the detections were matched as test_net went through the images
+      results = evaluator.results()
+    else:
+      # every class is evaluated from all_boxes, with the ground truth loaded
+      # once, at every threshold and area range on a pool of processes
+      results = eval_sweep(all_boxes, self._classes, self.image_index,
+                           self._eval_annotations(), ovthreshs=ovthreshs,
+                           use_07_metric=use_07_metric,
+                           use_diff=self.config['use_diff'],
+                           num_workers=cfg.TEST.EVAL_WORKERS, settings=settings)
+    for cls in self._classes:
+      if cls == '__background__':
+        continue
+      rec, prec, ap, rec_ALL = results[(cls, 'all', ovthreshs[0])]
+      aps += [ap]
+      print(('AP for {} = {:.4f}'.format(cls, ap)))
+      pr = {'rec': rec, 'prec': prec, 'ap': ap}
+      if len(cfg.TEST.EVAL_OVTHRESHS) > 1:
+        pr['ovthresh'] = dict((t, {'rec': results[(cls, 'all', t)][0],
+                                   'prec': results[(cls, 'all', t)][1],
+                                   'ap': results[(cls, 'all', t)][2]})
+                              for t in cfg.TEST.EVAL_OVTHRESHS)
+      with open(os.path.join(output_dir, cls + '_pr.pkl'), 'wb') as f:
+        pickle.dump(pr, f)
+    for t in cfg.TEST.EVAL_OVTHRESHS[1:]:
+      print(('Mean AP@{:.2f} = {:.4f}'.format(
+        t, np.mean([r[2] for (_, rs, rt), r in results.items() if rs == 'all' and rt == t]))))
+    if len(settings) > 1:
+      table = summarize(results, self._classes, ovthreshs[0])
+      with open(os.path.join(output_dir, 'ap_table.pkl'), 'wb') as f:
+        pickle.dump(table, f)
+    print(('Mean AP = {:.4f}'.format(np.mean(aps))))
+    print('~~~~~~~~')
+    print('Results:')
+    for ap in aps:
+      print(('{:.3f}'.format(ap)))
+    print(('{:.3f}'.format(np.mean(aps))))
+    print('~~~~~~~~')
+    print('')
+    print('--------------------------------------------------------------')
+    print('Results computed with the **unofficial** Python eval code.')
+    print('Results should be very close to the official MATLAB eval code.')
+    print('Recompute with `./tools/reval.py --matlab ...` for your paper.')
+    print('-- Thanks, The Management')
+    print('--------------------------------------------------------------')
+
+  def evaluate_detections(self, all_boxes, output_dir=None, evaluator=None):
     """
     all_boxes is a list of length number-of-classes.
     Each list element is a list of length number-of-images.
@@ -99,8 +254,28 @@ class imdb(object):
     or a numpy array of detection.
 
     all_boxes[class][image] = [] or np.array of shape #dets x 5
+
+    evaluator is the streaming_evaluator test_net fed with the same
+    detections, when there is one; all_boxes may then be None.
+
+    The subclasses give the ground truth (_eval_annotations), the
+    thresholds and settings (_eval_options), the results files
+    (_get_voc_results_file_template) and _do_matlab_eval.
     """
-    raise NotImplementedError
+    # The python eval reads all_boxes directly, the results files are only
+    # written for the competition mode or the MATLAB code
+    write_results = not self.config['cleanup'] or self.config['matlab_eval']
+    if write_results:
+      self._write_voc_results_file(all_boxes)
+    self._do_python_eval(all_boxes, output_dir, evaluator)
+    if self.config['matlab_eval']:
+      self._do_matlab_eval(output_dir)
+    if write_results and self.config['cleanup']:
+      for cls in self._classes:
+        if cls == '__background__':
+          continue
+        filename = self._get_voc_results_file_template().format(cls)
+        os.remove(filename)
 
   def _get_widths(self):
     if 'bdd' in self._name:
@@ -137,23 +312,26 @@ class imdb(object):
             'thresholds': vector of IoU overlap thresholds
             'gt_overlaps': vector of all ground-truth overlaps
     """
+    return self.evaluate_recall_sweep(candidate_boxes, thresholds,
+                                      [area], [limit])[(area, limit)]
+
+  def evaluate_recall_sweep(self, candidate_boxes=None, thresholds=None,
+                            areas=('all', 'small', 'medium', 'large'),
+                            limits=(None,)):
+    """Evaluate the proposal recall of every area range in areas with the
+    first limit proposals of every image, for every limit in limits (None
+    for all of them), in a single pass over the images.
+
+    Returns an OrderedDict mapping (area, limit) to the results of
+    evaluate_recall.
+    """
     # Record max overlap value for each gt box
     # Return vector of overlap values
-    areas = {'all': 0, 'small': 1, 'medium': 2, 'large': 3,
-             '96-128': 4, '128-256': 5, '256-512': 6, '512-inf': 7}
-    area_ranges = [[0 ** 2, 1e5 ** 2],  # all
-                   [0 ** 2, 32 ** 2],  # small
-                   [32 ** 2, 96 ** 2],  # medium
-                   [96 ** 2, 1e5 ** 2],  # large
-                   [96 ** 2, 128 ** 2],  # 96-128
-                   [128 ** 2, 256 ** 2],  # 128-256
-                   [256 ** 2, 512 ** 2],  # 256-512
-                   [512 ** 2, 1e5 ** 2],  # 512-inf
-                   ]
-    assert area in areas, 'unknown area range: {}'.format(area)
-    area_range = area_ranges[areas[area]]
-    gt_overlaps = np.zeros(0)
-    num_pos = 0
+    for area in areas:
+      assert area in RECALL_AREA_RANGES, 'unknown area range: {}'.format(area)
+    keys = [(area, limit) for area in areas for limit in limits]
+    gt_overlaps = dict((key, []) for key in keys)
+    num_pos = dict((area, 0) for area in areas)
     for i in range(self.num_images):
       # Checking for max_overlaps == 1 avoids including crowd annotations
       # (...pretty hacking :/)
@@ -162,10 +340,12 @@ class imdb(object):
                          (max_gt_overlaps == 1))[0]
       gt_boxes = self.roidb[i]['boxes'][gt_inds, :]
       gt_areas = self.roidb[i]['seg_areas'][gt_inds]
-      valid_gt_inds = np.where((gt_areas >= area_range[0]) &
-                               (gt_areas <= area_range[1]))[0]
-      gt_boxes = gt_boxes[valid_gt_inds, :]
-      num_pos += len(valid_gt_inds)
+      valid_gt_inds = {}
+      for area in areas:
+        area_range = RECALL_AREA_RANGES[area]
+        valid_gt_inds[area] = np.where((gt_areas >= area_range[0]) &
+                                       (gt_areas <= area_range[1]))[0]
+        num_pos[area] += len(valid_gt_inds[area])
 
       if candidate_boxes is None:
         # If candidate_boxes is not supplied, the default is to use the
@@ -176,45 +356,33 @@ class imdb(object):
         boxes = candidate_boxes[i]
       if boxes.shape[0] == 0:
         continue
-      if limit is not None and boxes.shape[0] > limit:
-        boxes = boxes[:limit, :]
-
-      overlaps = bbox_overlaps(boxes.astype(np.float),
-                               gt_boxes.astype(np.float))
-
-      _gt_overlaps = np.zeros((gt_boxes.shape[0]))
-      for j in range(gt_boxes.shape[0]):
-        # find which proposal box maximally covers each gt box
-        argmax_overlaps = overlaps.argmax(axis=0)
-        # and get the iou amount of coverage for each gt box
-        max_overlaps = overlaps.max(axis=0)
-        # find which gt box is 'best' covered (i.e. 'best' = most iou)
-        gt_ind = max_overlaps.argmax()
-        gt_ovr = max_overlaps.max()
-        assert (gt_ovr >= 0)
-        # find the proposal box that covers the best covered gt box
-        box_ind = argmax_overlaps[gt_ind]
-        # record the iou coverage of this gt box
-        _gt_overlaps[j] = overlaps[box_ind, gt_ind]
-        assert (_gt_overlaps[j] == gt_ovr)
-        # mark the proposal box and the gt box as used
-        overlaps[box_ind, :] = -1
-        overlaps[:, gt_ind] = -1
-      # append recorded iou coverage level
-      gt_overlaps = np.hstack((gt_overlaps, _gt_overlaps))
-
-    gt_overlaps = np.sort(gt_overlaps)
+      max_limit = None if None in limits else max(limits)
+      if max_limit is not None:
+        boxes = boxes[:max_limit, :]
+
+      # the overlaps of the first proposals are the first rows, so the
+      # matrix is computed once for all the limits
+      overlaps = bbox_overlaps(boxes.astype(np.float64),
+                               gt_boxes.astype(np.float64))
+      for area, limit in keys:
+        _overlaps = overlaps[:limit, valid_gt_inds[area]]
+        gt_overlaps[(area, limit)].append(greedy_coverage(_overlaps))
+
     if thresholds is None:
       step = 0.05
       thresholds = np.arange(0.5, 0.95 + 1e-5, step)
-    recalls = np.zeros_like(thresholds)
-    # compute recall for each iou threshold
-    for i, t in enumerate(thresholds):
-      recalls[i] = (gt_overlaps >= t).sum() / float(num_pos)
-    # ar = 2 * np.trapz(recalls, thresholds)
-    ar = recalls.mean()
-    return {'ar': ar, 'recalls': recalls, 'thresholds': thresholds,
-            'gt_overlaps': gt_overlaps}
+    results = OrderedDict()
+    for area, limit in keys:
+      _gt_overlaps = np.sort(np.concatenate([np.zeros(0)] + gt_overlaps[(area, limit)]))
+      # compute recall for each iou threshold
+      recalls = (_gt_overlaps[np.newaxis, :] >=
+                 np.asarray(thresholds)[:, np.newaxis]).sum(axis=1) / float(num_pos[area])
+      # ar = 2 * np.trapz(recalls, thresholds)
+      ar = recalls.mean()
+      results[(area, limit)] = {'ar': ar, 'recalls': recalls,
+                                'thresholds': thresholds,
+                                'gt_overlaps': _gt_overlaps}
+    return results
 
   def create_roidb_from_box_list(self, box_list, gt_roidb):
     assert len(box_list) == self.num_images, \
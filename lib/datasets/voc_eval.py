@@ -12,6 +12,11 @@ import os
 import pickle
 import numpy as np
 import json
+import multiprocessing
+from collections import OrderedDict
+
+from .detection_store import DetectionStore
+from .gt_index import GTIndex
 
 def parse_rec_voc(filename):
   """ Parse a PASCAL VOC xml file """
@@ -135,40 +140,177 @@ def voc_ap(rec, prec, use_07_metric=False):
     ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
   return ap
 
+# Area ranges of the ground truth, as in imdb.evaluate_recall
+AREA_RANGES = OrderedDict([('all', [0 ** 2, 1e5 ** 2]),
+                           ('small', [0 ** 2, 32 ** 2]),
+                           ('medium', [32 ** 2, 96 ** 2]),
+                           ('large', [96 ** 2, 1e5 ** 2])])
+
+# KITTI difficulty levels: the hardest diffLev (see parse_rec_KITTI) that
+# counts, and the minimum height of a detection that is not ignored
+KITTI_LEVELS = OrderedDict([('easy', (1, 40)),
+                            ('moderate', (2, 25)),
+                            ('hard', (3, 25))])
+
+# Overlap thresholds averaged by the COCO AP@[.5:.95]
+COCO_OVTHRESHS = [round(0.5 + 0.05 * i, 2) for i in range(10)]
+
+
+def box_areas(boxes):
+  boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+  return (boxes[:, 2] - boxes[:, 0] + 1.) * (boxes[:, 3] - boxes[:, 1] + 1.)
+
+
+def ignored_gt(setting, R):
+  """Mask of the ground truth boxes of R left out of the evaluation
+  setting: 'all', an area range of AREA_RANGES or a level of KITTI_LEVELS.
+  Difficult boxes are always left out."""
+  ignore = np.asarray(R['difficult']).astype(np.bool_)
+  if setting in KITTI_LEVELS:
+    level, _ = KITTI_LEVELS[setting]
+    ignore = ignore | (R['diffLev'] == 0) | (R['diffLev'] > level)
+  elif setting != 'all':
+    lo, hi = AREA_RANGES[setting]
+    area = box_areas(R['bbox'])
+    ignore = ignore | (area < lo) | (area > hi)
+  return ignore
+
+
+def ignored_detections(setting, BB):
+  """Mask of the detections that are not counted as false positives in the
+  evaluation setting when they match nothing, because they are out of its
+  area range or below the minimum height of its KITTI level."""
+  if setting in KITTI_LEVELS:
+    _, min_height = KITTI_LEVELS[setting]
+    return BB[:, 3] - BB[:, 1] < min_height
+  elif setting != 'all':
+    lo, hi = AREA_RANGES[setting]
+    area = box_areas(BB)
+    return (area < lo) | (area > hi)
+  return np.zeros(BB.shape[0], dtype=np.bool_)
+
+
+def best_overlaps(image_ids, BB, class_recs):
+  """ovmax, gt_ind, gt = best_overlaps(image_ids, BB, class_recs)
+
+  Find the ground truth box each detection overlaps most, computing one
+  overlap matrix per image. gt_ind numbers the boxes of all the images, and
+  gt holds every field of class_recs (bbox, difficult, ...) for the best
+  box of each detection.
+  """
+  nd = len(image_ids)
+  ovmax = np.full(nd, -np.inf)
+  gt_ind = np.full(nd, -1, dtype=np.int64)
+  gt = {'bbox': np.zeros((nd, 4)), 'difficult': np.zeros(nd, dtype=np.bool_)}
+  # the other fields, even when no image has a box
+  for R in list(class_recs.values())[:1]:
+    for key, value in R.items():
+      value = np.asarray(value)
+      if key not in gt:
+        gt[key] = np.zeros((nd,) + value.shape[1:], dtype=value.dtype)
+
+  # group the detections by image, keeping their order within an image
+  imagenames, image_inds = np.unique(np.array(image_ids), return_inverse=True)
+  order = np.argsort(image_inds, kind='mergesort')
+  ends = np.cumsum(np.bincount(image_inds, minlength=len(imagenames)))
+  num_gt = 0
+  for i, imagename in enumerate(imagenames):
+    inds = order[(ends[i - 1] if i > 0 else 0):ends[i]]
+    R = class_recs[imagename]
+    BBGT = R['bbox'].astype(float)
+    if BBGT.size == 0:
+      continue
+    bb = BB[inds, :].astype(float)
+
+    # compute overlaps
+    # intersection
+    ixmin = np.maximum(BBGT[np.newaxis, :, 0], bb[:, 0:1])
+    iymin = np.maximum(BBGT[np.newaxis, :, 1], bb[:, 1:2])
+    ixmax = np.minimum(BBGT[np.newaxis, :, 2], bb[:, 2:3])
+    iymax = np.minimum(BBGT[np.newaxis, :, 3], bb[:, 3:4])
+    iw = np.maximum(ixmax - ixmin + 1., 0.)
+    ih = np.maximum(iymax - iymin + 1., 0.)
+    inters = iw * ih
+
+    # union
+    uni = ((bb[:, 2:3] - bb[:, 0:1] + 1.) * (bb[:, 3:4] - bb[:, 1:2] + 1.) +
+           (BBGT[np.newaxis, :, 2] - BBGT[np.newaxis, :, 0] + 1.) *
+           (BBGT[np.newaxis, :, 3] - BBGT[np.newaxis, :, 1] + 1.) - inters)
+
+    overlaps = inters / uni
+    jmax = np.argmax(overlaps, axis=1)
+    ovmax[inds] = np.max(overlaps, axis=1)
+    gt_ind[inds] = num_gt + jmax
+    for key, value in R.items():
+      value = BBGT if key == 'bbox' else np.asarray(value)
+      gt[key][inds] = value[jmax]
+    num_gt += BBGT.shape[0]
+
+  return ovmax, gt_ind, gt
+
+
+def greedy_match(hit, gt_ind, gt_ignore, det_ignore=None):
+  """tp, fp, tp_ALL = greedy_match(hit, gt_ind, gt_ignore, [det_ignore])
+
+  Mark the detections, in decreasing confidence, whose best box gt_ind is
+  hit above the overlap threshold. The first detection on a box is a TP and
+  the later ones are FPs, those on an ignored box count as neither, and so
+  do the detections that hit nothing but are flagged by det_ignore.
+  """
+  nd = len(hit)
+  tp = np.zeros(nd)
+  fp = np.zeros(nd)
+  fp[~hit] = 1.
+  if det_ignore is not None:
+    fp[~hit & det_ignore] = 0.
+  # among the detections on the same box, only the first one is a TP
+  hit = np.where(hit & ~gt_ignore)[0]
+  _, first = np.unique(gt_ind[hit], return_index=True)
+  fp[hit] = 1.
+  fp[hit[first]] = 0.
+  tp[hit[first]] = 1.
 
-def voc_eval(detpath,
-             annopath,
-             imagesetfile,
-             classname,
-             cachedir,
-             ovthresh=0.5,
-             use_07_metric=False,
-             use_diff=False):
-  """rec, prec, ap = voc_eval(detpath,
-                              annopath,
-                              imagesetfile,
-                              classname,
-                              [ovthresh],
-                              [use_07_metric])
+  return tp, fp, len(hit)
 
-  Top level function that does the PASCAL VOC evaluation.
 
-  detpath: Path to detections
-      detpath.format(classname) should produce the detection results file.
-  annopath: Path to annotations
-      annopath.format(imagename) should be the xml annotations file.
-  imagesetfile: Text file containing the list of images, one image per line.
-  classname: Category name (duh)
-  cachedir: Directory for caching the annotations
-  [ovthresh]: Overlap threshold (default = 0.5)
-  [use_07_metric]: Whether to use VOC07's 11 point AP computation
-      (default False)
+def match_detections(image_ids, BB, class_recs, ovthresh):
+  """tp, fp, tp_ALL = match_detections(image_ids, BB, class_recs, ovthresh)
+
+  Mark the detections, sorted by decreasing confidence, as true or false
+  positives against the ground truth of their image in class_recs.
+
+  Each detection is compared with the GT box it overlaps most. Above
+  ovthresh, the first detection on a box is a TP and the later ones are FPs,
+  while boxes marked difficult are ignored. Since the best box of a
+  detection does not depend on the earlier matches, the overlaps are
+  computed as one matrix per image and the duplicate matches resolved at
+  once; the result is identical to going down the detections one by one.
+
+  tp_ALL is the number of detections overlapping a non-difficult box.
   """
-  # assumes detections are in detpath.format(classname)
-  # assumes annotations are in annopath.format(imagename)
-  # assumes imagesetfile is a text file with each line an image name
-  # cachedir caches the annotations in a pickle file
+  ovmax, gt_ind, gt = best_overlaps(image_ids, BB, class_recs)
+  return greedy_match(ovmax > ovthresh, gt_ind, gt['difficult'])
+
+
+def pr_curve(tp, fp, npos, use_07_metric=False):
+  """rec, prec, ap = pr_curve(tp, fp, npos, [use_07_metric])"""
+  # compute precision recall
+  fp = np.cumsum(fp)
+  tp = np.cumsum(tp)
+  rec = tp / float(npos)
+  # avoid divide by zero in case the first detection matches a difficult
+  # ground truth
+  prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+  ap = voc_ap(rec, prec, use_07_metric)
+  return rec, prec, ap
+
 
+def load_annotations(annopath, imagesetfile, cachedir):
+  """imagenames, recs = load_annotations(annopath, imagesetfile, cachedir)
+
+  Read the list of images in imagesetfile and the ground truth objects of
+  each of them, cached as a pickle in cachedir.
+  """
   if 'train' in imagesetfile:
     mode = 'train'
   if 'val' in imagesetfile:
@@ -226,6 +368,15 @@ def voc_eval(detpath,
       except:
         recs = pickle.load(f, encoding='bytes')
 
+  return imagenames, recs
+
+
+def class_ground_truth(recs, imagenames, classname, use_diff=False):
+  """class_recs, npos = class_ground_truth(recs, imagenames, classname, [use_diff])
+
+  Gather the boxes of classname in every image, and count the boxes that
+  are not difficult.
+  """
   # extract gt objects for this class
   class_recs = {}
   npos = 0
@@ -236,11 +387,112 @@ def voc_eval(detpath,
       difficult = np.array([False for x in R]).astype(np.bool)
     else:
       difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-    det = [False] * len(R)
     npos = npos + sum(~difficult)
     class_recs[imagename] = {'bbox': bbox,
-                             'difficult': difficult,
-                             'det': det}
+                             'difficult': difficult}
+
+  return class_recs, npos
+
+
+def eval_class(image_ids, confidence, BB, class_recs, npos, ovthresh=0.5,
+               use_07_metric=False):
+  """rec, prec, ap, tp_ALL = eval_class(image_ids, confidence, BB, class_recs, npos,
+                                        [ovthresh], [use_07_metric])
+
+  Evaluate the detections of one class, given as the image of each
+  detection, its score and its box.
+  """
+  nd = len(image_ids)
+  tp = np.zeros(nd)
+  fp = np.zeros(nd)
+  tp_ALL = 0
+
+  if nd > 0:
+    # sort by confidence, in the order of the original voc_eval: the ties
+    # are not broken stably, the AP depends on it
+    sorted_ind = np.argsort(-confidence)
+    BB = BB[sorted_ind, :]
+    image_ids = np.asarray(image_ids)[sorted_ind]
+
+    # go down dets and mark TPs and FPs
+    tp, fp, tp_ALL = match_detections(image_ids, BB, class_recs, ovthresh)
+
+  rec, prec, ap = pr_curve(tp, fp, npos, use_07_metric)
+  return rec, prec, ap, tp_ALL
+
+
+def eval_class_table(image_ids, confidence, BB, class_recs, ovthreshs,
+                     settings=('all',), use_07_metric=False):
+  """results = eval_class_table(image_ids, confidence, BB, class_recs, ovthreshs,
+                                [settings], [use_07_metric])
+
+  Evaluate the detections of one class at every overlap threshold and in
+  every setting ('all', the areas of AREA_RANGES, the levels of
+  KITTI_LEVELS) from a single overlap computation. A setting leaves out the
+  boxes of ignored_gt, the detections on them and the unmatched detections
+  of ignored_detections.
+
+  Returns a dict mapping (setting, ovthresh) to (rec, prec, ap, tp_ALL);
+  ('all', ovthresh) is what eval_class returns.
+  """
+  nd = len(image_ids)
+  BB = np.asarray(BB, dtype=np.float64).reshape(-1, 4)
+  if nd > 0:
+    # sort by confidence, in the order of the original voc_eval: the ties
+    # are not broken stably, the AP depends on it
+    sorted_ind = np.argsort(-confidence)
+    BB = BB[sorted_ind, :]
+    image_ids = np.asarray(image_ids)[sorted_ind]
+
+  ovmax, gt_ind, gt = best_overlaps(image_ids, BB, class_recs)
+  results = {}
+  for setting in settings:
+    gt_ignore = ignored_gt(setting, gt)
+    det_ignore = ignored_detections(setting, BB)
+    npos = sum(np.sum(~ignored_gt(setting, R)) for R in class_recs.values())
+    for ovthresh in ovthreshs:
+      tp, fp, tp_ALL = greedy_match(ovmax > ovthresh, gt_ind, gt_ignore, det_ignore)
+      rec, prec, ap = pr_curve(tp, fp, npos, use_07_metric)
+      results[(setting, ovthresh)] = (rec, prec, ap, tp_ALL)
+  return results
+
+
+def voc_eval(detpath,
+             annopath,
+             imagesetfile,
+             classname,
+             cachedir,
+             ovthresh=0.5,
+             use_07_metric=False,
+             use_diff=False):
+  """rec, prec, ap = voc_eval(detpath,
+                              annopath,
+                              imagesetfile,
+                              classname,
+                              [ovthresh],
+                              [use_07_metric])
+
+  Top level function that does the PASCAL VOC evaluation.
+
+  detpath: Path to detections
+      detpath.format(classname) should produce the detection results file.
+  annopath: Path to annotations
+      annopath.format(imagename) should be the xml annotations file.
+  imagesetfile: Text file containing the list of images, one image per line.
+  classname: Category name (duh)
+  cachedir: Directory for caching the annotations
+  [ovthresh]: Overlap threshold (default = 0.5)
+  [use_07_metric]: Whether to use VOC07's 11 point AP computation
+      (default False)
+  """
+  # assumes detections are in detpath.format(classname)
+  # assumes annotations are in annopath.format(imagename)
+  # assumes imagesetfile is a text file with each line an image name
+  # cachedir caches the annotations in a pickle file
+
+  imagenames, recs = load_annotations(annopath, imagesetfile, cachedir)
+
+  class_recs, npos = class_ground_truth(recs, imagenames, classname, use_diff)
 
   # read dets
   detfile = detpath.format(classname)
@@ -253,62 +505,344 @@ def voc_eval(detpath,
   BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
 
   nd = len(image_ids)
-  tp = np.zeros(nd)
-  fp = np.zeros(nd)
+  rec, prec, ap, tp_ALL = eval_class(image_ids, confidence, BB, class_recs, npos,
+                                     ovthresh, use_07_metric)
+  # print(tp_ALL, float(nd))
+  return rec, prec, ap, tp_ALL/float(nd)
 
-  if BB.shape[0] > 0:
-    # sort by confidence
-    sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
-    BB = BB[sorted_ind, :]
-    image_ids = [image_ids[x] for x in sorted_ind]
 
-    tp_ALL = 0
-    # go down dets and mark TPs and FPs
-    for d in range(nd):
-      R = class_recs[image_ids[d]]
-      bb = BB[d, :].astype(float)
-      ovmax = -np.inf
-      BBGT = R['bbox'].astype(float)
-
-      if BBGT.size > 0:
-        # compute overlaps
-        # intersection
-        ixmin = np.maximum(BBGT[:, 0], bb[0])
-        iymin = np.maximum(BBGT[:, 1], bb[1])
-        ixmax = np.minimum(BBGT[:, 2], bb[2])
-        iymax = np.minimum(BBGT[:, 3], bb[3])
-        iw = np.maximum(ixmax - ixmin + 1., 0.)
-        ih = np.maximum(iymax - iymin + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
-        ovmax = np.max(overlaps)
-        jmax = np.argmax(overlaps)
-
-      if ovmax > ovthresh:
-        if not R['difficult'][jmax]:
-          tp_ALL += 1
-          if not R['det'][jmax]:
-            tp[d] = 1.
-            R['det'][jmax] = 1
-          else:
-            fp[d] = 1.
-      else:
-        fp[d] = 1.
+def pack_ground_truth(recs, imagenames, classes, use_diff=False):
+  """Flatten the ground truth of imagenames into numpy arrays.
 
-  # compute precision recall
-  fp = np.cumsum(fp)
-  tp = np.cumsum(tp)
-  rec = tp / float(npos)
-  # avoid divide by zero in case the first detection matches a difficult
-  # ground truth
-  prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
-  ap = voc_ap(rec, prec, use_07_metric)
-  # print(tp_ALL, float(nd))
-  return rec, prec, ap, tp_ALL/float(nd)
+  Returns a dict of 'boxes' (M x 4), 'classes' (index in classes, -1 for
+  other names), 'difficult', 'images' (index in imagenames) and, for
+  KITTI, 'diffLev'. Worker
+  processes forked after packing share these buffers read-only, unlike
+  the nested lists of recs whose pages every access dirties.
+  """
+  if isinstance(recs, GTIndex):
+    return recs.pack(imagenames, classes, use_diff)
+  class_to_ind = dict(zip(classes, range(len(classes))))
+  boxes, gt_classes, difficult, images, diff_levs = [], [], [], [], []
+  for i, imagename in enumerate(imagenames):
+    for obj in recs[imagename]:
+      boxes.append(obj['bbox'])
+      gt_classes.append(class_to_ind.get(obj['name'], -1))
+      difficult.append(False if use_diff else bool(obj['difficult']))
+      images.append(i)
+      diff_levs.append(obj.get('diffLev', -1))
+  gt = {'boxes': np.array(boxes, dtype=np.float64).reshape(-1, 4),
+        'classes': np.array(gt_classes, dtype=np.int64),
+        'difficult': np.array(difficult, dtype=np.bool_),
+        'images': np.array(images, dtype=np.int64),
+        'num_images': len(imagenames)}
+  # the KITTI difficulty levels, when every box has one
+  if len(diff_levs) > 0 and -1 not in diff_levs:
+    gt['diffLev'] = np.array(diff_levs, dtype=np.int64)
+  return gt
+
+
+def results_file_values(scores, boxes):
+  """scores, boxes = results_file_values(scores, boxes)
+
+  The scores and the 1-based boxes of detections as the results files hold
+  them (see imdb._write_voc_results_file): the scores to 3 decimals and the
+  boxes to 1, so that the AP is that of the files. The rounding is exact
+  for the float32 detections of test_net.
+  """
+  boxes = np.asarray(boxes).reshape(-1, 4)
+  # the + 1 in the type dets[k, 0] + 1 has when the files are written
+  one_based = boxes.astype(type(boxes.dtype.type(0) + 1)) + 1
+  return (np.round(np.asarray(scores).astype(np.float64), 3),
+          np.round(one_based.astype(np.float64), 1))
+
+
+def pack_detections(all_boxes, classes):
+  """Stack all_boxes[cls] into (images, scores, boxes) arrays per class,
+  rounded to the values of the results files. all_boxes may also be a
+  DetectionStore, whose columns are sliced directly."""
+  dets = {}
+  for cls_ind, cls in enumerate(classes):
+    if cls == '__background__':
+      continue
+    if isinstance(all_boxes, DetectionStore):
+      images, scores, boxes = all_boxes.class_detections(cls_ind)
+      dets[cls_ind] = (images,) + results_file_values(scores, boxes)
+      continue
+    counts = [len(d) for d in all_boxes[cls_ind]]
+    stacked = [d for d in all_boxes[cls_ind] if len(d) > 0]
+    stacked = np.vstack(stacked) if stacked else np.zeros((0, 5), dtype=np.float32)
+    images = np.repeat(np.arange(len(counts)), counts)
+    dets[cls_ind] = (images,) + results_file_values(stacked[:, -1], stacked[:, :4])
+  return dets
+
+
+# Ground truth and detections of the running evaluation, set in the worker
+# processes by _init_eval_worker
+_eval_data = None
+
+
+def _init_eval_worker(data):
+  global _eval_data
+  _eval_data = data
+
+
+def _eval_job(job):
+  """Evaluate one class at every threshold and in every setting on
+  _eval_data."""
+  cls_ind = job
+  gt, dets, ovthreshs, settings, use_07_metric = _eval_data
+  keep = np.where(gt['classes'] == cls_ind)[0]
+  fields = [('bbox', gt['boxes']), ('difficult', gt['difficult'])]
+  if 'diffLev' in gt:
+    fields.append(('diffLev', gt['diffLev']))
+  class_recs = dict((i, dict((key, value[:0]) for key, value in fields))
+                    for i in range(gt['num_images']))
+  images = gt['images'][keep]
+  for i in np.unique(images):
+    inds = keep[images == i]
+    class_recs[i] = dict((key, value[inds]) for key, value in fields)
+
+  image_ids, confidence, BB = dets[cls_ind]
+  results = eval_class_table(image_ids, confidence, BB, class_recs, ovthreshs,
+                             settings, use_07_metric)
+  nd = float(max(len(image_ids), 1))
+  return cls_ind, dict((key, (rec, prec, ap, tp_ALL / nd))
+                       for key, (rec, prec, ap, tp_ALL) in results.items())
+
+
+def eval_sweep(all_boxes, classes, imagenames, recs, ovthreshs=(0.5,),
+               use_07_metric=False, use_diff=False, num_workers=1,
+               settings=('all',)):
+  """results = eval_sweep(all_boxes, classes, imagenames, recs, [ovthreshs],
+                          [use_07_metric], [use_diff], [num_workers], [settings])
+
+  Evaluate every class at every overlap threshold in ovthreshs and in every
+  setting of eval_class_table, straight from the detections of test_net.
+  Each class is one job, whose overlaps are computed once for all the
+  thresholds and settings; the jobs run on a pool of num_workers processes
+  (0 for one per core). The packed ground truth and detections are handed
+  to the workers once, and shared with them when processes are forked.
+
+  Returns an OrderedDict mapping (class, setting, ovthresh) to (rec, prec,
+  ap, tp_ALL / number of detections), in the order of classes.
+  """
+  gt = pack_ground_truth(recs, imagenames, classes, use_diff)
+  dets = pack_detections(all_boxes, classes)
+  data = (gt, dets, list(ovthreshs), list(settings), use_07_metric)
+  # the largest classes first, so that they do not finish last
+  jobs = sorted(dets, key=lambda c: -len(dets[c][0]))
+
+  if num_workers == 0:
+    num_workers = multiprocessing.cpu_count()
+  num_workers = min(num_workers, len(jobs))
+  if num_workers > 1:
+    pool = multiprocessing.Pool(num_workers, initializer=_init_eval_worker,
+                                initargs=(data,))
+    try:
+      done = dict(pool.imap_unordered(_eval_job, jobs))
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    _init_eval_worker(data)
+    done = dict(_eval_job(job) for job in jobs)
+    _init_eval_worker(None)
+
+  results = OrderedDict()
+  for cls_ind, cls in enumerate(classes):
+    if cls_ind in dets:
+      for setting in settings:
+        for ovthresh in ovthreshs:
+          results[(cls, setting, ovthresh)] = done[cls_ind][(setting, ovthresh)]
+  return results
+
+
+def eval_all_boxes(all_boxes, classes, imagenames, recs, ovthresh=0.5,
+                   use_07_metric=False, use_diff=False, num_workers=1):
+  """results = eval_all_boxes(all_boxes, classes, imagenames, recs,
+                              [ovthresh], [use_07_metric], [use_diff])
+
+  Evaluate every class straight from the detections of test_net, without
+  going through the results text files.
+
+  all_boxes[cls][image] is an N x 5 array of detections (x1, y1, x2, y2,
+  score) of the image imagenames[image], and recs the ground truth of
+  load_annotations. Returns an OrderedDict mapping every class but the
+  background to (rec, prec, ap, tp_ALL / number of detections), as
+  voc_eval does.
+  """
+  results = eval_sweep(all_boxes, classes, imagenames, recs, (ovthresh,),
+                       use_07_metric, use_diff, num_workers)
+  return OrderedDict((cls, r) for (cls, _, _), r in results.items())
+
+
+class _GrowingArray(object):
+  """A numpy array appended to in chunks, doubling its buffer when full."""
+
+  def __init__(self, shape=(), dtype=np.float64):
+    self._buffer = np.zeros((16,) + tuple(shape), dtype=dtype)
+    self._size = 0
+
+  def append(self, values):
+    n = len(values)
+    if self._size + n > len(self._buffer):
+      capacity = max(2 * len(self._buffer), self._size + n)
+      buffer = np.zeros((capacity,) + self._buffer.shape[1:], dtype=self._buffer.dtype)
+      buffer[:self._size] = self._buffer[:self._size]
+      self._buffer = buffer
+    self._buffer[self._size:self._size + n] = values
+    self._size += n
+
+  @property
+  def array(self):
+    return self._buffer[:self._size]
+
+
+class IncrementalEvaluator(object):
+  """Evaluate the detections of test_net image by image, as they come.
+
+  Since a detection can only match the ground truth of its own image, the
+  overlaps of the detections of an image are computed as soon as it is
+  added. The evaluator then only keeps, for each detection, its score,
+  image, best overlap and best ground truth box, and whether the settings
+  ignore them, instead of its box. The greedy matching waits for the
+  results: the detections are sorted as eval_sweep sorts them, so that the
+  ties are broken the same way and the results are those of eval_sweep on
+  the same detections.
+  """
+
+  def __init__(self, classes, imagenames, recs, ovthreshs=(0.5,),
+               use_07_metric=False, use_diff=False, settings=('all',)):
+    self.classes = classes
+    self.ovthreshs = list(ovthreshs)
+    self.settings = list(settings)
+    self.use_07_metric = use_07_metric
+    self.keys = [(setting, t) for setting in self.settings for t in self.ovthreshs]
+    self._gt = pack_ground_truth(recs, imagenames, classes, use_diff)
+    # the ground truth is packed in the order of the images
+    self._gt_starts = np.searchsorted(self._gt['images'],
+                                      np.arange(len(imagenames) + 1))
+    self._fields = [('bbox', self._gt['boxes']), ('difficult', self._gt['difficult'])]
+    if 'diffLev' in self._gt:
+      self._fields.append(('diffLev', self._gt['diffLev']))
+    self._class_inds = [c for c, cls in enumerate(classes) if cls != '__background__']
+
+    self._npos = {}
+    self._npos_seen = {}
+    for c in self._class_inds:
+      R = self._class_recs(0, len(self._gt['classes']), c)
+      for setting in self.settings:
+        self._npos[(c, setting)] = np.sum(~ignored_gt(setting, R))
+        self._npos_seen[(c, setting)] = 0
+    self._images = dict((c, _GrowingArray(dtype=np.int64)) for c in self._class_inds)
+    self._scores = dict((c, _GrowingArray()) for c in self._class_inds)
+    self._overlaps = dict((c, _GrowingArray()) for c in self._class_inds)
+    self._gt_inds = dict((c, _GrowingArray(dtype=np.int64)) for c in self._class_inds)
+    # ignored_gt of the best box and ignored_detections, per setting
+    self._ignored = dict((c, _GrowingArray((len(self.settings), 2), np.bool_))
+                         for c in self._class_inds)
+    self.num_images = 0
+
+  def _class_recs(self, start, stop, c):
+    """The ground truth of the class c among the rows start:stop."""
+    inds = start + np.where(self._gt['classes'][start:stop] == c)[0]
+    return dict((key, value[inds]) for key, value in self._fields)
+
+  def add(self, i, dets):
+    """Add the detections of the image i: dets[cls] is the N x 5 array
+    (x1, y1, x2, y2, score) of the class, all_boxes[cls][i] of test_net."""
+    start, stop = self._gt_starts[i], self._gt_starts[i + 1]
+    for c in self._class_inds:
+      R = self._class_recs(start, stop, c)
+      for setting in self.settings:
+        self._npos_seen[(c, setting)] += np.sum(~ignored_gt(setting, R))
+      d = np.asarray(dets[c]).reshape(-1, 5)
+      if d.shape[0] == 0:
+        continue
+      scores, BB = results_file_values(d[:, 4], d[:, :4])
+      ovmax, gt_ind, gt = best_overlaps(np.zeros(len(BB), dtype=np.int64), BB, {0: R})
+      ignored = np.zeros((len(BB), len(self.settings), 2), dtype=np.bool_)
+      for k, setting in enumerate(self.settings):
+        ignored[:, k, 0] = ignored_gt(setting, gt)
+        ignored[:, k, 1] = ignored_detections(setting, BB)
+      self._images[c].append(np.full(len(BB), i, dtype=np.int64))
+      self._scores[c].append(scores)
+      self._overlaps[c].append(ovmax)
+      # numbered among the boxes of all the images
+      self._gt_inds[c].append(np.where(gt_ind >= 0, start + gt_ind, -1))
+      self._ignored[c].append(ignored)
+    self.num_images += 1
+
+  def _eval(self, c, keys, npos):
+    # the order of pack_detections: by image, then as they came in the image
+    order = np.argsort(self._images[c].array, kind='mergesort')
+    confidence = self._scores[c].array[order]
+    # sort by confidence, as eval_class_table does
+    order = order[np.argsort(-confidence)]
+    ovmax = self._overlaps[c].array[order]
+    gt_ind = self._gt_inds[c].array[order]
+    ignored = self._ignored[c].array[order]
+    nd = float(max(len(order), 1))
+    results = {}
+    for setting, ovthresh in keys:
+      k = self.settings.index(setting)
+      tp, fp, tp_ALL = greedy_match(ovmax > ovthresh, gt_ind, ignored[:, k, 0], ignored[:, k, 1])
+      rec, prec, ap = pr_curve(tp, fp, npos[(c, setting)], self.use_07_metric)
+      results[(setting, ovthresh)] = (rec, prec, ap, tp_ALL / nd)
+    return results
+
+  def mean_ap(self, setting='all', ovthresh=None):
+    """Mean AP of the images added so far, at ovthresh (by default the
+    first threshold)."""
+    if ovthresh is None:
+      ovthresh = self.ovthreshs[0]
+    key = (setting, ovthresh)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      aps = [self._eval(c, [key], self._npos_seen)[key][2] for c in self._class_inds]
+    return np.nanmean(aps) if not np.isnan(aps).all() else np.nan
+
+  def results(self):
+    """Evaluate every class in every setting at every threshold, counting
+    the ground truth of all the images. Returns the OrderedDict of
+    eval_sweep."""
+    results = OrderedDict()
+    for c in self._class_inds:
+      done = self._eval(c, self.keys, self._npos)
+      for key in self.keys:
+        results[(self.classes[c],) + key] = done[key]
+    return results
+
+
+def summarize(results, classes, ovthresh=0.5):
+  """table = summarize(results, classes, [ovthresh])
+
+  Build and print the AP table of the results of eval_sweep, one row per
+  class and a mean row: AP (averaged over COCO_OVTHRESHS), AP50, AP75,
+  APs/APm/APl (averaged over COCO_OVTHRESHS) and the KITTI easy, moderate
+  and hard AP at ovthresh, for the columns the results cover. Returns an
+  OrderedDict mapping every column to the list of class APs, the mean last.
+  Classes without ground truth in a setting have a nan AP there and are left
+  out of its mean.
+  """
+  classes = [cls for cls in classes if cls != '__background__']
+  evaluated = set((setting, t) for (_, setting, t) in results)
+
+  def mean_ap(cls, setting, ovthreshs):
+    return np.mean([results[(cls, setting, t)][2] for t in ovthreshs])
+
+  columns = [('AP', 'all', COCO_OVTHRESHS), ('AP50', 'all', [0.5]), ('AP75', 'all', [0.75]),
+             ('APs', 'small', COCO_OVTHRESHS), ('APm', 'medium', COCO_OVTHRESHS),
+             ('APl', 'large', COCO_OVTHRESHS)]
+  columns += [(level, level, [ovthresh]) for level in KITTI_LEVELS]
+  table = OrderedDict()
+  for name, setting, ovthreshs in columns:
+    if all((setting, t) in evaluated for t in ovthreshs):
+      aps = [mean_ap(cls, setting, ovthreshs) for cls in classes]
+      table[name] = aps + [np.nanmean(aps) if not np.isnan(aps).all() else np.nan]
+
+  print(('{:>15s}' + ' {:>8s}' * len(table)).format('', *table.keys()))
+  for i, cls in enumerate(classes + ['mean']):
+    print(('{:>15s}' + ' {:8.4f}' * len(table)).format(
+      cls, *[aps[i] for aps in table.values()]))
+  return table
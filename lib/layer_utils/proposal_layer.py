@@ -26,32 +26,41 @@ def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride,
   post_nms_topN = cfg[cfg_key].RPN_POST_NMS_TOP_N
   nms_thresh = cfg[cfg_key].RPN_NMS_THRESH
 
-  # Get the scores and bounding boxes
-  scores = rpn_cls_prob[:, :, :, num_anchors:]
-  rpn_bbox_pred = rpn_bbox_pred.view((-1, 4))
-  scores = scores.contiguous().view(-1, 1)
-  proposals = bbox_transform_inv(anchors, rpn_bbox_pred)
-  proposals = clip_boxes(proposals, im_info[:2])
-
-  # Pick the top region proposals
-  scores, order = scores.view(-1).sort(descending=True)
-  if pre_nms_topN > 0:
-    order = order[:pre_nms_topN]
-    scores = scores[:pre_nms_topN].view(-1, 1)
-  proposals = proposals[order.data, :]
+  blobs = []
+  blob_scores = []
+  # Proposals are generated image by image, the batch index of each image
+  # goes to the first column of the rois blob
+  for i in range(rpn_cls_prob.size(0)):
+    # Get the scores and bounding boxes
+    scores = rpn_cls_prob[i:i+1, :, :, num_anchors:]
+    bbox_pred = rpn_bbox_pred[i:i+1].contiguous().view((-1, 4))
+    scores = scores.contiguous().view(-1, 1)
+    proposals = bbox_transform_inv(anchors, bbox_pred)
+    proposals = clip_boxes(proposals, im_info[i, :2])
 
-  # Non-maximal suppression
-  keep = nms(torch.cat((proposals, scores), 1).data, nms_thresh) #error
+    # Pick the top region proposals
+    scores, order = scores.view(-1).sort(descending=True)
+    if pre_nms_topN > 0:
+      order = order[:pre_nms_topN]
+      scores = scores[:pre_nms_topN]
+    scores = scores.view(-1, 1)
+    proposals = proposals[order.data, :]
 
-  # Pick the top region proposals after NMS
-  if post_nms_topN > 0:
-    keep = keep[:post_nms_topN]
-  proposals = proposals[keep, :]
-  scores = scores[keep,]
+    # Non-maximal suppression
+    keep = nms(torch.cat((proposals, scores), 1).data, nms_thresh) #error
 
-  # Only support single image as input
-  batch_inds = Variable(proposals.data.new(proposals.size(0), 1).zero_())
-  blob = torch.cat((batch_inds, proposals), 1)
+    # Pick the top region proposals after NMS
+    if post_nms_topN > 0:
+      keep = keep[:post_nms_topN]
+    proposals = proposals[keep, :]
+    scores = scores[keep,]
+
+    batch_inds = Variable(proposals.data.new(proposals.size(0), 1).fill_(i))
+    blobs.append(torch.cat((batch_inds, proposals), 1))
+    blob_scores.append(scores)
+
+  blob = torch.cat(blobs, 0)
+  scores = torch.cat(blob_scores, 0)
 
   return blob, scores
 
@@ -73,7 +82,7 @@ def proposal_layer_fpn(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stri
     rpn_bbox_pred[idx] = rpn_bbox_pred[idx].view((-1, 4))
     scores = scores.contiguous().view(-1, 1)
     proposals = bbox_transform_inv(anchors[idx], rpn_bbox_pred[idx])
-    proposals = clip_boxes(proposals, im_info[:2])
+    proposals = clip_boxes(proposals, im_info[0, :2])
     
     # Pick the top region proposals
     scores, order = scores.view(-1).sort(descending=True)
@@ -18,10 +18,13 @@ from utils.bbox import bbox_overlaps
 import torch
 from torch.autograd import Variable
 
-def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes):
+def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes, im_ind=0, num_images=1):
   """
   Assign object detection proposals to ground-truth targets. Produces proposal
   classification labels and bounding-box regression targets.
+
+  rpn_rois and gt_boxes belong to the single image im_ind of a minibatch of
+  num_images images, cfg.TRAIN.BATCH_SIZE is split evenly among them.
   """
 
   # Proposal ROIs (0, x1, y1, x2, y2) coming from RPN
@@ -31,14 +34,14 @@ def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes):
 
   # Include ground-truth boxes in the set of candidate rois
   if cfg.TRAIN.USE_GT:
-    zeros = rpn_rois.data.new(gt_boxes.shape[0], 1)
+    zeros = rpn_rois.data.new(gt_boxes.shape[0], 1).zero_()
+    batch_inds = rpn_rois.data.new(gt_boxes.shape[0], 1).fill_(im_ind)
     all_rois = torch.cat(
-      (all_rois, torch.cat((zeros, gt_boxes[:, :-1]), 1))
+      (all_rois, torch.cat((batch_inds, gt_boxes[:, :-1]), 1))
     , 0)
     # not sure if it a wise appending, but anyway i am not using it
     all_scores = torch.cat((all_scores, zeros), 0)
 
-  num_images = 1
   rois_per_image = cfg.TRAIN.BATCH_SIZE / num_images
   fg_rois_per_image = int(round(cfg.TRAIN.FG_FRACTION * rois_per_image))
 
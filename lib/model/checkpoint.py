@@ -0,0 +1,154 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+# A compact checkpoint is an array file (see utils.array_file) whose
+# sections are the top level modules of the network
+from utils.array_file import ArrayFile, save_arrays, is_compact, section_of
+
+
+class LazyStateDict(ArrayFile):
+  """State dict of a compact checkpoint, whose tensors are created from the
+  memory-mapped arrays on lookup."""
+  def __getitem__(self, name):
+    return torch.from_numpy(ArrayFile.__getitem__(self, name))
+
+
+def save_checkpoint(state_dict, filename, compact=False, half=False):
+  """Save a host state dict with torch.save, or in the compact format."""
+  if not compact:
+    torch.save(state_dict, filename)
+  else:
+    save_arrays([(k, v.numpy()) for k, v in state_dict.items()], filename, half=half)
+
+
+def load_checkpoint(filename, exclude=()):
+  """Load a state dict saved by either format, without the sections (top
+  level modules) in exclude. Compact checkpoints are loaded lazily."""
+  if is_compact(filename):
+    return LazyStateDict(filename, exclude)
+  state_dict = torch.load(filename)
+  return OrderedDict((k, v) for k, v in state_dict.items() if section_of(k) not in exclude)
+
+
+def shared_checkpoint(filename, cache_dir, exclude=()):
+  """The path of a compact copy of the checkpoint filename without the
+  sections in exclude, for processes that share its memory-mapped pages.
+
+  A compact checkpoint already is one; a torch.save snapshot is converted
+  once into cache_dir, under a name that changes with the snapshot.
+  """
+  if is_compact(filename):
+    return filename
+  st = os.stat(filename)
+  path = os.path.join(cache_dir, '{:s}.{:d}.{:d}.{:s}.compact'.format(
+    os.path.basename(filename), st.st_size, int(st.st_mtime),
+    '-'.join(sorted(exclude)) or 'all'))
+  if not os.path.exists(path):
+    # on the host, so the caller may still fork before CUDA is initialized
+    state_dict = torch.load(filename, map_location=lambda storage, loc: storage)
+    save_checkpoint(OrderedDict((k, v) for k, v in state_dict.items()
+                                if section_of(k) not in exclude),
+                    path + '.tmp', compact=True)
+    os.rename(path + '.tmp', path)
+  return path
+
+
+def cpu_state_dict(state_dict):
+  """Copy a state dict to host memory, so the copy no longer changes with
+  the training parameters."""
+  return OrderedDict((k, v.cpu() if v.is_cuda else v.clone())
+                     for k, v in state_dict.items())
+
+
+class CheckpointWriter(object):
+  """Writes snapshots and removes old ones on a background thread.
+
+  The caller only pays for the copy of the weights to host memory; the
+  serialization, the disk writes and the deletions happen in the order they
+  were queued. Every file is written under a temporary name and renamed when
+  complete, so a crash never leaves a truncated snapshot behind.
+  """
+  def __init__(self, compact=False, half=False, max_pending=1):
+    self._compact = compact
+    self._half = half
+    # Each pending snapshot holds a full copy of the weights in host memory
+    self._jobs = queue.Queue(maxsize=max_pending)
+    self._error = None
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def save(self, filename, state_dict, nfilename, meta):
+    """Queue the weights for filename and the objects of meta, pickled one
+    after the other, for nfilename."""
+    self._raise_error()
+    self._jobs.put((self._write, (filename, cpu_state_dict(state_dict), nfilename, list(meta))))
+
+  def remove(self, paths):
+    """Queue the deletion of paths, after every snapshot queued before."""
+    self._raise_error()
+    self._jobs.put((self._remove, (list(paths),)))
+
+  def flush(self):
+    """Block until every queued job is done."""
+    self._jobs.join()
+    self._raise_error()
+
+  def close(self):
+    self.flush()
+    self._jobs.put(None)
+    self._thread.join()
+
+  def _raise_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def _run(self):
+    while True:
+      job = self._jobs.get()
+      try:
+        if job is None:
+          return
+        func, args = job
+        func(*args)
+      except Exception as e:
+        self._error = e
+      finally:
+        self._jobs.task_done()
+
+  def _write(self, filename, state_dict, nfilename, meta):
+    tmp = filename + '.tmp'
+    save_checkpoint(state_dict, tmp, compact=self._compact, half=self._half)
+    ntmp = nfilename + '.tmp'
+    with open(ntmp, 'wb') as fid:
+      for obj in meta:
+        pickle.dump(obj, fid, pickle.HIGHEST_PROTOCOL)
+    # the weights last, so that a snapshot whose weights exist is complete
+    os.rename(ntmp, nfilename)
+    os.rename(tmp, filename)
+    print('Wrote snapshot to: {:s}'.format(filename))
+
+  def _remove(self, paths):
+    for path in paths:
+      if os.path.exists(path):
+        os.remove(path)
@@ -60,8 +60,8 @@ __C.TRAIN.BIAS_DECAY = False
 # Whether to add ground truth boxes to the pool when sampling regions
 __C.TRAIN.USE_GT = False
 
-# Whether to use aspect-ratio grouping of training images, introduced merely for saving
-# GPU memory
+# Whether to use aspect-ratio grouping of training images, so that the images of a
+# minibatch (IMS_PER_BATCH > 1) share an orientation and need little padding
 __C.TRAIN.ASPECT_GROUPING = False
 
 # The number of snapshots kept, older ones are deleted to save space
@@ -77,7 +77,9 @@ __C.TRAIN.SCALES = (500,)#(600,)
 # Max pixel size of the longest side of a scaled input image
 __C.TRAIN.MAX_SIZE = 1000
 
-# Images to use per minibatch
+# Images to use per minibatch, they are padded into a single blob and BATCH_SIZE
+# is split evenly among them (must divide BATCH_SIZE); 1 when the synthetic
+# source images are weighted by their discriminator score (D_T_score)
 __C.TRAIN.IMS_PER_BATCH = 1
 
 # Minibatch size (number of regions of interest [ROIs])
@@ -111,6 +113,14 @@ __C.TRAIN.SNAPSHOT_ITERS = 10000
 # infix to yield the path: <prefix>[_<infix>]_iters_XYZ.caffemodel
 __C.TRAIN.SNAPSHOT_PREFIX = 'vgg16_faster_rcnn'
 
+# Format of the snapshots: 'torch' for torch.save, or 'compact' for a file
+# with one section per module that can be memory-mapped and partially loaded
+__C.TRAIN.SNAPSHOT_FORMAT = 'torch'
+
+# Store the weights of compact snapshots in half precision, this halves their
+# size but training resumed from them starts from the rounded weights
+__C.TRAIN.SNAPSHOT_HALF = False
+
 # Normalize the targets (subtract empirical mean, divide by empirical stddev)
 __C.TRAIN.BBOX_NORMALIZE_TARGETS = True
 
@@ -171,22 +181,59 @@ __C.TRAIN.RPN_POSITIVE_WEIGHT = -1.0
 # For COCO, setting USE_ALL_GT to False will exclude boxes that are flagged as ''iscrowd''
 __C.TRAIN.USE_ALL_GT = True
 
+# Derive CROP_BAND from the ground truth boxes of the training roidb: the
+# band holding the top and bottom edges of TRAIN.CROP_BAND_COVERAGE of the
+# boxes, widened by TRAIN.CROP_BAND_MARGIN of the image height
+__C.TRAIN.CROP_BAND_AUTO = False
+
+__C.TRAIN.CROP_BAND_COVERAGE = 0.99
+
+__C.TRAIN.CROP_BAND_MARGIN = 0.02
+
+# The ground truth boxes of a training image cropped to CROP_BAND are kept
+# when at least this fraction of their height is in the band; an image
+# without any such box is not cropped
+__C.TRAIN.CROP_BAND_MIN_VISIBLE = 0.5
+
 #
 # Testing options
 #
 __C.TEST = edict()
 
-# Scale to use during testing (can NOT list multiple scales)
-# The scale is the pixel size of an image's shortest side
+# Scale to use during testing
+# The scale is the pixel size of an image's shortest side; with several
+# scales, the rescaled images are detected together and their detections
+# merged (multi-scale test-time augmentation)
 __C.TEST.SCALES = (500,)#(600,)
 
 # Max pixel size of the longest side of a scaled input image
 __C.TEST.MAX_SIZE = 1000
 
+# Also detect in the horizontally flipped images, batched with the images
+# (test-time augmentation)
+__C.TEST.FLIP = False
+
+# Images per forward pass of im_detect_batch; the images of a batch are
+# grouped by size and padded into a single blob
+__C.TEST.IMS_PER_BATCH = 1
+
+# Threads of test_net reading and preprocessing the images ahead of the
+# network
+__C.TEST.LOADER_THREADS = 4
+
+# Images the stages of test_net may hold for the next stage: preprocessed
+# images waiting for the network, outputs waiting for post-processing
+__C.TEST.PIPELINE_DEPTH = 8
+
 # Overlap threshold used for non-maximum suppression (suppress boxes with
 # IoU >= this threshold)
 __C.TEST.NMS = 0.3
 
+# Replace the boxes kept by the NMS by the score-weighted average of the
+# boxes overlapping them by this IoU at least (box voting, e.g. to merge
+# the detections of test-time augmentation); 0 to disable
+__C.TEST.BBOX_VOTE = 0.
+
 # Experimental: treat the (K+1) units in the cls_score layer as linear
 # predictors (trained, eg, with one-vs-rest SVMs).
 __C.TEST.SVM = False
@@ -219,6 +266,84 @@ __C.TEST.MODE = 'nms'
 # Only useful when TEST.MODE is 'top', specifies the number of top proposals to select
 __C.TEST.RPN_TOP_N = 5000
 
+# Send to the second stage only the proposals whose RPN objectness is at
+# least TEST.RPN_SCORE_THRESH, the best TEST.RPN_MIN_PROPOSALS at least and
+# TEST.RPN_MAX_PROPOSALS at most; an image without such proposal skips the
+# second stage and has no detection (see tools/proposal_budget.py)
+__C.TEST.RPN_ADAPTIVE = False
+
+__C.TEST.RPN_SCORE_THRESH = 0.5
+
+__C.TEST.RPN_MIN_PROPOSALS = 16
+
+__C.TEST.RPN_MAX_PROPOSALS = 300
+
+# Overlap thresholds the detections are evaluated at; the first one gives the
+# reported AP, the others are added to the <class>_pr.pkl files
+__C.TEST.EVAL_OVTHRESHS = [0.5]
+
+# Also report the COCO style AP@[.5:.95], AP75 and AP of small, medium and
+# large objects, all derived from the same overlaps
+__C.TEST.EVAL_COCO = True
+
+# Number of processes evaluating the classes, each at every overlap threshold
+# and setting from one overlap computation, 0 for one per core
+__C.TEST.EVAL_WORKERS = 0
+
+# Evaluate the detections of every image as test_net produces them, instead
+# of all_boxes once every image is done
+__C.TEST.STREAM_EVAL = True
+
+# Print the running mAP of the streaming evaluation every so many images,
+# 0 to only print the final results
+__C.TEST.EVAL_DISPLAY = 500
+
+# Keep the detections and write them to detections.dets (for tools/reval.py)
+# even when they are evaluated as they come; without it only the compact
+# state of the evaluation is kept in memory
+__C.TEST.SAVE_DETECTIONS = True
+
+# Save the raw scores and boxes of every image to raw_outputs.arr, so that
+# tools/sweep_postprocess.py can try other thresholds, NMS and
+# max_per_image settings without running the network again
+__C.TEST.SAVE_RAW_OUTPUTS = False
+
+# Directory of the on-disk cache of the backbone feature maps (float16) of
+# the test images, keyed by image and backbone weights, so that snapshots
+# sharing the backbone only run the heads; empty to disable. Only images
+# run one at a time are cached: it needs TEST.IMS_PER_BATCH 1, and neither
+# TEST.TILE nor test-time augmentation
+__C.TEST.FEATURE_CACHE = ''
+
+# Cache the RPN outputs too, so that runs of the same backbone and RPN (e.g.
+# trying RPN_POST_NMS_TOP_N or TEST.MODE) only redo the proposals and heads
+__C.TEST.FEATURE_CACHE_RPN = False
+
+# Detect in overlapping tiles of the image at TEST.TILE_SCALE instead of in
+# the image downscaled to TEST.SCALES, for the small objects the downscaling
+# loses; the detections of the tiles are merged by the per-class NMS
+__C.TEST.TILE = False
+
+# Scale of the tiled image, relative to the original image
+__C.TEST.TILE_SCALE = 1.0
+
+# Side of the square tiles, in pixels of the tiled image, unless derived
+# from TEST.TILE_MEMORY; more than twice TEST.TILE_OVERLAP
+__C.TEST.TILE_SIZE = 800
+
+# Peak memory of the device (MB) the forward passes of TEST.IMS_PER_BATCH
+# tiles may take: the largest tiles within it are measured once, 0 to use
+# TEST.TILE_SIZE
+__C.TEST.TILE_MEMORY = 0
+
+# Overlap of neighbouring tiles, in pixels of the tiled image: the objects
+# smaller than it are found whole in a tile
+__C.TEST.TILE_OVERLAP = 128
+
+# Also detect in the whole image at TEST.SCALES, for the objects larger
+# than the tiles
+__C.TEST.TILE_GLOBAL = True
+
 #
 # ResNet options
 #
@@ -263,6 +388,14 @@ __C.MOBILENET.DEPTH_MULTIPLIER = 1.
 # they were trained with
 __C.PIXEL_MEANS = np.array([[[102.9801, 115.9465, 122.7717]]])
 
+# Rows of the images the network sees, as a [top, bottom] pair of fractions
+# of the image height (e.g. [0.35, 0.9] drops the sky and the hood of
+# driving datasets), in training and testing. The images are cropped before
+# they are resized, at the scale of the whole image, so the backbone runs on
+# fewer pixels; the detections are mapped back to the whole image. Empty for
+# the whole image (see also TRAIN.CROP_BAND_AUTO)
+__C.CROP_BAND = []
+
 # For reproducibility
 __C.RNG_SEED = 3
 
@@ -295,6 +428,9 @@ __C.ANCHOR_RATIOS = [0.5,1,2]
 # Number of filters for the RPN layer
 __C.RPN_CHANNELS = 512
 
+# Whether the resnet backbone builds a feature pyramid (see FPNres50.yml)
+__C.FPN = False
+
 
 def get_output_dir(imdb, weights_filename):
   """Return the directory where experimental artifacts are placed.
@@ -0,0 +1,114 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+
+import numpy as np
+
+from utils.array_file import ArrayFile, save_arrays
+
+# The cache keeps one array file per test image and set of weights:
+#   cache_dir/conv-<head fingerprint>/<image key>.arr   net_conv, as float16
+#   cache_dir/rpn-<rpn fingerprint>/<image key>.arr     rpn_cls_prob and
+#                                                       rpn_bbox_pred, float32
+# The head fingerprint hashes the weights of the backbone, the rpn one those
+# of the backbone and of the RPN, and the image key the input blob and
+# im_info, so an entry is only found for the very same input and weights.
+
+
+def weights_fingerprint(modules):
+  """A short hash of the parameters and buffers of modules."""
+  h = hashlib.sha1()
+  for module in modules:
+    for name, value in sorted(module.state_dict().items()):
+      h.update(name.encode('utf-8'))
+      h.update(value.cpu().numpy().tobytes())
+  return h.hexdigest()[:16]
+
+
+def image_key(image, im_info):
+  h = hashlib.sha1(np.ascontiguousarray(image).tobytes())
+  h.update(np.asarray(im_info, dtype=np.float32).tobytes())
+  return h.hexdigest()
+
+
+class FeatureCache(object):
+  """On-disk cache of the head feature maps of the test images and,
+  optionally, of the RPN outputs on top of them, so that test runs of
+  networks sharing the backbone (and the RPN) skip straight to the
+  proposals (or to the RoI pooling). The entries are memory-mapped when
+  they are read."""
+
+  def __init__(self, cache_dir, head_fingerprint, rpn_fingerprint=None):
+    self._conv_dir = os.path.join(cache_dir, 'conv-' + head_fingerprint)
+    self._rpn_dir = os.path.join(cache_dir, 'rpn-' + rpn_fingerprint) \
+      if rpn_fingerprint is not None else None
+    self.rpn = self._rpn_dir is not None
+    for d in [self._conv_dir, self._rpn_dir]:
+      if d is not None and not os.path.exists(d):
+        os.makedirs(d)
+    self.hits = {'conv': 0, 'rpn': 0}
+    self.misses = {'conv': 0, 'rpn': 0}
+
+  def _load(self, directory, key, names):
+    filename = os.path.join(directory, key + '.arr')
+    if not os.path.exists(filename):
+      return None
+    arrays = ArrayFile(filename)
+    return [arrays[name] for name in names]
+
+  def load(self, key):
+    """net_conv, rpn = cache.load(key)
+
+    The cached net_conv of the image key (float16) and, when the RPN
+    outputs are cached too, rpn = (rpn_cls_prob, rpn_bbox_pred); None for
+    what is not in the cache.
+    """
+    conv = self._load(self._conv_dir, key, ['net_conv'])
+    rpn = None
+    if conv is not None and self.rpn:
+      rpn = self._load(self._rpn_dir, key, ['rpn_cls_prob', 'rpn_bbox_pred'])
+    self._count('conv', conv is not None)
+    if self.rpn:
+      self._count('rpn', rpn is not None)
+    return (conv[0] if conv is not None else None), rpn
+
+  def _count(self, what, hit):
+    if hit:
+      self.hits[what] += 1
+    else:
+      self.misses[what] += 1
+
+  def _save(self, directory, key, named_arrays):
+    filename = os.path.join(directory, key + '.arr')
+    if os.path.exists(filename):
+      return
+    # Written under another name first, so that a test run reading the
+    # cache never sees a partial entry
+    tmp_file = '{:s}.{:d}.tmp'.format(filename, os.getpid())
+    save_arrays(named_arrays, tmp_file)
+    os.rename(tmp_file, filename)
+
+  def save_conv(self, key, net_conv):
+    """Cache the net_conv (numpy array) of the image key."""
+    self._save(self._conv_dir, key, [('net_conv', net_conv.astype(np.float16))])
+
+  def save_rpn(self, key, rpn_cls_prob, rpn_bbox_pred):
+    """Cache the RPN outputs (numpy arrays) of the image key."""
+    self._save(self._rpn_dir, key,
+               [('rpn_cls_prob', rpn_cls_prob.astype(np.float32, copy=False)),
+                ('rpn_bbox_pred', rpn_bbox_pred.astype(np.float32, copy=False))])
+
+  def summary(self):
+    lines = ['feature cache: net_conv {:d} hits, {:d} misses'.format(
+      self.hits['conv'], self.misses['conv'])]
+    if self.rpn:
+      lines.append('feature cache: rpn {:d} hits, {:d} misses'.format(
+        self.hits['rpn'], self.misses['rpn']))
+    return '\n'.join(lines)
@@ -0,0 +1,50 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from model.config import cfg
+
+
+def param_groups(named_parameters, lr, double_bias=None, bias_decay=None):
+  """Collapse the trainable parameters into one SGD group for the weights
+  and one for the biases, instead of one group per tensor.
+
+  double_bias and bias_decay default to cfg.TRAIN.DOUBLE_BIAS and
+  cfg.TRAIN.BIAS_DECAY.
+  """
+  if double_bias is None:
+    double_bias = cfg.TRAIN.DOUBLE_BIAS
+  if bias_decay is None:
+    bias_decay = cfg.TRAIN.BIAS_DECAY
+  weights, biases = [], []
+  for key, value in named_parameters:
+    if not value.requires_grad:
+      continue
+    if 'bias' in key:
+      biases.append(value)
+    else:
+      weights.append(value)
+
+  groups = []
+  if weights:
+    groups.append({'params': weights, 'lr': lr,
+                   'weight_decay': cfg.TRAIN.WEIGHT_DECAY})
+  if biases:
+    groups.append({'params': biases, 'lr': lr * (double_bias + 1),
+                   'weight_decay': bias_decay and cfg.TRAIN.WEIGHT_DECAY or 0})
+  return groups
+
+
+def zero_grad(optimizer):
+  """Reset the gradients by dropping them instead of filling them with zeros.
+
+  The next backward pass allocates fresh gradients, which saves a memset per
+  parameter; SGD skips any parameter whose gradient is still None.
+  """
+  for group in optimizer.param_groups:
+    for p in group['params']:
+      p.grad = None
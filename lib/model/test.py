@@ -15,12 +15,17 @@ except ImportError:
   import pickle
 import os
 import math
+import time
 
-from utils.timer import Timer
+from utils.timer import StageTimer
+from utils.pipeline import Prefetcher, Worker
 from model.nms_wrapper import nms
-from utils.blob import im_list_to_blob
+from utils.blob import im_list_to_blob, band_rows
+from utils.bbox import bbox_overlaps
 
 from model.config import cfg, get_output_dir
+from datasets.detection_store import DetectionStore, DetectionWriter, RawOutputWriter, \
+  merge_detection_stores
 from model.bbox_transform import clip_boxes, bbox_transform_inv
 
 import torch
@@ -33,25 +38,19 @@ def _get_image_blob(im):
     blob (ndarray): a data blob holding an image pyramid
     im_scale_factors (list): list of image scales (relative to im) used
       in the image pyramid
+  Only the rows of cfg.CROP_BAND are kept, cropped before resizing.
   """
-  im_orig = im.astype(np.float32, copy=True)
+  first, last = band_rows(im.shape[0], cfg.CROP_BAND)
+  im_orig = im[first:last].astype(np.float32, copy=True)
   im_orig -= cfg.PIXEL_MEANS
 
-  im_shape = im_orig.shape
-  im_size_min = np.min(im_shape[0:2])
-  im_size_max = np.max(im_shape[0:2])
-
   processed_ims = []
-  im_scale_factors = []
+  # the scales of the whole image
+  im_scale_factors = _test_scales(im.shape)
 
-  for target_size in cfg.TEST.SCALES:
-    im_scale = float(target_size) / float(im_size_min)
-    # Prevent the biggest axis from being more than MAX_SIZE
-    if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
-      im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
+  for im_scale in im_scale_factors:
     im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale,
             interpolation=cv2.INTER_LINEAR)
-    im_scale_factors.append(im_scale)
     processed_ims.append(im)
 
   # Create a blob to hold the input images
@@ -59,6 +58,20 @@ def _get_image_blob(im):
 
   return blob, np.array(im_scale_factors)
 
+def _test_scales(im_shape):
+  """The scale factors of an image of shape im_shape for TEST.SCALES."""
+  im_size_min = np.min(im_shape[0:2])
+  im_size_max = np.max(im_shape[0:2])
+
+  im_scale_factors = []
+  for target_size in cfg.TEST.SCALES:
+    im_scale = float(target_size) / float(im_size_min)
+    # Prevent the biggest axis from being more than MAX_SIZE
+    if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
+      im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
+    im_scale_factors.append(im_scale)
+  return im_scale_factors
+
 def _get_blobs(im):
   """Convert an image and RoIs within that image into network inputs."""
   blobs = {}
@@ -85,33 +98,259 @@ def _rescale_boxes(boxes, inds, scales):
 
   return boxes
 
-def im_detect(net, im):
-  blobs, im_scales = _get_blobs(im)
-  assert len(im_scales) == 1, "Only single-image batch implemented"
-
-  im_blob = blobs['data']
-  blobs['im_info'] = np.array([im_blob.shape[1], im_blob.shape[2], im_scales[0]], dtype=np.float32)
-
-  _, scores, bbox_pred, rois, fc7, net_conv = net.test_image(blobs['data'], blobs['im_info'])
-
-  boxes = rois[:, 1:5] / im_scales[0]
+def _image_detections(scores, bbox_pred, rois, im_scale, im_shape, y_offset=0):
+  """The scores and boxes of im_detect from the network outputs of an
+  image, whose first y_offset rows were cropped (see cfg.CROP_BAND)."""
+  boxes = rois[:, 1:5] / im_scale
+  boxes[:, 1::2] += y_offset
   scores = np.reshape(scores, [scores.shape[0], -1])
   bbox_pred = np.reshape(bbox_pred, [bbox_pred.shape[0], -1])
+  if boxes.shape[0] == 0:
+    # the image sent no RoI to the second stage (TEST.RPN_ADAPTIVE)
+    return scores, np.zeros(bbox_pred.shape, dtype=np.float32)
   if cfg.TEST.BBOX_REG:
     # Apply bounding-box regression deltas
     box_deltas = bbox_pred
     pred_boxes = bbox_transform_inv(torch.from_numpy(boxes), torch.from_numpy(box_deltas)).numpy()
-    pred_boxes = _clip_boxes(pred_boxes, im.shape)
+    pred_boxes = _clip_boxes(pred_boxes, im_shape)
   else:
     # Simply repeat the boxes, once for each class
     pred_boxes = np.tile(boxes, (1, scores.shape[1]))
 
-  return scores, pred_boxes#, fc7, net_conv
+  return scores, pred_boxes
+
+def prepare_image(im):
+  """processed_im, im_scale, y_offset = prepare_image(im)
+
+  The rescaled, mean subtracted image of im (of its rows in
+  cfg.CROP_BAND), its scale and the first row kept."""
+  assert len(cfg.TEST.SCALES) == 1, "Several test scales are detected by detect_variants"
+  blob, im_scales = _get_image_blob(im)
+  return blob[0], im_scales[0], band_rows(im.shape[0], cfg.CROP_BAND)[0]
+
+def test_time_augmented():
+  return len(cfg.TEST.SCALES) > 1 or cfg.TEST.FLIP
+
+def prepare_variants(im):
+  """The (processed_im, im_scale, y_offset, flipped) variants of im
+  detect_variants runs: im at every scale of TEST.SCALES, and flipped
+  horizontally with TEST.FLIP, cropped as prepare_image."""
+  first, last = band_rows(im.shape[0], cfg.CROP_BAND)
+  im_orig = im[first:last].astype(np.float32, copy=True)
+  im_orig -= cfg.PIXEL_MEANS
+  variants = []
+  for im_scale in _test_scales(im.shape):
+    processed_im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale,
+                              interpolation=cv2.INTER_LINEAR)
+    variants.append((processed_im, im_scale, first, False))
+    if cfg.TEST.FLIP:
+      variants.append((processed_im[:, ::-1], im_scale, first, True))
+  return variants
+
+def detect_prepared(net, prepared, im_shapes):
+  """Run the network once on the (processed_im, im_scale, y_offset) of
+  prepare_image of prepared, padded into one blob, and return the (scores,
+  boxes) of every image, whose original shape is in im_shapes."""
+  blob = im_list_to_blob([processed_im for processed_im, _, _ in prepared])
+  im_info = np.array([[processed_im.shape[0], processed_im.shape[1], im_scale]
+                      for processed_im, im_scale, _ in prepared], dtype=np.float32)
+
+  _, scores, bbox_pred, rois, fc7, net_conv = net.test_image(blob, im_info)
+
+  # the first column of rois is the index of the image in the batch
+  detections = []
+  for k, (_, im_scale, y_offset) in enumerate(prepared):
+    keep = rois[:, 0] == k
+    detections.append(_image_detections(scores[keep], bbox_pred[keep], rois[keep],
+                                        im_scale, im_shapes[k], y_offset))
+  return detections
+
+def im_detect_batch(net, ims, batch_size=None):
+  """Detect objects in the images of ims (BGR), batch_size images per
+  forward pass (cfg.TEST.IMS_PER_BATCH by default).
+
+  The rescaled images are sorted by size, so that the images of a batch
+  need little or no padding, and the images of each batch are padded into
+  one blob. Returns the (scores, boxes) of im_detect of every image, in
+  the order of ims. With test-time augmentation (several TEST.SCALES or
+  TEST.FLIP), the variants of every image are batched instead.
+  """
+  if test_time_augmented():
+    # the variants of an image make the batches instead
+    return [detect_variants(net, prepare_variants(im), im.shape) for im in ims]
+
+  batch_size = batch_size or cfg.TEST.IMS_PER_BATCH
+  prepared = [prepare_image(im) for im in ims]
+
+  order = sorted(range(len(ims)), key=lambda i: prepared[i][0].shape[:2])
+  detections = [None] * len(ims)
+  for start in range(0, len(order), batch_size):
+    inds = order[start:start + batch_size]
+    outputs = detect_prepared(net, [prepared[i] for i in inds], [ims[i].shape for i in inds])
+    for i, output in zip(inds, outputs):
+      detections[i] = output
+
+  return detections
+
+def detect_variants(net, variants, im_shape):
+  """Run the variants of prepare_variants of an image of shape im_shape
+  through the network as one batch, and return the (scores, boxes) of
+  im_detect of the image: the rows of all the variants, in the coordinates
+  of the image, for class_detections to merge."""
+  outputs = detect_prepared(net, [(processed_im, im_scale, y_offset)
+                                  for processed_im, im_scale, y_offset, _ in variants],
+                            [im_shape] * len(variants))
+  scores, boxes = [], []
+  for (_, _, _, flipped), (variant_scores, variant_boxes) in zip(variants, outputs):
+    if flipped:
+      flipped_boxes = variant_boxes.copy()
+      flipped_boxes[:, 0::4] = im_shape[1] - 1 - variant_boxes[:, 2::4]
+      flipped_boxes[:, 2::4] = im_shape[1] - 1 - variant_boxes[:, 0::4]
+      variant_boxes = flipped_boxes
+    scores.append(variant_scores)
+    boxes.append(variant_boxes)
+  return np.vstack(scores), np.vstack(boxes)
+
+def im_detect(net, im):
+  return im_detect_batch(net, [im], 1)[0]
+
+def image_tiles(im_shape, tile_size, overlap, scale=1.):
+  """The (x1, y1, x2, y2) windows, in pixels of the image of shape
+  im_shape, of the square tiles of tile_size pixels of the image rescaled
+  by scale, neighbouring tiles overlapping by overlap pixels at least. The
+  tiles are evenly spaced, so that they all have the same size."""
+  size = int(round(tile_size / scale))
+  overlap = int(round(overlap / scale))
+
+  def starts(length):
+    if length <= size:
+      return [0]
+    num = int(math.ceil(float(length - overlap) / (size - overlap)))
+    return np.round(np.linspace(0, length - size, num)).astype(int).tolist()
+
+  height, width = im_shape[:2]
+  return [(x, y, min(x + size, width), min(y + size, height))
+          for y in starts(height) for x in starts(width)]
+
+def _prepare_tile(im, scale):
+  im = im.astype(np.float32, copy=True)
+  im -= cfg.PIXEL_MEANS
+  if scale != 1.:
+    im = cv2.resize(im, None, None, fx=scale, fy=scale, interpolation=cv2.INTER_LINEAR)
+  # the boxes are moved to the image by _tile_detections
+  return im, scale, 0
+
+def prepare_tiles(im, tile_size):
+  """The tiles of im for detect_tiles: (prepared, shape, window) triples,
+  prepared being the processed image and scale of the tile, shape the shape
+  of its crop and window its image_tiles window, None for the whole image
+  at TEST.SCALES (with TEST.TILE_GLOBAL). Only the rows of cfg.CROP_BAND
+  are tiled."""
+  scale = cfg.TEST.TILE_SCALE
+  first, last = band_rows(im.shape[0], cfg.CROP_BAND)
+  tiles = []
+  for x1, y1, x2, y2 in image_tiles((last - first, im.shape[1]), tile_size,
+                                    cfg.TEST.TILE_OVERLAP, scale):
+    window = (x1, y1 + first, x2, y2 + first)
+    x1, y1, x2, y2 = window
+    crop = im[y1:y2, x1:x2]
+    tiles.append((_prepare_tile(crop, scale), crop.shape, window))
+  if cfg.TEST.TILE_GLOBAL:
+    tiles.append((prepare_image(im), im.shape, None))
+  return tiles
+
+def _tile_detections(scores, boxes, window, im_shape):
+  """Move the detections of the tile window to the image of shape im_shape,
+  dropping (with a zero score) the boxes cut by an edge of the tile inside
+  the tiled rows: the objects smaller than the overlap are found whole in
+  the neighbouring tile."""
+  x1, y1, x2, y2 = window
+  first, last = band_rows(im_shape[0], cfg.CROP_BAND)
+  overlap = cfg.TEST.TILE_OVERLAP / cfg.TEST.TILE_SCALE
+  edge = 1.
+  b = boxes.reshape(boxes.shape[0], -1, 4)
+  small_x = b[:, :, 2] - b[:, :, 0] < overlap
+  small_y = b[:, :, 3] - b[:, :, 1] < overlap
+  cut = np.zeros(b.shape[:2], dtype=bool)
+  if x1 > 0:
+    cut |= small_x & (b[:, :, 0] <= edge)
+  if y1 > first:
+    cut |= small_y & (b[:, :, 1] <= edge)
+  if x2 < im_shape[1]:
+    cut |= small_x & (b[:, :, 2] >= x2 - x1 - 1 - edge)
+  if y2 < last:
+    cut |= small_y & (b[:, :, 3] >= y2 - y1 - 1 - edge)
+  scores = np.where(cut, 0., scores).astype(scores.dtype, copy=False)
+
+  boxes = boxes.copy()
+  boxes[:, 0::2] += x1
+  boxes[:, 1::2] += y1
+  return scores, boxes
+
+def detect_tiles(net, tiles, im_shape, batch_size=None):
+  """Detect objects in the tiles of prepare_tiles of an image of shape
+  im_shape, batch_size tiles per forward pass (cfg.TEST.IMS_PER_BATCH by
+  default), and return the (scores, boxes) of im_detect of the image: the
+  rows of all the tiles, in image coordinates, for class_detections to
+  merge by NMS."""
+  batch_size = batch_size or cfg.TEST.IMS_PER_BATCH
+  windows = [t for t in tiles if t[2] is not None]
+  scores, boxes = [], []
+  for start in range(0, len(windows), batch_size):
+    batch = windows[start:start + batch_size]
+    outputs = detect_prepared(net, [prepared for prepared, _, _ in batch],
+                              [shape for _, shape, _ in batch])
+    for (_, _, window), (tile_scores, tile_boxes) in zip(batch, outputs):
+      tile_scores, tile_boxes = _tile_detections(tile_scores, tile_boxes, window, im_shape)
+      scores.append(tile_scores)
+      boxes.append(tile_boxes)
+  # the whole image on its own, it is not the size of the tiles
+  for prepared, shape, window in tiles:
+    if window is None:
+      tile_scores, tile_boxes = detect_prepared(net, [prepared], [shape])[0]
+      scores.append(tile_scores)
+      boxes.append(tile_boxes)
+  return np.vstack(scores), np.vstack(boxes)
+
+def im_detect_tiled(net, im, tile_size=None):
+  """im_detect in the tiles of im of tile_size pixels (cfg.TEST.TILE_SIZE
+  by default)."""
+  return detect_tiles(net, prepare_tiles(im, tile_size or cfg.TEST.TILE_SIZE), im.shape)
+
+def tile_size_for_memory(net, memory, batch_size=1, sizes=(256, 512)):
+  """The side of the largest square tiles whose forward passes of
+  batch_size tiles keep the peak memory of the device under memory MB.
+
+  The peak memory is measured after forward passes on blank tiles of two
+  sizes, in increasing order, and grows with the number of pixels. The
+  peak is never reset, so this has to run before the larger forward passes
+  (of the whole image of TEST.TILE_GLOBAL, which is not counted)."""
+  peaks = []
+  for size in sizes:
+    blob = np.zeros((batch_size, size, size, 3), dtype=np.float32)
+    im_info = np.array([[size, size, 1.]] * batch_size, dtype=np.float32)
+    net.test_image(blob, im_info)
+    peaks.append(torch.cuda.max_memory_allocated())
+  per_pixel = float(peaks[1] - peaks[0]) / (batch_size * (sizes[1] ** 2 - sizes[0] ** 2))
+  if per_pixel <= 0:
+    raise RuntimeError('The peak memory did not grow with the tiles, '
+                       'measure it before the other forward passes')
+  fixed = peaks[0] - per_pixel * batch_size * sizes[0] ** 2
+  pixels = (memory * 2. ** 20 - fixed) / (per_pixel * batch_size)
+  # a multiple of the stride of the feature maps
+  side = int(math.sqrt(max(pixels, 0.))) // 32 * 32
+  if side <= cfg.TEST.TILE_OVERLAP * 2:
+    raise ValueError('{:d} MB leave tiles of {:d} pixels for an overlap of {:d}'
+                     .format(memory, side, cfg.TEST.TILE_OVERLAP))
+  return side
 
 def apply_nms(all_boxes, thresh):
   """Apply non-maximum suppression to all predicted boxes output by the
-  test_net method.
+  test_net method, either all_boxes or a DetectionStore (which gives a
+  DetectionStore back).
   """
+  if isinstance(all_boxes, DetectionStore):
+    return _apply_nms_store(all_boxes, thresh)
   num_classes = len(all_boxes)
   num_images = len(all_boxes[0])
   nms_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
@@ -136,6 +375,24 @@ def apply_nms(all_boxes, thresh):
         continue
       nms_boxes[cls_ind][im_ind] = dets[keep, :].copy()
   return nms_boxes
+
+def _apply_nms_store(store, thresh):
+  writer = DetectionWriter(store.num_images, store.num_classes)
+  for im_ind in range(store.num_images):
+    rows = store.image_slice(im_ind)
+    classes = store.classes[rows]
+    dets = np.hstack((store.boxes[rows], store.scores[rows, np.newaxis]))
+    nms_dets = [[] for _ in range(store.num_classes)]
+    for cls_ind in np.unique(classes):
+      cls_dets = dets[classes == cls_ind]
+      inds = np.where((cls_dets[:, 2] > cls_dets[:, 0]) & (cls_dets[:, 3] > cls_dets[:, 1]))[0]
+      cls_dets = cls_dets[inds, :]
+      if len(cls_dets) == 0:
+        continue
+      keep = nms(torch.from_numpy(cls_dets), thresh).numpy()
+      nms_dets[cls_ind] = cls_dets[keep, :]
+    writer.add(im_ind, nms_dets)
+  return writer.finish()
   
 def draw_car_bb(im, bboxes, scores=[], thr=0.3, color_type='1'):
     bboxes = bboxes.astype(int)
@@ -209,81 +466,229 @@ def split_bbox(bbox, imgname, class_recs):
 
   return np.array(ov_th), np.array(und_th), BBGT[gt_left] # N, box+score
 
-def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0.):
+def box_voting(nms_dets, dets, thresh):
+  """The detections nms_dets kept by the NMS of dets, their boxes replaced
+  by the score-weighted average of the boxes of dets overlapping them by
+  thresh IoU at least (box voting)."""
+  overlaps = bbox_overlaps(nms_dets[:, :4].astype(np.float32, copy=False),
+                           dets[:, :4].astype(np.float32, copy=False))
+  weights = np.where(overlaps >= thresh, dets[np.newaxis, :, 4], 0.)
+  voted = nms_dets.copy()
+  voted[:, :4] = weights.dot(dets[:, :4]) / np.maximum(weights.sum(axis=1), 1e-12)[:, np.newaxis]
+  return voted
+
+def class_detections(scores, boxes, thresh=0., nms_thresh=0.3, vote_thresh=0.):
+  """Turn the im_detect outputs of an image into its detections: for every
+  class but the background, the boxes scoring above thresh, after NMS (and
+  box voting if vote_thresh is set).
+  Returns the list of N x 5 arrays (x1, y1, x2, y2, score) of the classes.
+  """
+  num_classes = scores.shape[1]
+  # skip j = 0, because it's the background class
+  image_dets = [[] for _ in range(num_classes)]
+  for j in range(1, num_classes):
+    inds = np.where(scores[:, j] > thresh)[0]
+    cls_scores = scores[inds, j]
+    cls_boxes = boxes[inds, j*4:(j+1)*4]
+    cls_dets = np.hstack((cls_boxes, cls_scores[:, np.newaxis])) \
+      .astype(np.float32, copy=False)
+    keep = nms(torch.from_numpy(cls_dets), nms_thresh).numpy() if cls_dets.size > 0 else []
+    if vote_thresh > 0 and len(keep) > 0:
+      image_dets[j] = box_voting(cls_dets[keep, :], cls_dets, vote_thresh)
+    else:
+      image_dets[j] = cls_dets[keep, :]
+  return image_dets
+
+def limit_detections(image_dets, max_per_image=100):
+  """Keep the max_per_image best detections of class_detections *over all
+  classes* (all of them if max_per_image is 0)."""
+  image_dets = list(image_dets)
+  if max_per_image > 0:
+    image_scores = np.hstack([image_dets[j][:, -1]
+                  for j in range(1, len(image_dets))])
+    if len(image_scores) > max_per_image:
+      image_thresh = np.sort(image_scores)[-max_per_image]
+      for j in range(1, len(image_dets)):
+        keep = np.where(image_dets[j][:, -1] >= image_thresh)[0]
+        image_dets[j] = image_dets[j][keep, :]
+  return image_dets
+
+def shard_images(num_images, shard, num_shards):
+  """The images of the shard of num_shards: contiguous slices of the image
+  index whose sizes differ by one at most."""
+  return range(shard * num_images // num_shards, (shard + 1) * num_images // num_shards)
+
+def _shard_file(output_dir, shard, num_shards):
+  return os.path.join(output_dir, 'detections.shard{:d}of{:d}.dets'.format(shard, num_shards))
+
+def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0., shard=None):
+  """Test a Fast R-CNN network on an image database.
+
+  With shard = (k, num_shards), only test the images of shard_images and
+  save their detections for merge_shards, which evaluates them.
+  """
   vis = False
 
   np.random.seed(cfg.RNG_SEED)
-  """Test a Fast R-CNN network on an image database."""
   num_images = len(imdb.image_index)
-  # all detections are collected into:
-  #  all_boxes[cls][image] = N x 5 array of detections in
+  image_inds = shard_images(num_images, *shard) if shard is not None else range(num_images)
+  # the detections of every image are matched against the ground truth
+  # as they come, when the dataset supports it
+  evaluator = imdb.streaming_evaluator() \
+    if cfg.TEST.STREAM_EVAL and shard is None else None
+  keep_boxes = evaluator is None or cfg.TEST.SAVE_DETECTIONS
+  # all detections are collected into the columns of a DetectionStore,
+  # where all_boxes[cls][image] = N x 5 array of detections in
   #  (x1, y1, x2, y2, score)
-  all_boxes = [[[] for _ in range(num_images)]
-         for _ in range(imdb.num_classes)]
-  ##
-  original_all_boxes = [[[] for _ in range(num_images)]
-         for _ in range(imdb.num_classes)]
-  ##
+  writer = DetectionWriter(num_images, imdb.num_classes) if keep_boxes else None
 
   output_dir = get_output_dir(imdb, weights_filename)
-
-  # timers
-  _t = {'im_detect' : Timer(), 'misc' : Timer()}
-
-  # extract gt objects for this class
-  class_recs = {}
-  npos = 0
-
-  for i in range(num_images):
+  # the im_detect outputs, to replay the post-processing with other settings
+  # (see tools/sweep_postprocess.py)
+  raw_writer = RawOutputWriter(os.path.join(output_dir, 'raw_outputs.arr')) \
+    if cfg.TEST.SAVE_RAW_OUTPUTS and shard is None else None
+  if cfg.TEST.SAVE_RAW_OUTPUTS and shard is not None:
+    print('The raw outputs are not saved by sharded runs')
+
+  tiled = cfg.TEST.TILE
+  augmented = test_time_augmented()
+  assert not (tiled and augmented), 'The tiles are not augmented'
+  if tiled:
+    # measured before any other forward pass
+    if cfg.TEST.TILE_MEMORY > 0:
+      tile_size = tile_size_for_memory(net, cfg.TEST.TILE_MEMORY, cfg.TEST.IMS_PER_BATCH)
+    else:
+      tile_size = cfg.TEST.TILE_SIZE
+      # the tiles would not advance past their overlap
+      if tile_size <= cfg.TEST.TILE_OVERLAP * 2:
+        raise ValueError('Tiles of {:d} pixels are too small for an overlap of {:d}'
+                         .format(tile_size, cfg.TEST.TILE_OVERLAP))
+    print('Detecting in tiles of {:d} pixels at scale {:.2f}'.format(tile_size,
+                                                                      cfg.TEST.TILE_SCALE))
+
+  # the cache is keyed by image, the network only fills it for single images
+  assert not cfg.TEST.FEATURE_CACHE or not (cfg.TEST.IMS_PER_BATCH > 1 or tiled or augmented), \
+    'The feature cache needs TEST.IMS_PER_BATCH 1, without tiles or test-time augmentation'
+  feature_cache = net.set_feature_cache(cfg.TEST.FEATURE_CACHE, cfg.TEST.FEATURE_CACHE_RPN) \
+    if cfg.TEST.FEATURE_CACHE else None
+  net.proposal_stats(reset=True)
+
+  # Three stages overlap: threads read and preprocess the images ahead, the
+  # network runs on batches of them here, and a worker thread turns the
+  # outputs into detections and evaluates them
+  times = StageTimer()
+
+  def load(i):
+    start = time.time()
     im = cv2.imread(imdb.image_path_at(i))
-    _t['im_detect'].tic()
-    scores, boxes = im_detect(net, im)
-    _t['im_detect'].toc()
-
-    _t['misc'].tic()
-
-    # skip j = 0, because it's the background class
-    for j in range(1, imdb.num_classes):
-      inds = np.where(scores[:, j] > thresh)[0]
-      cls_scores = scores[inds, j]
-      cls_boxes = boxes[inds, j*4:(j+1)*4]
-      cls_dets = np.hstack((cls_boxes, cls_scores[:, np.newaxis])) \
-        .astype(np.float32, copy=False)
-      keep = nms(torch.from_numpy(cls_dets), cfg.TEST.NMS).numpy() if cls_dets.size > 0 else []
-      # ##
-      # original_all_boxes[j][i] = cls_dets
-      # ##
-      cls_dets = cls_dets[keep, :]
-      all_boxes[j][i] = cls_dets
-    ##
-    obj_scores = net.roi_scores.cpu().data.numpy()
-    inds = np.where(obj_scores[:] > thresh)[0]
-    cls_scores = obj_scores[inds]
-    cls_boxes = boxes[inds, 4:8]
-    cls_dets = np.hstack((cls_boxes, obj_scores[:])) \
-      .astype(np.float32, copy=False)
-    
-    original_all_boxes[j][i] = cls_dets
-
-    # Limit to max_per_image detections *over all classes*
-    if max_per_image > 0:
-      image_scores = np.hstack([all_boxes[j][i][:, -1]
-                    for j in range(1, imdb.num_classes)])
-      if len(image_scores) > max_per_image:
-        image_thresh = np.sort(image_scores)[-max_per_image]
-        for j in range(1, imdb.num_classes):
-          keep = np.where(all_boxes[j][i][:, -1] >= image_thresh)[0]
-          all_boxes[j][i] = all_boxes[j][i][keep, :]
-          
-    _t['misc'].toc()
-    
-    print('im_detect: {:d}/{:d} {:.3f}s {:.3f}s' \
-        .format(i + 1, num_images, _t['im_detect'].average_time(),
-            _t['misc'].average_time()))
+    if tiled:
+      prepared = prepare_tiles(im, tile_size)
+    elif augmented:
+      prepared = prepare_variants(im)
+    else:
+      prepared = prepare_image(im)
+    times.add('load', time.time() - start)
+    return i, prepared, im.shape
+
+  def post_process(i, scores, boxes):
+    start = time.time()
+    if raw_writer is not None:
+      raw_writer.add(scores, boxes)
+
+    image_dets = limit_detections(
+      class_detections(scores, boxes, thresh, cfg.TEST.NMS, cfg.TEST.BBOX_VOTE),
+      max_per_image)
+
+    if evaluator is not None:
+      evaluator.add(i, image_dets)
+    if keep_boxes:
+      writer.add(i, image_dets)
+    times.add('post', time.time() - start)
+
+    # average times per image
+    print('im_detect: {:d}/{:d} {:s}'.format(i + 1 - image_inds[0], len(image_inds),
+                                             times.summary()))
+    if evaluator is not None and cfg.TEST.EVAL_DISPLAY > 0 \
+        and (i + 1) % cfg.TEST.EVAL_DISPLAY == 0 and i + 1 < num_images:
+      print('running mAP after {:d} images: {:.4f}'.format(i + 1, evaluator.mean_ap()))
+
+  last = image_inds[-1] if len(image_inds) > 0 else -1
+  loader = Prefetcher(load, image_inds, threads=cfg.TEST.LOADER_THREADS,
+                      ahead=cfg.TEST.PIPELINE_DEPTH)
+  post = Worker(post_process, depth=cfg.TEST.PIPELINE_DEPTH)
+  try:
+    batch = []
+    wait_start = time.time()
+    for item in loader:
+      batch.append(item)
+      # the tiles or variants of an image are batched instead
+      if len(batch) < cfg.TEST.IMS_PER_BATCH and not (tiled or augmented) \
+          and item[0] != last:
+        continue
+      # the time the network waited for the images
+      times.add('wait', time.time() - wait_start, len(batch))
+
+      start = time.time()
+      if tiled:
+        outputs = [detect_tiles(net, tiles, im_shape) for _, tiles, im_shape in batch]
+      elif augmented:
+        outputs = [detect_variants(net, variants, im_shape)
+                   for _, variants, im_shape in batch]
+      else:
+        outputs = detect_prepared(net, [prepared for _, prepared, _ in batch],
+                                   [im_shape for _, _, im_shape in batch])
+      times.add('forward', time.time() - start, len(batch))
+
+      for (i, _, _), (scores, boxes) in zip(batch, outputs):
+        post.put(i, scores, boxes)
+      batch = []
+      wait_start = time.time()
+  finally:
+    post.close()
+  print('time per image: {:s}'.format(times.summary()))
+
+  if raw_writer is not None:
+    raw_writer.close()
+  if feature_cache is not None:
+    print(feature_cache.summary())
+    net.set_feature_cache(None)
+  if cfg.TEST.RPN_ADAPTIVE:
+    stats = net.proposal_stats()
+    print('RoIs per image: {:.1f}, second stage skipped on {:d}/{:d} images'.format(
+      stats['rois'] / float(max(stats['images'], 1)), stats['skipped'], stats['images']))
+
+  all_boxes = None
+  if keep_boxes:
+    all_boxes = writer.finish()
+  if shard is not None:
+    filename = _shard_file(output_dir, *shard)
+    # renamed when complete, merge_shards never reads a partial shard
+    all_boxes.save(filename + '.tmp')
+    os.rename(filename + '.tmp', filename)
+    print('Wrote shard {:d} of {:d} to {:s}'.format(shard[0], shard[1], filename))
+    return
+  if keep_boxes:
+    all_boxes.save(os.path.join(output_dir, 'detections.dets'))
+
+  print('Evaluating detections')
+  if evaluator is not None:
+    imdb.evaluate_detections(all_boxes, output_dir, evaluator=evaluator)
+  else:
+    imdb.evaluate_detections(all_boxes, output_dir)
 
-  det_file = os.path.join(output_dir, 'detections.pkl')
-  with open(det_file, 'wb') as f:
-    pickle.dump(all_boxes, f, pickle.HIGHEST_PROTOCOL)
+def merge_shards(imdb, weights_filename, num_shards):
+  """Assemble the detections of the num_shards shards of test_net into
+  detections.dets and evaluate them."""
+  output_dir = get_output_dir(imdb, weights_filename)
+  filenames = [_shard_file(output_dir, k, num_shards) for k in range(num_shards)]
+  missing = [f for f in filenames if not os.path.exists(f)]
+  assert not missing, 'Missing shards: {}'.format(', '.join(missing))
+
+  all_boxes = merge_detection_stores([DetectionStore.load(f) for f in filenames])
+  assert all_boxes.num_images == imdb.num_images, \
+    'The shards hold {:d} images, {} has {:d}'.format(all_boxes.num_images, imdb.name,
+                                                       imdb.num_images)
+  all_boxes.save(os.path.join(output_dir, 'detections.dets'))
 
   print('Evaluating detections')
   imdb.evaluate_detections(all_boxes, output_dir)
@@ -13,6 +13,9 @@ from model.config import cfg
 import roi_data_layer.roidb as rdl_roidb
 from roi_data_layer.layer import RoIDataLayer
 import utils.timer
+from utils.meter import LossMeter
+from model.optimizer import param_groups
+from model.checkpoint import CheckpointWriter, load_checkpoint
 try:
   import cPickle as pickle
 except ImportError:
@@ -53,6 +56,14 @@ class SolverWrapper(object):
     if not os.path.exists(self.tbvaldir):
       os.makedirs(self.tbvaldir)
     self.pretrained_model = pretrained_model
+    # The detection loss of a source minibatch is scaled by the discriminator
+    # score of its synthetic image; the losses of a multi-image minibatch are
+    # pooled across its images, which a single weight cannot split
+    assert not hasattr(imdb, 'D_T_score') or cfg.TRAIN.IMS_PER_BATCH == 1, \
+      'Weighting the synthetic images by D_T_score needs TRAIN.IMS_PER_BATCH 1'
+    # Snapshots are written and removed on a background thread
+    self.checkpoint_writer = CheckpointWriter(compact=cfg.TRAIN.SNAPSHOT_FORMAT == 'compact',
+                                              half=cfg.TRAIN.SNAPSHOT_HALF)
 
   def snapshot(self, iter):
     net = self.net
@@ -63,8 +74,6 @@ class SolverWrapper(object):
     # Store the model snapshot
     filename = cfg.TRAIN.SNAPSHOT_PREFIX + '_iter_{:d}'.format(iter) + '.pth'
     filename = os.path.join(self.output_dir, filename)
-    torch.save(self.net.state_dict(), filename)
-    print('Wrote snapshot to: {:s}'.format(filename))
 
     # Also store some meta information, random state, etc.
     nfilename = cfg.TRAIN.SNAPSHOT_PREFIX + '_iter_{:d}'.format(iter) + '.pkl'
@@ -84,22 +93,16 @@ class SolverWrapper(object):
     # current shuffled indexes of the database
     permT = self.data_layer_T._perm
 
-    # Dump the meta info
-    with open(nfilename, 'wb') as fid:
-      pickle.dump(st0, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(cur, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(perm, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(cur_val, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(perm_val, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(curT, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(permT, fid, pickle.HIGHEST_PROTOCOL)
-      pickle.dump(iter, fid, pickle.HIGHEST_PROTOCOL)
+    # Queue the weights and the meta info, the writer copies the weights to
+    # host memory before returning
+    self.checkpoint_writer.save(filename, self.net.state_dict(), nfilename,
+                                [st0, cur, perm, cur_val, perm_val, curT, permT, iter])
 
     return filename, nfilename
 
   def from_snapshot(self, sfile, nfile):
     print('Restoring model snapshots from {:s}'.format(sfile))
-    self.net.load_state_dict(torch.load(str(sfile)))
+    self.net.load_state_dict(load_checkpoint(str(sfile)))
     print('Restored.')
     # Needs to restore the other hyper-parameters/states for training, (TODO xinlei) I have
     # tried my best to find the random states so that it can be recovered exactly
@@ -137,19 +140,10 @@ class SolverWrapper(object):
     # loss = layers['total_loss']
     # Set learning rate and momentum
     lr = cfg.TRAIN.LEARNING_RATE
-    params = []
-
-    for key, value in dict(self.net.named_parameters()).items():
-      if 'D_img' in key:
-        # print(key)
-        continue
-
-      if value.requires_grad:
-        # print(key)
-        if 'bias' in key:
-          params += [{'params':[value],'lr':lr, 'weight_decay': cfg.TRAIN.WEIGHT_DECAY}]
-        else:
-          params += [{'params':[value],'lr':lr, 'weight_decay': cfg.TRAIN.WEIGHT_DECAY}]
+    # The discriminator is updated by its own optimizer below, biases share
+    # the weight learning rate and decay
+    params = param_groups([(key, value) for key, value in self.net.named_parameters()
+                           if 'D_img' not in key], lr, double_bias=False, bias_decay=True)
     self.optimizer = torch.optim.SGD(params, momentum=cfg.TRAIN.MOMENTUM)
 
     self.D_img_op = torch.optim.SGD(self.net.D_img.parameters(), lr=lr*cfg.D_lr_mult, momentum=cfg.TRAIN.MOMENTUM)
@@ -177,6 +171,11 @@ class SolverWrapper(object):
     redfiles = [redfile.replace('.pth', '.pkl') for redfile in redfiles]
     nfiles = [nn for nn in nfiles if nn not in redfiles]
 
+    # A crash while a snapshot was written or removed may leave one of its
+    # two files behind: only restore from complete snapshots
+    sfiles = [ss for ss in sfiles if os.path.exists(ss[:-len('.pth')] + '.pkl')]
+    nfiles = [nn for nn in nfiles if os.path.exists(nn[:-len('.pkl')] + '.pth')]
+
     lsf = len(sfiles)
     assert len(nfiles) == lsf
 
@@ -219,19 +218,16 @@ class SolverWrapper(object):
 
   def remove_snapshot(self, np_paths, ss_paths):
     to_remove = len(np_paths) - cfg.TRAIN.SNAPSHOT_KEPT
-    for c in range(to_remove):
-      nfile = np_paths[0]
-      os.remove(str(nfile))
-      np_paths.remove(nfile)
+    nfiles = np_paths[:max(to_remove, 0)]
+    del np_paths[:max(to_remove, 0)]
 
     to_remove = len(ss_paths) - cfg.TRAIN.SNAPSHOT_KEPT
-    for c in range(to_remove):
-      sfile = ss_paths[0]
-      # To make the code compatible to earlier versions of Tensorflow,
-      # where the naming tradition for checkpoints are different
-      os.remove(str(sfile))
-      ss_paths.remove(sfile)
-    
+    sfiles = ss_paths[:max(to_remove, 0)]
+    del ss_paths[:max(to_remove, 0)]
+
+    # The files are deleted by the writer, after the snapshots queued before
+    self.checkpoint_writer.remove([str(f) for f in sfiles + nfiles])
+
   def train_model(self, max_iters):
     # Build data layers for both training and validation set
     self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes)
@@ -265,6 +261,13 @@ class SolverWrapper(object):
 
     #self.net.D_img2.train()
     #self.net.D_img2.cuda()
+
+    # The losses stay on the device and the clock is read with a single
+    # synchronization every DISPLAY iterations
+    losses = LossMeter(['total_loss', 'rpn_loss_cls', 'rpn_loss_box', 'loss_cls', 'loss_box',
+                        'D_img_loss_S', 'D_img_loss_T'])
+    speed = utils.timer.SampledTimer()
+    speed.start()
   
     while iter < max_iters + 1:
       # Learning rate
@@ -275,8 +278,8 @@ class SolverWrapper(object):
         scale_lr(self.optimizer, cfg.TRAIN.GAMMA)
         #scale_lr(self.D_img_op, cfg.TRAIN.GAMMA)
         next_stepsize = stepsizes.pop()
+        speed.start()
 
-      utils.timer.timer.tic()
       # Get training data, one batch at a time
       blobs = self.data_layer.forward()
       blobsT = self.data_layer_T.forward()
@@ -302,20 +305,22 @@ class SolverWrapper(object):
         
         rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, total_loss, D_img_loss_S, D_img_loss_T = \
             self.net.train_adapt_step_img(blobs, blobsT, self.optimizer, self.D_img_op, synth_weight)
+      losses.add([total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box,
+                  D_img_loss_S, D_img_loss_T])
+      speed.step()
 
-      utils.timer.timer.toc()
-
-      # Display training information
+      # Display training information, averaged since the last display
       if iter % (cfg.TRAIN.DISPLAY) == 0:
+        avg = losses.average()
         print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
               '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n '
               '>>> D_img_loss_S: %.6f\n >>> D_img_loss_T: %.6f\n '
               '>>> lambda: %f >>> lr: %f ' % \
-              (iter, max_iters, total_loss, rpn_loss_cls, \
-                rpn_loss_box, loss_cls, loss_box, \
-                D_img_loss_S, D_img_loss_T, \
+              (iter, max_iters, avg['total_loss'], avg['rpn_loss_cls'], \
+                avg['rpn_loss_box'], avg['loss_cls'], avg['loss_box'], \
+                avg['D_img_loss_S'], avg['D_img_loss_T'], \
                 cfg.ADAPT_LAMBDA, lr))
-        print('speed: {:.3f}s / iter'.format(utils.timer.timer.average_time()))
+        print('speed: {:.3f}s / iter'.format(speed.average_time()))
 
         # for k in utils.timer.timer._average_time.keys():
         #   print(k, utils.timer.timer.average_time(k))
@@ -330,11 +335,15 @@ class SolverWrapper(object):
         # Remove the old snapshots if there are too many
         if len(np_paths) > cfg.TRAIN.SNAPSHOT_KEPT:
           self.remove_snapshot(np_paths, ss_paths)
+        # Keep the snapshot out of the step time
+        speed.start()
 
       iter += 1
 
     if last_snapshot_iter != iter - 1:
       self.snapshot(iter - 1)
+    # Wait for the last snapshots to be on disk
+    self.checkpoint_writer.close()
 
     self.writer.close()
     self.valwriter.close()
@@ -388,6 +397,8 @@ def train_net(network, imdb, roidb, imdb_T, roidb_T, valroidb, output_dir, tb_di
   valroidb = filter_roidb(valroidb)
 
   roidb_T = filter_roidb(roidb_T)
+  # from the labelled source domain
+  rdl_roidb.set_crop_band(roidb)
 
   sw = SolverWrapper(network, imdb, roidb, imdb_T, roidb_T, valroidb, output_dir, tb_dir,
                      pretrained_model=pretrained_model)
@@ -0,0 +1,36 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Factory method for building the networks by name."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from model.config import cfg
+from nets.vgg16 import vgg16
+from nets.resnet_v1 import resnetv1
+from nets.mobilenet_v1 import mobilenetv1
+
+
+def build_net(name, num_classes):
+  """The network name (vgg16, res50, res101, res152 or mobile), with the
+  architecture of num_classes classes created."""
+  if name == 'vgg16':
+    net = vgg16()
+  elif name == 'res50':
+    net = resnetv1(num_layers=50)
+  elif name == 'res101':
+    net = resnetv1(num_layers=101)
+  elif name == 'res152':
+    net = resnetv1(num_layers=152)
+  elif name == 'mobile':
+    net = mobilenetv1()
+  else:
+    raise NotImplementedError
+
+  net.create_architecture(num_classes, tag='default',
+                          anchor_scales=cfg.ANCHOR_SCALES,
+                          anchor_ratios=cfg.ANCHOR_RATIOS)
+  return net
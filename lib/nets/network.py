@@ -30,6 +30,8 @@ from layer_utils.roi_pooling.roi_pool import RoIPoolFunction
 from layer_utils.roi_align.crop_and_resize import CropAndResizeFunction
 
 from model.config import cfg
+from model.optimizer import zero_grad
+from model.feature_cache import FeatureCache, weights_fingerprint, image_key
 
 import tensorboardX as tb
 
@@ -99,19 +101,23 @@ class Network(nn.Module):
     self._event_summaries = {}
     self._image_gt_summaries = {}
     self._variables_to_fix = {}
+    self._feature_cache = None
+    self._cache_key = None
+    self._proposal_stats = {'images': 0, 'rois': 0, 'skipped': 0}
 
   def _add_gt_image(self):
     # add back mean
     image = self._image_gt_summaries['image'] + cfg.PIXEL_MEANS
-    image = imresize(image[0], self._im_info[:2] / self._im_info[2])
+    image = imresize(image[0], self._im_info[0, :2] / self._im_info[0, 2])
     # BGR to RGB (opencv uses BGR)
     self._gt_image = image[np.newaxis, :,:,::-1].copy(order='C')
 
   def _add_gt_image_summary(self):
     # use a customized visualization function to visualize the boxes
     self._add_gt_image()
+    start, end = self._image_gt_range(0)
     image = draw_bounding_boxes(\
-                      self._gt_image, self._image_gt_summaries['gt_boxes'], self._image_gt_summaries['im_info'])
+                      self._gt_image, self._image_gt_summaries['gt_boxes'][start:end], self._im_info[0])
 
     return tb.summary.image('GROUND_TRUTH', image[0].astype('float32')/255.0)
 
@@ -264,10 +270,21 @@ class Network(nn.Module):
 
     return crops
 
+  def _image_gt_range(self, i):
+    """Rows of self._gt_boxes that belong to image i of the minibatch."""
+    return int(self._gt_offsets[i]), int(self._gt_offsets[i + 1])
+
   def _anchor_target_layer(self, rpn_cls_score):
+    gt_boxes = self._gt_boxes.data.cpu().numpy()
+    anchors = self._anchors.data.cpu().numpy()
+    # anchors are shared by the images of a minibatch, the targets are not
+    targets = []
+    for i in range(rpn_cls_score.size(0)):
+      start, end = self._image_gt_range(i)
+      targets.append(anchor_target_layer(
+        rpn_cls_score[i:i+1].data, gt_boxes[start:end], self._im_info[i], self._feat_stride, anchors, self._num_anchors))
     rpn_labels, rpn_bbox_targets, rpn_bbox_inside_weights, rpn_bbox_outside_weights = \
-      anchor_target_layer(
-      rpn_cls_score.data, self._gt_boxes.data.cpu().numpy(), self._im_info, self._feat_stride, self._anchors.data.cpu().numpy(), self._num_anchors)
+      [np.concatenate(t, axis=0) for t in zip(*targets)]
 
     rpn_labels = Variable(torch.from_numpy(rpn_labels).float().cuda()) #.set_shape([1, 1, None, None])
     rpn_bbox_targets = Variable(torch.from_numpy(rpn_bbox_targets).float().cuda())#.set_shape([1, None, None, self._num_anchors * 4])
@@ -288,7 +305,7 @@ class Network(nn.Module):
   def _anchor_target_layer_fpn(self, rpn_cls_score, idx):
     rpn_labels, rpn_bbox_targets, rpn_bbox_inside_weights, rpn_bbox_outside_weights = \
       anchor_target_layer(
-      rpn_cls_score.data, self._gt_boxes.data.cpu().numpy(), self._im_info, [self._feat_stride[idx]], self._anchors[idx].data.cpu().numpy(), self._num_anchors)
+      rpn_cls_score.data, self._gt_boxes.data.cpu().numpy(), self._im_info[0], [self._feat_stride[idx]], self._anchors[idx].data.cpu().numpy(), self._num_anchors)
 
     rpn_labels = Variable(torch.from_numpy(rpn_labels).float().cuda()) #.set_shape([1, 1, None, None])
     rpn_bbox_targets = Variable(torch.from_numpy(rpn_bbox_targets).float().cuda())#.set_shape([1, None, None, self._num_anchors * 4])
@@ -312,9 +329,15 @@ class Network(nn.Module):
     return rpn_labels
 
   def _proposal_target_layer(self, rois, roi_scores):
+    num_images = self._image.size(0)
+    targets = []
+    for i in range(num_images):
+      inds = (rois.data[:, 0] == i).nonzero().view(-1)
+      start, end = self._image_gt_range(i)
+      targets.append(proposal_target_layer(
+        rois[inds], roi_scores[inds], self._gt_boxes[start:end], self._num_classes, i, num_images))
     rois, roi_scores, labels, bbox_targets, bbox_inside_weights, bbox_outside_weights = \
-      proposal_target_layer(
-      rois, roi_scores, self._gt_boxes, self._num_classes)
+      [torch.cat(t, 0) for t in zip(*targets)]
 
     self._proposal_targets['rois'] = rois
     self._proposal_targets['labels'] = labels.long()
@@ -473,7 +496,7 @@ class Network(nn.Module):
     rpn_cls_score = self.rpn_cls_score_net(rpn) # batch * (num_anchors * 2) * h * w
 
     # change it so that the score has 2 as its channel size
-    rpn_cls_score_reshape = rpn_cls_score.view(1, 2, -1, rpn_cls_score.size()[-1]) # batch * 2 * (num_anchors*h) * w
+    rpn_cls_score_reshape = rpn_cls_score.view(rpn_cls_score.size(0), 2, -1, rpn_cls_score.size()[-1]) # batch * 2 * (num_anchors*h) * w
     rpn_cls_prob_reshape = F.softmax(rpn_cls_score_reshape, dim=1)
     
     # Move channel to the last dimenstion, to fit the input of python functions
@@ -490,12 +513,7 @@ class Network(nn.Module):
       rpn_labels = self._anchor_target_layer(rpn_cls_score)
       rois, _ = self._proposal_target_layer(rois, roi_scores)
     else:
-      if cfg.TEST.MODE == 'nms':
-        rois, self.roi_scores = self._proposal_layer(rpn_cls_prob, rpn_bbox_pred)
-      elif cfg.TEST.MODE == 'top':
-        rois, _ = self._proposal_top_layer(rpn_cls_prob, rpn_bbox_pred)
-      else:
-        raise NotImplementedError
+      rois = self._test_proposals(rpn_cls_prob, rpn_bbox_pred)
 
     self._predictions["rpn_cls_score"] = rpn_cls_score
     self._predictions["rpn_cls_score_reshape"] = rpn_cls_score_reshape
@@ -506,6 +524,52 @@ class Network(nn.Module):
 
     return rois
 
+  def _test_proposals(self, rpn_cls_prob, rpn_bbox_pred):
+    if cfg.TEST.MODE == 'nms':
+      rois, self.roi_scores = self._proposal_layer(rpn_cls_prob, rpn_bbox_pred)
+      roi_scores = self.roi_scores
+    elif cfg.TEST.MODE == 'top':
+      rois, roi_scores = self._proposal_top_layer(rpn_cls_prob, rpn_bbox_pred)
+    else:
+      raise NotImplementedError
+
+    num_images = rpn_cls_prob.size(0)
+    if cfg.TEST.RPN_ADAPTIVE:
+      rois = self._adaptive_proposals(rois, roi_scores, num_images)
+    self._proposal_stats['images'] += num_images
+    self._proposal_stats['rois'] += rois.size(0) if rois is not None else 0
+    return rois
+
+  def _adaptive_proposals(self, rois, roi_scores, num_images):
+    """The proposals of every image whose objectness is at least
+    TEST.RPN_SCORE_THRESH, the best TEST.RPN_MIN_PROPOSALS at least and
+    TEST.RPN_MAX_PROPOSALS at most, or none when no proposal passes; None
+    when no image of the batch keeps any."""
+    batch_inds = rois.data[:, 0].cpu().numpy().astype(np.int64)
+    scores = roi_scores.data.view(-1).cpu().numpy()
+    keep = []
+    for i in range(num_images):
+      inds = np.where(batch_inds == i)[0]
+      inds = inds[np.argsort(-scores[inds], kind='mergesort')]
+      num = int((scores[inds] >= cfg.TEST.RPN_SCORE_THRESH).sum())
+      if num == 0:
+        self._proposal_stats['skipped'] += 1
+        continue
+      num = min(max(num, cfg.TEST.RPN_MIN_PROPOSALS), cfg.TEST.RPN_MAX_PROPOSALS)
+      keep.append(inds[:num])
+    if not keep:
+      return None
+    keep = torch.from_numpy(np.concatenate(keep)).cuda()
+    return rois[keep]
+
+  def proposal_stats(self, reset=False):
+    """The numbers of test images, of RoIs they sent to the second stage
+    and of images whose second stage was skipped (see TEST.RPN_ADAPTIVE)."""
+    stats = dict(self._proposal_stats)
+    if reset:
+      self._proposal_stats = {'images': 0, 'rois': 0, 'skipped': 0}
+    return stats
+
   def _region_proposal_fpn(self, net_conv):
     # self._act_summaries['rpn'] = []
     rpn_cls_prob_total = []
@@ -517,7 +581,7 @@ class Network(nn.Module):
       rpn_cls_score = self.rpn_cls_score_net(rpn) # batch * (num_anchors * 2) * h * w
 
       # change it so that the score has 2 as its channel size
-      rpn_cls_score_reshape = rpn_cls_score.view(1, 2, -1, rpn_cls_score.size()[-1]) # batch * 2 * (num_anchors*h) * w
+      rpn_cls_score_reshape = rpn_cls_score.view(rpn_cls_score.size(0), 2, -1, rpn_cls_score.size()[-1]) # batch * 2 * (num_anchors*h) * w
       rpn_cls_prob_reshape = F.softmax(rpn_cls_score_reshape)
 
       # Move channel to the last dimenstion, to fit the input of python functions
@@ -687,11 +751,35 @@ class Network(nn.Module):
   def _predict(self):
     # This is just _build_network in tf-faster-rcnn
     torch.backends.cudnn.benchmark = False
-    net_conv = self._image_to_head()
+    net_conv, rpn = None, None
+    if self._cache_key is not None:
+      net_conv, rpn = self._feature_cache.load(self._cache_key)
+    cached = net_conv is not None, rpn is not None
+    if cached[0]:
+      net_conv = Variable(torch.from_numpy(net_conv.astype(np.float32)).cuda(), volatile=True)
+    else:
+      net_conv = self._image_to_head()
 
     # build the anchors for the image
     self._anchor_component(net_conv.size(2), net_conv.size(3))
-    rois = self._region_proposal(net_conv)
+    if cached[1]:
+      rois = self._test_proposals(*[Variable(torch.from_numpy(np.asarray(a)).cuda(), volatile=True)
+                                    for a in rpn])
+      self._predictions["rois"] = rois
+    else:
+      rois = self._region_proposal(net_conv)
+
+    if self._cache_key is not None:
+      if not cached[0]:
+        self._feature_cache.save_conv(self._cache_key, net_conv.data.cpu().numpy())
+      if self._feature_cache.rpn and not cached[1]:
+        self._feature_cache.save_rpn(self._cache_key,
+                                     self._predictions['rpn_cls_prob'].data.cpu().numpy(),
+                                     self._predictions['rpn_bbox_pred'].data.cpu().numpy())
+
+    if rois is None:
+      # no proposal of TEST.RPN_ADAPTIVE passed, the second stage is skipped
+      return None, None, None, net_conv, None
 
     if cfg.POOLING_MODE == 'crop':
       pool5 = self._crop_pool_layer(net_conv, rois)
@@ -722,23 +810,38 @@ class Network(nn.Module):
     boxes[:, 3::4] = np.minimum(boxes[:, 3::4], im_shape[0] - 1)
     return boxes
   
-  def forward(self, image, im_info, gt_boxes=None, mode='TRAIN', adapt=None):
+  def forward(self, image, im_info, gt_boxes=None, mode='TRAIN', adapt=None, num_gt=None):
+    """
+    image is a N x H x W x 3 blob, im_info holds one row per image.
+    gt_boxes stacks the boxes of all the images, num_gt[i] of them belonging
+    to image i; without num_gt they all belong to the first image.
+    """
+    im_info = np.asarray(im_info, dtype=np.float32).reshape((image.shape[0], -1))
     self._image_gt_summaries['image'] = image
     self._image_gt_summaries['gt_boxes'] = gt_boxes
     self._image_gt_summaries['im_info'] = im_info
 
     self._image = Variable(torch.from_numpy(image.transpose([0,3,1,2])).cuda(), volatile=mode == 'TEST')
-    self._im_info = im_info # No need to change; actually it can be an list
+    self._im_info = im_info
     self._gt_boxes = Variable(torch.from_numpy(gt_boxes).cuda()) if gt_boxes is not None else None
+    if gt_boxes is not None:
+      if num_gt is None:
+        num_gt = [gt_boxes.shape[0]]
+      self._gt_offsets = np.cumsum([0] + list(num_gt))
 
     self._mode = mode
+    # the feature cache only holds single test images
+    self._cache_key = image_key(image, im_info) \
+      if self._feature_cache is not None and mode == 'TEST' and image.shape[0] == 1 else None
 
     rois, cls_prob, bbox_pred, net_conv, fc7 = self._predict()
 
     if mode == 'TEST':
-      stds = bbox_pred.data.new(cfg.TRAIN.BBOX_NORMALIZE_STDS).repeat(self._num_classes).unsqueeze(0).expand_as(bbox_pred)
-      means = bbox_pred.data.new(cfg.TRAIN.BBOX_NORMALIZE_MEANS).repeat(self._num_classes).unsqueeze(0).expand_as(bbox_pred)
-      self._predictions["bbox_pred"] = bbox_pred.mul(Variable(stds)).add(Variable(means))
+      # without bbox_pred when the second stage was skipped
+      if bbox_pred is not None:
+        stds = bbox_pred.data.new(cfg.TRAIN.BBOX_NORMALIZE_STDS).repeat(self._num_classes).unsqueeze(0).expand_as(bbox_pred)
+        means = bbox_pred.data.new(cfg.TRAIN.BBOX_NORMALIZE_MEANS).repeat(self._num_classes).unsqueeze(0).expand_as(bbox_pred)
+        self._predictions["bbox_pred"] = bbox_pred.mul(Variable(stds)).add(Variable(means))
     elif adapt:
       pass
     else:
@@ -776,6 +879,24 @@ class Network(nn.Module):
     normal_init(self.D_img.conv3, 0, 0.01, cfg.TRAIN.TRUNCATED)
     normal_init(self.D_img.classifier, 0, 0.01, cfg.TRAIN.TRUNCATED)
 
+  def set_feature_cache(self, cache_dir, rpn=False):
+    """
+    Cache the head feature maps of the test images under cache_dir, and with
+    rpn the RPN outputs too, or stop caching if cache_dir is None. The
+    entries are keyed by the current weights: call it again after loading
+    other ones.
+    """
+    if cache_dir is None:
+      self._feature_cache = None
+      return None
+    assert not cfg.FPN, 'The feature cache does not support FPN'
+    head = [self._layers['head']]
+    self._feature_cache = FeatureCache(
+      cache_dir, weights_fingerprint(head),
+      weights_fingerprint(head + [self.rpn_net, self.rpn_cls_score_net,
+                                  self.rpn_bbox_pred_net]) if rpn else None)
+    return self._feature_cache
+
   # Extract the head feature maps, for example for vgg16 it is conv5_3
   # only useful during testing mode
   def extract_head(self, image):
@@ -786,6 +907,13 @@ class Network(nn.Module):
   def test_image(self, image, im_info):
     self.eval()
     fc7, net_conv = self.forward(image, im_info, None, mode='TEST')
+    if self._predictions['rois'] is None:
+      # the second stage was skipped, there is no detection
+      self.delete_intermediate_states()
+      return np.zeros((0, self._num_classes), dtype=np.float32), \
+             np.zeros((0, self._num_classes), dtype=np.float32), \
+             np.zeros((0, self._num_classes * 4), dtype=np.float32), \
+             np.zeros((0, 5), dtype=np.float32), fc7, net_conv
     cls_score, cls_prob, bbox_pred, rois = self._predictions["cls_score"].data.cpu().numpy(), \
                                                      self._predictions['cls_prob'].data.cpu().numpy(), \
                                                      self._predictions['bbox_pred'].data.cpu().numpy(), \
@@ -801,7 +929,7 @@ class Network(nn.Module):
 
   def get_summary(self, blobs):
     self.eval()
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], num_gt=blobs['num_gt'])
     self.train()
     summary = self._run_summary_op(True)
 
@@ -811,13 +939,13 @@ class Network(nn.Module):
     source_label = 0
     target_label = 1
 
-    train_op.zero_grad()
-    D_img_op.zero_grad()
+    zero_grad(train_op)
+    zero_grad(D_img_op)
     
     bceLoss_func = nn.BCEWithLogitsLoss()
 
     #train with source
-    fc7, net_conv = self.forward(blobs_S['data'], blobs_S['im_info'], blobs_S['gt_boxes'])
+    fc7, net_conv = self.forward(blobs_S['data'], blobs_S['im_info'], blobs_S['gt_boxes'], num_gt=blobs_S['num_gt'])
 
     net_conv = grad_reverse(net_conv)
 
@@ -832,13 +960,9 @@ class Network(nn.Module):
     
     total_loss_S = loss_S + (cfg.ADAPT_LAMBDA/2.) * loss_D_img_S
 
-    rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].data[0], \
-                                                                        self._losses['rpn_loss_box'].data[0], \
-                                                                        self._losses['cross_entropy'].data[0], \
-                                                                        self._losses['loss_box'].data[0], \
-                                                                        self._losses['total_loss'].data[0]
+    rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._detached_losses()
     #train with target
-    fc7, net_conv = self.forward(blobs_T['data'], blobs_T['im_info'], blobs_T['gt_boxes'], adapt=True)
+    fc7, net_conv = self.forward(blobs_T['data'], blobs_T['im_info'], blobs_T['gt_boxes'], adapt=True, num_gt=blobs_T['num_gt'])
     net_conv = grad_reverse(net_conv)
 
     #D_img
@@ -861,21 +985,21 @@ class Network(nn.Module):
                                                                         
     self.delete_intermediate_states()
 
-    return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss, loss_D_img_S, loss_D_img_T
+    return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss, loss_D_img_S.detach(), loss_D_img_T.detach()
 
   def FPN_train_adapt_step_img(self, blobs_S, blobs_T, train_op, D_inst_op, D_img_op):
     source_label = 0
     target_label = 1
 
-    train_op.zero_grad()
+    zero_grad(train_op)
     # D_inst_op.zero_grad()
-    D_img_op.zero_grad()
+    zero_grad(D_img_op)
     
     # sig = nn.Sigmoid()
     bceLoss_func = nn.BCEWithLogitsLoss()
 
     #train with source
-    fc7, net_conv = self.forward(blobs_S['data'], blobs_S['im_info'], blobs_S['gt_boxes'])
+    fc7, net_conv = self.forward(blobs_S['data'], blobs_S['im_info'], blobs_S['gt_boxes'], num_gt=blobs_S['num_gt'])
 
     loss_D_img_S = 0
     for idx, n in enumerate(net_conv):
@@ -897,7 +1021,7 @@ class Network(nn.Module):
                                                                         self._losses['loss_box'].data[0], \
                                                                         self._losses['total_loss'].data[0]
     #train with target
-    fc7, net_conv = self.forward(blobs_T['data'], blobs_T['im_info'], blobs_T['gt_boxes'], adapt=True)
+    fc7, net_conv = self.forward(blobs_T['data'], blobs_T['im_info'], blobs_T['gt_boxes'], adapt=True, num_gt=blobs_T['num_gt'])
 
     loss_D_img_T = 0
     for idx, n in enumerate(net_conv):
@@ -926,18 +1050,18 @@ class Network(nn.Module):
     source_label = 0
     target_label = 1
 
-    train_op.zero_grad()
+    zero_grad(train_op)
     # D_inst_op.zero_grad()
-    D_img_op.zero_grad()
-    D_img_op1.zero_grad()
-    D_img_op2.zero_grad()
-    D_img_op3.zero_grad()
-    D_img_op4.zero_grad()
+    zero_grad(D_img_op)
+    zero_grad(D_img_op1)
+    zero_grad(D_img_op2)
+    zero_grad(D_img_op3)
+    zero_grad(D_img_op4)
     
     bceLoss_func = nn.BCEWithLogitsLoss()
 
     #train with source
-    fc7, net_conv = self.forward(blobs_S['data'], blobs_S['im_info'], blobs_S['gt_boxes'])
+    fc7, net_conv = self.forward(blobs_S['data'], blobs_S['im_info'], blobs_S['gt_boxes'], num_gt=blobs_S['num_gt'])
 
     loss_D_img_S = 0
 
@@ -984,7 +1108,7 @@ class Network(nn.Module):
                                                                         self._losses['loss_box'].data[0], \
                                                                         self._losses['total_loss'].data[0]
     #train with target
-    fc7, net_conv = self.forward(blobs_T['data'], blobs_T['im_info'], blobs_T['gt_boxes'], adapt=True)
+    fc7, net_conv = self.forward(blobs_T['data'], blobs_T['im_info'], blobs_T['gt_boxes'], adapt=True, num_gt=blobs_T['num_gt'])
 
     loss_D_img_T = 0
     net_conv[0] = grad_reverse(net_conv[0])
@@ -1038,17 +1162,19 @@ class Network(nn.Module):
 
     return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss, loss_D_inst_S, loss_D_img_S, loss_D_const_S, loss_D_inst_T, loss_D_img_T, loss_D_const_T
 
+  def _detached_losses(self):
+    """The step losses as device tensors, so reading them does not wait for
+    the GPU; they are materialized by the caller only when displayed."""
+    return tuple(self._losses[k].detach() for k in
+                 ['rpn_cross_entropy', 'rpn_loss_box', 'cross_entropy', 'loss_box', 'total_loss'])
+
   def train_step(self, blobs, train_op):
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], num_gt=blobs['num_gt'])
 
-    rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].data[0], \
-                                                                        self._losses['rpn_loss_box'].data[0], \
-                                                                        self._losses['cross_entropy'].data[0], \
-                                                                        self._losses['loss_box'].data[0], \
-                                                                        self._losses['total_loss'].data[0]
+    rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._detached_losses()
 
     #utils.timer.timer.tic('backward')
-    train_op.zero_grad()
+    zero_grad(train_op)
     self._losses['total_loss'].backward()
     #utils.timer.timer.toc('backward')
     train_op.step()
@@ -1058,13 +1184,9 @@ class Network(nn.Module):
     return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss
 
   def train_step_with_summary(self, blobs, train_op):
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
-    rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].data[0], \
-                                                                        self._losses['rpn_loss_box'].data[0], \
-                                                                        self._losses['cross_entropy'].data[0], \
-                                                                        self._losses['loss_box'].data[0], \
-                                                                        self._losses['total_loss'].data[0]
-    train_op.zero_grad()
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], num_gt=blobs['num_gt'])
+    rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._detached_losses()
+    zero_grad(train_op)
     self._losses['total_loss'].backward()
     train_op.step()
     summary = self._run_summary_op()
@@ -1074,8 +1196,8 @@ class Network(nn.Module):
     return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss, summary
 
   def train_step_no_return(self, blobs, train_op):
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
-    train_op.zero_grad()
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], num_gt=blobs['num_gt'])
+    zero_grad(train_op)
     self._losses['total_loss'].backward()
     train_op.step()
     self.delete_intermediate_states()
@@ -1087,7 +1209,9 @@ class Network(nn.Module):
     To provide back compatibility, we overwrite the load_state_dict
     """
     netDict = self.state_dict()
-    stateDict = {k: v for k, v in state_dict.items() if k in netDict}
+    # Look up only the keys of this network, so a lazily loaded checkpoint
+    # never reads the tensors that are dropped
+    stateDict = {k: state_dict[k] for k in netDict if k in state_dict}
     netDict.update(stateDict)
     nn.Module.load_state_dict(self, netDict)
 
@@ -40,23 +40,26 @@ class RoIDataLayer(object):
       #np.random.seed(millis)
     
     if cfg.TRAIN.ASPECT_GROUPING:
+      # Group the images of a minibatch by orientation so that the blob
+      # they are padded into wastes as little computation as possible
+      ims_per_batch = cfg.TRAIN.IMS_PER_BATCH
       widths = np.array([r['width'] for r in self._roidb])
       heights = np.array([r['height'] for r in self._roidb])
       horz = (widths >= heights)
       vert = np.logical_not(horz)
-      horz_inds = np.where(horz)[0]
-      vert_inds = np.where(vert)[0]
-      inds = np.hstack((
-          np.random.permutation(horz_inds),
-          np.random.permutation(vert_inds)))
-      inds = np.reshape(inds, (-1, 2))
+      horz_inds = np.random.permutation(np.where(horz)[0])
+      vert_inds = np.random.permutation(np.where(vert)[0])
+      # drop the remainder of each group so that no batch mixes orientations
+      horz_inds = horz_inds[:len(horz_inds) // ims_per_batch * ims_per_batch]
+      vert_inds = vert_inds[:len(vert_inds) // ims_per_batch * ims_per_batch]
+      inds = np.hstack((horz_inds, vert_inds))
+      inds = np.reshape(inds, (-1, ims_per_batch))
       row_perm = np.random.permutation(np.arange(inds.shape[0]))
       inds = np.reshape(inds[row_perm, :], (-1,))
       self._perm = inds
     else:
-      self._perm = np.random.permutation(np.arange(len(self._roidb)))
-    ##no shuffle
-    self._perm = np.arange(len(self._roidb))
+      ##no shuffle
+      self._perm = np.arange(len(self._roidb))
     # Restore the random state
     #if self._random:
       #np.random.set_state(st0)
@@ -66,7 +69,7 @@ class RoIDataLayer(object):
   def _get_next_minibatch_inds(self):
     """Return the roidb indices for the next minibatch."""
     
-    if self._cur + cfg.TRAIN.IMS_PER_BATCH >= len(self._roidb):
+    if self._cur + cfg.TRAIN.IMS_PER_BATCH >= len(self._perm):
       self._shuffle_roidb_inds()
 
     db_inds = self._perm[self._cur:self._cur + cfg.TRAIN.IMS_PER_BATCH]
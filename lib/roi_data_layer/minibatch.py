@@ -14,7 +14,7 @@ import numpy as np
 import numpy.random as npr
 import cv2
 from model.config import cfg
-from utils.blob import prep_im_for_blob, im_list_to_blob
+from utils.blob import prep_im_for_blob, im_list_to_blob, band_rows
 
 def get_minibatch(roidb, num_classes):
   """Given a roidb, construct a minibatch sampled from it."""
@@ -29,28 +29,43 @@ def get_minibatch(roidb, num_classes):
     format(num_images, cfg.TRAIN.BATCH_SIZE)
 
   # Get the input image blob, formatted for caffe
-  im_blob, im_scales, im_path, orig_imshape = _get_image_blob(roidb, random_scale_inds)
+  im_blob, im_scales, im_shapes, im_path, orig_imshapes, crop_rows = \
+    _get_image_blob(roidb, random_scale_inds)
 
   blobs = {'data': im_blob}
   blobs['data_path'] = im_path
 
-  assert len(im_scales) == 1, "Single batch only"
-  assert len(roidb) == 1, "Single batch only"
-  
-  # gt boxes: (x1, y1, x2, y2, cls)
-  if cfg.TRAIN.USE_ALL_GT:
-    # Include all ground truth boxes
-    gt_inds = np.where(roidb[0]['gt_classes'] != 0)[0]
-  else:
-    # For the COCO ground truth boxes, exclude the ones that are ''iscrowd'' 
-    gt_inds = np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
-  gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
-  gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
-  gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
-  blobs['gt_boxes'] = gt_boxes
-  blobs['im_info'] = np.array(
-    [im_blob.shape[1], im_blob.shape[2], im_scales[0], orig_imshape[0], orig_imshape[1], orig_imshape[2]],
-    dtype=np.float32)
+  # gt boxes: (x1, y1, x2, y2, cls), stacked over the images of the batch;
+  # num_gt tells how many of them belong to each image
+  gt_boxes = []
+  num_gt = np.zeros(num_images, dtype=np.int32)
+  im_info = np.zeros((num_images, 6), dtype=np.float32)
+  for i in range(num_images):
+    if cfg.TRAIN.USE_ALL_GT:
+      # Include all ground truth boxes
+      gt_inds = np.where(roidb[i]['gt_classes'] != 0)[0]
+    else:
+      # For the COCO ground truth boxes, exclude the ones that are ''iscrowd'' 
+      gt_inds = np.where(roidb[i]['gt_classes'] != 0 & np.all(roidb[i]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+    boxes = roidb[i]['boxes'][gt_inds, :].astype(np.float32)
+    if crop_rows[i] is not None:
+      # in the rows of the crop band, without the boxes mostly outside of it
+      first, last = crop_rows[i]
+      keep = _in_band(boxes, first, last)
+      gt_inds, boxes = gt_inds[keep], boxes[keep]
+      boxes[:, 1::2] = np.clip(boxes[:, 1::2] - first, 0, last - first - 1)
+    im_gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
+    im_gt_boxes[:, 0:4] = boxes * im_scales[i]
+    im_gt_boxes[:, 4] = roidb[i]['gt_classes'][gt_inds]
+    gt_boxes.append(im_gt_boxes)
+    num_gt[i] = len(gt_inds)
+    # the blob is padded to the largest image, im_info keeps the valid region
+    im_info[i, :] = [im_shapes[i][0], im_shapes[i][1], im_scales[i],
+                     orig_imshapes[i][0], orig_imshapes[i][1], orig_imshapes[i][2]]
+
+  blobs['gt_boxes'] = np.vstack(gt_boxes)
+  blobs['num_gt'] = num_gt
+  blobs['im_info'] = im_info
 
   return blobs
 
@@ -61,20 +76,43 @@ def _get_image_blob(roidb, scale_inds):
   num_images = len(roidb)
   processed_ims = []
   im_scales = []
+  im_shapes = []
   im_path = []
+  orig_imshapes = []
+  crop_rows = []
   for i in range(num_images):
     im = cv2.imread(roidb[i]['image'])
-    orig_imshape = im.shape
+    rows = _crop_rows(roidb[i], im.shape[0]) if cfg.CROP_BAND else None
+    crop_rows.append(rows)
+    # the shape of the image the boxes are in
+    orig_imshapes.append(im.shape if rows is None else (rows[1] - rows[0],) + im.shape[1:])
     im_path.append(roidb[i]['image'])
     if roidb[i]['flipped']:
       im = im[:, ::-1, :]
     target_size = cfg.TRAIN.SCALES[scale_inds[i]]
     im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size,
-                    cfg.TRAIN.MAX_SIZE)
+                    cfg.TRAIN.MAX_SIZE, rows)
     im_scales.append(im_scale)
+    im_shapes.append(im.shape)
     processed_ims.append(im)
 
   # Create a blob to hold the input images
   blob = im_list_to_blob(processed_ims)
 
-  return blob, im_scales, im_path, orig_imshape
+  return blob, im_scales, im_shapes, im_path, orig_imshapes, crop_rows
+
+def _in_band(boxes, first, last):
+  """Whether at least TRAIN.CROP_BAND_MIN_VISIBLE of the height of each of
+  the boxes is within the rows [first, last) of the crop band."""
+  heights = boxes[:, 3] - boxes[:, 1] + 1
+  visible = np.minimum(boxes[:, 3], last - 1) - np.maximum(boxes[:, 1], first) + 1
+  return (visible > 0) & (visible >= cfg.TRAIN.CROP_BAND_MIN_VISIBLE * heights)
+
+def _crop_rows(entry, height):
+  """The rows of cfg.CROP_BAND of the image of the roidb entry, or None
+  when none of its ground truth boxes is kept in the band."""
+  first, last = band_rows(height, cfg.CROP_BAND)
+  boxes = entry['boxes'][entry['gt_classes'] != 0].astype(np.float32)
+  if len(boxes) > 0 and not np.any(_in_band(boxes, first, last)):
+    return None
+  return first, last
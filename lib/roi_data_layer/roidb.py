@@ -52,3 +52,33 @@ def prepare_roidb(imdb):
     # max overlap > 0 => class should not be zero (must be a fg class)
     nonzero_inds = np.where(max_overlaps > 0)[0]
     assert all(max_classes[nonzero_inds] != 0)
+
+def gt_crop_band(roidb, coverage=0.99, margin=0.02):
+  """The [top, bottom] crop band (see cfg.CROP_BAND) of the ground truth
+  boxes of roidb: the fractions of the image height above which the top
+  edges and below which the bottom edges of coverage of the boxes are,
+  widened by margin. Empty if roidb has no box."""
+  assert len(roidb) == 0 or 'height' in roidb[0], \
+    'The crop band is derived from the image heights of prepare_roidb'
+  tops, bottoms = [], []
+  for entry in roidb:
+    boxes = entry['boxes'][entry['gt_classes'] != 0]
+    tops.append(boxes[:, 1] / float(entry['height']))
+    bottoms.append((boxes[:, 3] + 1) / float(entry['height']))
+  tops = np.concatenate(tops) if tops else np.zeros(0)
+  bottoms = np.concatenate(bottoms) if bottoms else np.zeros(0)
+  if len(tops) == 0:
+    return []
+  top = max(np.percentile(tops, 100. * (1. - coverage)) - margin, 0.)
+  bottom = min(np.percentile(bottoms, 100. * coverage) + margin, 1.)
+  # rounded outwards to whole percents
+  return [float(np.floor(top * 100.) / 100.), float(np.ceil(bottom * 100.) / 100.)]
+
+def set_crop_band(roidb):
+  """Set cfg.CROP_BAND to the gt_crop_band of the training roidb with
+  TRAIN.CROP_BAND_AUTO."""
+  if not cfg.TRAIN.CROP_BAND_AUTO:
+    return
+  cfg.CROP_BAND = gt_crop_band(roidb, cfg.TRAIN.CROP_BAND_COVERAGE, cfg.TRAIN.CROP_BAND_MARGIN)
+  print('Crop band {} of the ground truth boxes, test with --set CROP_BAND "{}"'.format(
+    cfg.CROP_BAND, cfg.CROP_BAND))
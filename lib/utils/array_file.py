@@ -0,0 +1,179 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+  from collections.abc import Mapping
+except ImportError:
+  from collections import Mapping
+
+import json
+import os
+import shutil
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+# An array file (compact checkpoints, detection stores) is the magic, the
+# length of a JSON header, the header and the raw array data. The header
+# lists every array with its section (the part of the name before the first
+# dot, e.g. the top level module 'vgg' or 'D_img' of a checkpoint), dtype,
+# shape and the offset of its data, aligned so that each array can be
+# memory-mapped on its own.
+_MAGIC = b'DACKPT01'
+_ALIGN = 64
+
+
+def _align(offset):
+  return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def section_of(key):
+  return key.split('.')[0]
+
+
+def _layout(specs):
+  """entries, header = _layout(specs)
+
+  Place the arrays of specs, (name, dtype, stored dtype, shape, nbytes)
+  tuples, one after the other in the data of an array file."""
+  entries = []
+  offset = 0
+  for name, dtype, stored, shape, nbytes in specs:
+    offset = _align(offset)
+    entries.append({'name': name, 'section': section_of(name), 'shape': list(shape),
+                    'stored': stored, 'dtype': dtype, 'offset': offset})
+    offset += nbytes
+  header = json.dumps({'tensors': entries}).encode('utf-8')
+  return entries, header
+
+
+def _write_header(fid, header):
+  fid.write(_MAGIC)
+  fid.write(struct.pack('<Q', len(header)))
+  fid.write(header)
+  return _align(len(_MAGIC) + 8 + len(header))
+
+
+def save_arrays(named_arrays, filename, half=False):
+  """Write (name, numpy array) pairs to an array file, storing the float32
+  arrays as float16 if half is set."""
+  specs = []
+  arrays = []
+  for name, a in named_arrays:
+    dtype, shape = a.dtype.str, a.shape
+    if half and a.dtype == np.float32:
+      a = a.astype(np.float16)
+    a = np.ascontiguousarray(a)
+    specs.append((name, dtype, a.dtype.str, shape, a.nbytes))
+    arrays.append(a)
+
+  entries, header = _layout(specs)
+  with open(filename, 'wb') as fid:
+    data_start = _write_header(fid, header)
+    for e, a in zip(entries, arrays):
+      fid.seek(data_start + e['offset'])
+      fid.write(a.tobytes())
+
+
+class ArrayFileWriter(object):
+  """Write an array file whose arrays grow by appending rows, without
+  keeping them in memory: every array is spooled to a temporary file next
+  to filename, and close() copies them into place."""
+
+  def __init__(self, filename):
+    self.filename = filename
+    self._columns = OrderedDict()
+
+  def append(self, name, rows):
+    rows = np.ascontiguousarray(rows)
+    if name not in self._columns:
+      fid = open('{:s}.{:s}.tmp'.format(self.filename, name), 'w+b')
+      self._columns[name] = {'fid': fid, 'dtype': rows.dtype,
+                             'shape': rows.shape[1:], 'rows': 0}
+    column = self._columns[name]
+    assert rows.dtype == column['dtype'] and rows.shape[1:] == column['shape'], \
+      'rows of {:s} do not match the previous ones'.format(name)
+    column['fid'].write(rows.tobytes())
+    column['rows'] += rows.shape[0]
+
+  def close(self, named_arrays=()):
+    """Write the file, with the (name, numpy array) pairs of named_arrays
+    after the appended arrays."""
+    named_arrays = [(name, np.require(a, requirements='C')) for name, a in named_arrays]
+    specs = [(name, c['dtype'].str, c['dtype'].str, (c['rows'],) + c['shape'],
+              c['rows'] * int(np.prod(c['shape'])) * c['dtype'].itemsize)
+             for name, c in self._columns.items()]
+    specs += [(name, a.dtype.str, a.dtype.str, a.shape, a.nbytes) for name, a in named_arrays]
+    entries, header = _layout(specs)
+    with open(self.filename, 'wb') as fid:
+      data_start = _write_header(fid, header)
+      for e, (name, c) in zip(entries, self._columns.items()):
+        fid.seek(data_start + e['offset'])
+        c['fid'].seek(0)
+        shutil.copyfileobj(c['fid'], fid)
+      for e, (name, a) in zip(entries[len(self._columns):], named_arrays):
+        fid.seek(data_start + e['offset'])
+        fid.write(a.tobytes())
+    self.discard()
+
+  def discard(self):
+    """Drop the temporary files."""
+    for c in self._columns.values():
+      c['fid'].close()
+      os.remove(c['fid'].name)
+    self._columns = OrderedDict()
+
+
+def is_compact(filename):
+  with open(filename, 'rb') as fid:
+    return fid.read(len(_MAGIC)) == _MAGIC
+
+
+class ArrayFile(Mapping):
+  """Read-only mapping from the names of an array file to numpy arrays.
+
+  Nothing but the header is read when the file is opened; an array is
+  memory-mapped when it is looked up, so only the pages actually used are
+  read from disk. Sections listed in exclude are left out entirely.
+  """
+  def __init__(self, filename, exclude=()):
+    self._filename = filename
+    with open(filename, 'rb') as fid:
+      assert fid.read(len(_MAGIC)) == _MAGIC, '{:s} is not an array file'.format(filename)
+      length, = struct.unpack('<Q', fid.read(8))
+      header = json.loads(fid.read(length).decode('utf-8'))
+    self._data_start = _align(len(_MAGIC) + 8 + length)
+    self._entries = OrderedDict((e['name'], e) for e in header['tensors']
+                                if e['section'] not in exclude)
+
+  def sections(self):
+    return sorted(set(e['section'] for e in self._entries.values()))
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __iter__(self):
+    return iter(self._entries)
+
+  def __getitem__(self, name):
+    e = self._entries[name]
+    stored = np.dtype(e['stored'])
+    shape = tuple(e['shape'])
+    if int(np.prod(shape)) == 0:
+      a = np.empty(shape, dtype=stored)
+    else:
+      # Copy-on-write, so the arrays are writable without touching the file
+      a = np.memmap(self._filename, dtype=stored, mode='c',
+                    offset=self._data_start + e['offset'],
+                    shape=shape if shape else (1,))
+      if not shape:
+        a = np.array(a[0])
+    if e['dtype'] != e['stored']:
+      a = a.astype(np.dtype(e['dtype']))
+    return a
@@ -30,12 +30,29 @@ def im_list_to_blob(ims):
   return blob
 
 
-def prep_im_for_blob(im, pixel_means, target_size, max_size):
-  """Mean subtract and scale an image for use in a blob."""
+def band_rows(height, band):
+  """The (first, last + 1) rows of an image of height rows in band, a
+  [top, bottom] pair of fractions of the height (cfg.CROP_BAND); all the
+  rows if band is empty."""
+  if not band:
+    return 0, height
+  first = max(int(np.floor(band[0] * height)), 0)
+  last = min(max(int(np.ceil(band[1] * height)), first + 1), height)
+  return first, last
+
+
+def prep_im_for_blob(im, pixel_means, target_size, max_size, rows=None):
+  """Mean subtract and scale an image for use in a blob.
+
+  With rows, the (first, last + 1) rows of band_rows, only these rows are
+  kept, cropped before resizing; the scale is still the one of the whole
+  image."""
+  im_shape = im.shape
+  if rows is not None:
+    im = im[rows[0]:rows[1]]
   im = im.astype(np.float32, copy=False)
   im -= pixel_means
 
-  im_shape = im.shape
   im_size_min = np.min(im_shape[0:2])
   im_size_max = np.max(im_shape[0:2])
   im_scale = float(target_size) / float(im_size_min)
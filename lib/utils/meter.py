@@ -0,0 +1,42 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Running averages of the training losses."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+
+import torch
+
+class LossMeter(object):
+  """Sums the losses of every step on the device.
+
+  Adding a step only queues an addition on the GPU; the sums are copied to
+  the host, which waits for the device, only when average() is called.
+  """
+  def __init__(self, names):
+    self._names = list(names)
+    self.reset()
+
+  def reset(self):
+    self._sums = None
+    self._count = 0
+
+  def add(self, losses):
+    """Accumulate one step, given the loss tensors in the order of names."""
+    assert len(losses) == len(self._names)
+    values = torch.cat([loss.detach().view(1) for loss in losses])
+    self._sums = values if self._sums is None else self._sums + values
+    self._count += 1
+
+  def average(self):
+    """Return the mean of every loss since the last read and reset."""
+    if self._count == 0:
+      return OrderedDict((name, 0.) for name in self._names)
+    sums = self._sums.cpu().numpy() / self._count
+    self.reset()
+    return OrderedDict(zip(self._names, sums.tolist()))
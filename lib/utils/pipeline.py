@@ -0,0 +1,170 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue
+import threading
+import time
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+# Marks the end of the items of a queue
+_DONE = object()
+
+
+class Prefetcher(object):
+  """Iterate over func(item) for the items of items, in order, computed
+  ahead on a pool of threads.
+
+  At most threads calls run at a time and ahead results wait to be read,
+  so memory stays bounded however far the reader lags behind. An error of
+  func is raised by the iteration, at the item it failed on.
+  """
+  def __init__(self, func, items, threads=4, ahead=8):
+    self._results = queue.Queue(maxsize=ahead)
+    self._thread = threading.Thread(target=self._run, args=(func, items, threads))
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self, func, items, threads):
+    pool = ThreadPool(threads)
+    pending = deque()
+    try:
+      for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= threads:
+          self._results.put((True, pending.popleft().get()))
+      while pending:
+        self._results.put((True, pending.popleft().get()))
+      self._results.put(_DONE)
+    except Exception as e:
+      self._results.put((False, e))
+    finally:
+      pool.close()
+
+  def __iter__(self):
+    while True:
+      result = self._results.get()
+      if result is _DONE:
+        return
+      ok, value = result
+      if not ok:
+        raise value
+      yield value
+
+
+class Worker(object):
+  """Call func on the arguments given to put, in order, on a background
+  thread; put blocks while depth calls are pending. Like CheckpointWriter,
+  an error of func is raised by the next put or by close, and the calls
+  queued after it are dropped."""
+  def __init__(self, func, depth=8):
+    self._func = func
+    self._jobs = queue.Queue(maxsize=depth)
+    self._error = None
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def put(self, *args):
+    self._raise_error()
+    self._jobs.put(args)
+
+  def close(self):
+    """Wait for the pending calls."""
+    self._jobs.put(_DONE)
+    self._thread.join()
+    self._raise_error()
+
+  def _raise_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def _run(self):
+    while True:
+      args = self._jobs.get()
+      if args is _DONE:
+        return
+      if self._error is not None:
+        continue
+      try:
+        self._func(*args)
+      except Exception as e:
+        self._error = e
+
+
+class _Request(object):
+  def __init__(self, item):
+    self.item = item
+    self.result = None
+    self.error = None
+    self.done = threading.Event()
+
+
+class MicroBatcher(object):
+  """Coalesce the calls of concurrent threads into batches.
+
+  batcher(item) blocks until func, called on a background thread with the
+  list of the items of a batch, returns the list of their results, and
+  returns the result of item. A batch is closed when max_batch items are
+  waiting or max_wait seconds after its first item came, whichever is
+  first. An error of func is raised in every call of the batch.
+  """
+  def __init__(self, func, max_batch=8, max_wait=0.01):
+    self._func = func
+    self._max_batch = max_batch
+    self._max_wait = max_wait
+    self._requests = queue.Queue()
+    self._lock = threading.Lock()
+    self.batches = 0
+    self.items = 0
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def __call__(self, item):
+    request = _Request(item)
+    self._requests.put(request)
+    request.done.wait()
+    if request.error is not None:
+      raise request.error
+    return request.result
+
+  def stats(self):
+    """Number of batches run and of items in them."""
+    with self._lock:
+      return {'batches': self.batches, 'items': self.items}
+
+  def _run(self):
+    while True:
+      batch = [self._requests.get()]
+      deadline = time.time() + self._max_wait
+      while len(batch) < self._max_batch:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          break
+        try:
+          batch.append(self._requests.get(timeout=timeout))
+        except queue.Empty:
+          break
+      try:
+        results = self._func([request.item for request in batch])
+        for request, result in zip(batch, results):
+          request.result = result
+      except Exception as e:
+        for request in batch:
+          request.error = e
+      finally:
+        with self._lock:
+          self.batches += 1
+          self.items += len(batch)
+        for request in batch:
+          request.done.set()
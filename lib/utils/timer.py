@@ -5,7 +5,10 @@
 # Written by Ross Girshick
 # --------------------------------------------------------
 
+import threading
 import time
+from collections import OrderedDict
+
 import torch
 
 class Timer(object):
@@ -40,4 +43,57 @@ class Timer(object):
     def total_time(self, name='default'):
         return self._total_time[name]
 
+class SampledTimer(object):
+    """Average time per step over a window of steps.
+
+    Unlike Timer, the device is only synchronized when the window is read,
+    so the host can queue work ahead of the GPU in between.
+    """
+    def __init__(self):
+        self._start_time = None
+        self._steps = 0
+
+    def start(self):
+        torch.cuda.synchronize()
+        self._start_time = time.time()
+        self._steps = 0
+
+    def step(self):
+        self._steps += 1
+
+    def average_time(self):
+        """Time per step since the last read (or start), then open a new window."""
+        torch.cuda.synchronize()
+        now = time.time()
+        average = (now - self._start_time) / max(self._steps, 1)
+        self._start_time = now
+        self._steps = 0
+        return average
+
+class StageTimer(object):
+    """Time spent per item in the stages of a pipeline.
+
+    The stages may run on several threads at once: each reports the
+    seconds it spent on a number of items, and the average is the time per
+    item of the stage, in the order the stages first reported.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._total_time = OrderedDict()
+        self._items = {}
+
+    def add(self, name, seconds, items=1):
+        with self._lock:
+            self._total_time[name] = self._total_time.get(name, 0.) + seconds
+            self._items[name] = self._items.get(name, 0) + items
+
+    def average_time(self, name):
+        with self._lock:
+            return self._total_time[name] / max(self._items[name], 1)
+
+    def summary(self):
+        with self._lock:
+            return ' '.join('{:s} {:.3f}s'.format(name, total / max(self._items[name], 1))
+                            for name, total in self._total_time.items())
+
 timer = Timer()
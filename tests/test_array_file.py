@@ -0,0 +1,153 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# The array file format of the compact checkpoints and detection stores.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import os.path as osp
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'lib'))
+
+from utils.array_file import ArrayFile, ArrayFileWriter, save_arrays, is_compact
+
+
+def named_arrays(rng):
+  return [('vgg.conv1.weight', rng.randn(8, 3, 3, 3).astype(np.float32)),
+          ('vgg.conv1.bias', rng.randn(8).astype(np.float32)),
+          # not contiguous
+          ('D_img.fc.weight', rng.randn(5, 7).astype(np.float32).T),
+          ('D_img.steps', np.array(12345, dtype=np.int64)),
+          ('D_img.scale', np.array(0.5, dtype=np.float32)),
+          ('rpn.mask', rng.rand(3, 5) > 0.5),
+          ('rpn.ids', np.arange(7, dtype=np.int32)),
+          ('rpn.empty', np.zeros((0, 4), dtype=np.float32)),
+          ('offsets', np.array([0, 3, 3, 9], dtype=np.int64))]
+
+
+def test_round_trip(tmpdir):
+  rng = np.random.RandomState(0)
+  arrays = named_arrays(rng)
+  filename = str(tmpdir.join('arrays.arr'))
+  save_arrays(arrays, filename)
+
+  loaded = ArrayFile(filename)
+  assert list(loaded) == [name for name, _ in arrays]
+  assert loaded.sections() == ['D_img', 'offsets', 'rpn', 'vgg']
+  for name, a in arrays:
+    assert loaded[name].dtype == a.dtype and loaded[name].shape == a.shape, name
+    np.testing.assert_array_equal(loaded[name], a)
+  # 0-d arrays come back as 0-d arrays, not one element ones
+  assert loaded['D_img.steps'].shape == () and int(loaded['D_img.steps']) == 12345
+
+
+def test_alignment(tmpdir):
+  rng = np.random.RandomState(1)
+  filename = str(tmpdir.join('arrays.arr'))
+  # odd sizes, so the arrays would not be aligned one after the other
+  arrays = [('a{:d}'.format(i), rng.randn(n).astype(np.float32))
+            for i, n in enumerate([1, 3, 17, 5, 64, 2])]
+  save_arrays(arrays, filename)
+  loaded = ArrayFile(filename)
+  for name, a in arrays:
+    mapped = loaded[name]
+    assert isinstance(mapped, np.memmap)
+    assert mapped.offset % 64 == 0, name
+    np.testing.assert_array_equal(mapped, a)
+
+
+def test_half(tmpdir):
+  rng = np.random.RandomState(2)
+  weight = rng.randn(4, 6).astype(np.float32)
+  ids = np.arange(4, dtype=np.int64)
+  save_arrays([('ids', ids), ('weight', weight)], str(tmpdir.join('full.arr')))
+  save_arrays([('ids', ids), ('weight', weight)], str(tmpdir.join('half.arr')), half=True)
+  loaded = ArrayFile(str(tmpdir.join('half.arr')))
+  # stored as float16, given back as float32
+  assert loaded['weight'].dtype == np.float32
+  np.testing.assert_array_equal(loaded['weight'], weight.astype(np.float16).astype(np.float32))
+  np.testing.assert_array_equal(loaded['ids'], ids)
+  assert os.path.getsize(str(tmpdir.join('full.arr'))) - \
+    os.path.getsize(str(tmpdir.join('half.arr'))) == weight.nbytes // 2
+
+
+def test_exclude(tmpdir):
+  filename = str(tmpdir.join('arrays.arr'))
+  save_arrays(named_arrays(np.random.RandomState(3)), filename)
+  loaded = ArrayFile(filename, exclude=('D_img', 'rpn'))
+  assert loaded.sections() == ['offsets', 'vgg']
+  assert list(loaded) == ['vgg.conv1.weight', 'vgg.conv1.bias', 'offsets']
+  with pytest.raises(KeyError):
+    loaded['D_img.steps']
+
+
+def test_copy_on_write(tmpdir):
+  filename = str(tmpdir.join('arrays.arr'))
+  save_arrays([('a', np.arange(10, dtype=np.float32))], filename)
+  a = ArrayFile(filename)['a']
+  a[:] = -1.
+  np.testing.assert_array_equal(ArrayFile(filename)['a'], np.arange(10, dtype=np.float32))
+
+
+def test_is_compact(tmpdir):
+  save_arrays([('a', np.zeros(3))], str(tmpdir.join('arrays.arr')))
+  with open(str(tmpdir.join('arrays.pkl')), 'wb') as f:
+    pickle.dump({'a': np.zeros(3)}, f)
+  assert is_compact(str(tmpdir.join('arrays.arr')))
+  assert not is_compact(str(tmpdir.join('arrays.pkl')))
+  with pytest.raises(AssertionError):
+    ArrayFile(str(tmpdir.join('arrays.pkl')))
+
+
+def test_writer(tmpdir):
+  rng = np.random.RandomState(4)
+  filename = str(tmpdir.join('arrays.arr'))
+  writer = ArrayFileWriter(filename)
+  chunks = [rng.randn(n, 4).astype(np.float32) for n in [0, 3, 0, 5, 1]]
+  for rows in chunks:
+    writer.append('boxes', rows)
+    writer.append('images', np.full(len(rows), len(rows), dtype=np.int32))
+  writer.close([('offsets', np.cumsum([0] + [len(c) for c in chunks])),
+                ('num_classes', np.array(9, dtype=np.int64))])
+  # the temporary files are gone
+  assert os.listdir(str(tmpdir)) == ['arrays.arr']
+
+  loaded = ArrayFile(filename)
+  assert list(loaded) == ['boxes', 'images', 'offsets', 'num_classes']
+  np.testing.assert_array_equal(loaded['boxes'], np.vstack(chunks))
+  np.testing.assert_array_equal(loaded['images'],
+                                np.concatenate([[len(c)] * len(c) for c in chunks]))
+  assert loaded['num_classes'].shape == () and int(loaded['num_classes']) == 9
+  for name in loaded:
+    if loaded[name].size > 1:
+      assert loaded[name].offset % 64 == 0, name
+
+
+def test_writer_empty_column(tmpdir):
+  filename = str(tmpdir.join('arrays.arr'))
+  writer = ArrayFileWriter(filename)
+  writer.append('boxes', np.zeros((0, 4), dtype=np.float32))
+  writer.close()
+  loaded = ArrayFile(filename)
+  assert loaded['boxes'].shape == (0, 4) and loaded['boxes'].dtype == np.float32
+
+
+def test_writer_mismatch_and_discard(tmpdir):
+  filename = str(tmpdir.join('arrays.arr'))
+  writer = ArrayFileWriter(filename)
+  writer.append('boxes', np.zeros((2, 4), dtype=np.float32))
+  with pytest.raises(AssertionError):
+    writer.append('boxes', np.zeros((2, 5), dtype=np.float32))
+  with pytest.raises(AssertionError):
+    writer.append('boxes', np.zeros((2, 4), dtype=np.float64))
+  writer.discard()
+  assert os.listdir(str(tmpdir)) == []
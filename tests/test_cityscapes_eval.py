@@ -0,0 +1,218 @@
+# --------------------------------------------------------
+# Fast/er R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Check cityscapes_eval, which reuses the vectorized matching of voc_eval,
+# and the in-memory evaluation of the cityscapes imdb against the original
+# cityscapes_eval, copied below as it was before.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import os.path as osp
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'lib'))
+
+from datasets.cityscapes_eval import cityscapes_eval, parse_rec, voc_ap
+from datasets.voc_eval import eval_all_boxes
+
+from test_voc_eval import ResultsFiles, random_dataset, random_all_boxes, \
+  assert_same_results, streamed_results
+
+CLASSES = ('__background__', 'car', 'person', 'bicycle')
+
+
+def original_cityscapes_eval(detpath,
+             annopath,
+             imagesetfile,
+             classname,
+             cachedir,
+             ovthresh=0.5,
+             use_07_metric=False,
+             use_diff=False):
+  """rec, prec, ap = voc_eval(detpath,
+                              annopath,
+                              imagesetfile,
+                              classname,
+                              [ovthresh],
+                              [use_07_metric])
+
+  Top level function that does the PASCAL VOC evaluation.
+
+  detpath: Path to detections
+      detpath.format(classname) should produce the detection results file.
+  annopath: Path to annotations
+      annopath.format(imagename) should be the xml annotations file.
+  imagesetfile: Text file containing the list of images, one image per line.
+  classname: Category name (duh)
+  cachedir: Directory for caching the annotations
+  [ovthresh]: Overlap threshold (default = 0.5)
+  [use_07_metric]: Whether to use VOC07's 11 point AP computation
+      (default False)
+  """
+  # assumes detections are in detpath.format(classname)
+  # assumes annotations are in annopath.format(imagename)
+  # assumes imagesetfile is a text file with each line an image name
+  # cachedir caches the annotations in a pickle file
+
+  # first load gt
+  if not os.path.isdir(cachedir):
+    os.mkdir(cachedir)
+  if 'foggy' in imagesetfile[0]:
+    cachefile = os.path.join(cachedir, '%s_annots.pkl' % 'cityscapes_foggy')
+  else:
+    cachefile = os.path.join(cachedir, '%s_annots.pkl' % 'cityscapes')
+  # read list of images
+
+  imagenames = imagesetfile
+
+  if not os.path.isfile(cachefile):
+    # load annotations
+    recs = {}
+    for i, imagename in enumerate(imagenames):
+      recs[imagename] = parse_rec(annopath.format(imagename[:imagename.find('_')], imagename[:imagename.find('leftImg8bit')]))
+      if i % 100 == 0:
+        print('Reading annotation for {:d}/{:d}'.format(
+          i + 1, len(imagenames)))
+    # save
+    print('Saving cached annotations to {:s}'.format(cachefile))
+    with open(cachefile, 'wb') as f:
+      pickle.dump(recs, f)
+  else:
+    # load
+    with open(cachefile, 'rb') as f:
+      try:
+        recs = pickle.load(f)
+      except:
+        recs = pickle.load(f, encoding='bytes')
+
+  # extract gt objects for this class
+  class_recs = {}
+  npos = 0
+  for imagename in imagenames:
+    R = [obj for obj in recs[imagename] if obj['name'] == classname]
+    bbox = np.array([x['bbox'] for x in R])
+    if use_diff:
+      difficult = np.array([False for x in R]).astype(np.bool)
+    else:
+      difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
+    det = [False] * len(R)
+    npos = npos + sum(~difficult)
+    class_recs[imagename] = {'bbox': bbox,
+                             'difficult': difficult,
+                             'det': det}
+
+  # read dets
+  detfile = detpath.format(classname)
+
+  with open(detfile, 'r') as f:
+    lines = f.readlines()
+
+  splitlines = [x.strip().split(' ') for x in lines]
+  image_ids = [x[0] for x in splitlines]
+  confidence = np.array([float(x[1]) for x in splitlines])
+  BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
+
+  nd = len(image_ids)
+  tp = np.zeros(nd)
+  fp = np.zeros(nd)
+
+  if BB.shape[0] > 0:
+    # sort by confidence
+    sorted_ind = np.argsort(-confidence)
+    sorted_scores = np.sort(-confidence)
+    BB = BB[sorted_ind, :]
+    image_ids = [image_ids[x] for x in sorted_ind]
+
+    # go down dets and mark TPs and FPs
+    for d in range(nd):
+      R = class_recs[image_ids[d]]
+      bb = BB[d, :].astype(float)
+      ovmax = -np.inf
+      BBGT = R['bbox'].astype(float)
+
+      if BBGT.size > 0:
+        # compute overlaps
+        # intersection
+        ixmin = np.maximum(BBGT[:, 0], bb[0])
+        iymin = np.maximum(BBGT[:, 1], bb[1])
+        ixmax = np.minimum(BBGT[:, 2], bb[2])
+        iymax = np.minimum(BBGT[:, 3], bb[3])
+        iw = np.maximum(ixmax - ixmin + 1., 0.)
+        ih = np.maximum(iymax - iymin + 1., 0.)
+        inters = iw * ih
+
+        # union
+        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
+               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
+               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
+
+        overlaps = inters / uni
+        ovmax = np.max(overlaps)
+        jmax = np.argmax(overlaps)
+
+      if ovmax > ovthresh:
+        if not R['difficult'][jmax]:
+          if not R['det'][jmax]:
+            tp[d] = 1.
+            R['det'][jmax] = 1
+          else:
+            fp[d] = 1.
+      else:
+        fp[d] = 1.
+
+  # compute precision recall
+  fp = np.cumsum(fp)
+  tp = np.cumsum(tp)
+  rec = tp / float(npos)
+  # avoid divide by zero in case the first detection matches a difficult
+  # ground truth
+  prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+  ap = voc_ap(rec, prec, use_07_metric)
+  print(classname, npos)
+  return rec, prec, ap
+
+
+def write_results_files(tmpdir, recs, imagenames, all_boxes):
+  """The detpath and cachedir of cityscapes_eval for the ground truth recs
+  and the detections all_boxes."""
+  cachedir = str(tmpdir.mkdir('cache'))
+  with open(os.path.join(cachedir, 'cityscapes_annots.pkl'), 'wb') as f:
+    pickle.dump(recs, f)
+  results = ResultsFiles(CLASSES, imagenames, str(tmpdir))
+  results._write_voc_results_file(all_boxes)
+  return results._get_voc_results_file_template(), cachedir
+
+
+@pytest.mark.parametrize('score_levels', [None, 4, 1000])
+@pytest.mark.parametrize('ovthresh', [0.5, 0.7])
+@pytest.mark.parametrize('seed', range(3))
+def test_cityscapes_eval(tmpdir, seed, ovthresh, score_levels):
+  rng = np.random.RandomState(800 + seed)
+  recs, imagenames = random_dataset(rng, num_images=15, classes=CLASSES[1:],
+                                    p_difficult=0.)
+  imagenames = ['frankfurt_{:06d}_000019_leftImg8bit'.format(i)
+                for i in range(len(imagenames))]
+  recs = dict(zip(imagenames, [recs[name] for name in sorted(recs)]))
+  all_boxes = random_all_boxes(rng, recs, imagenames, CLASSES, score_levels=score_levels)
+  detpath, cachedir = write_results_files(tmpdir, recs, imagenames, all_boxes)
+  annopath = str(tmpdir.join('{:s}', '{:s}gtFine_polygons.json'))
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    evaluated = [eval_all_boxes(all_boxes, CLASSES, imagenames, recs, ovthresh),
+                 streamed_results(all_boxes, CLASSES, imagenames, recs, ovthresh,
+                                  False, False)]
+    for cls in CLASSES[1:]:
+      expected = original_cityscapes_eval(detpath, annopath, imagenames, cls, cachedir,
+                                          ovthresh)
+      assert_same_results(cityscapes_eval(detpath, annopath, imagenames, cls, cachedir,
+                                          ovthresh), expected)
+      for results in evaluated:
+        assert_same_results(results[cls][:3], expected)
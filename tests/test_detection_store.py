@@ -0,0 +1,203 @@
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Round trips of the detection store, the on-disk format of the detections
+# that reval, the sharded test runs and the post-processing sweep read.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import os.path as osp
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'lib'))
+
+from datasets.detection_store import DetectionStore, DetectionWriter, \
+  DetectionStreamWriter, RawOutputs, RawOutputWriter, detection_store, \
+  merge_detection_stores, load_detections
+
+NUM_CLASSES = 4
+
+
+def random_all_boxes(rng, num_images=12, num_classes=NUM_CLASSES):
+  """all_boxes[cls][image] of test_net, with images without detections,
+  either [] or 0 x 5 arrays, and the last class never detected."""
+  all_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
+  for cls in range(1, num_classes - 1):
+    for i in range(num_images):
+      if i % 4 == 0:
+        continue
+      n = rng.randint(0, 5)
+      xy = rng.uniform(0., 500., (n, 2))
+      dets = np.hstack((xy, xy + rng.uniform(1., 100., (n, 2)), rng.rand(n, 1)))
+      all_boxes[cls][i] = dets.astype(np.float32)
+  return all_boxes
+
+
+def as_array(dets):
+  return np.asarray(dets, dtype=np.float32).reshape(-1, 5)
+
+
+def assert_same_detections(store, all_boxes):
+  assert len(store) == len(all_boxes)
+  for cls in range(len(all_boxes)):
+    assert len(store[cls]) == len(all_boxes[cls])
+    for i in range(len(all_boxes[cls])):
+      np.testing.assert_array_equal(store[cls][i], as_array(all_boxes[cls][i]))
+
+
+def assert_same_stores(a, b):
+  assert (a.num_images, a.num_classes) == (b.num_images, b.num_classes)
+  for name in ('boxes', 'scores', 'classes', 'images', 'offsets'):
+    np.testing.assert_array_equal(getattr(a, name), getattr(b, name))
+
+
+def test_round_trip():
+  rng = np.random.RandomState(0)
+  all_boxes = random_all_boxes(rng)
+  store = detection_store(all_boxes)
+  assert_same_detections(store, all_boxes)
+  assert store.boxes.dtype == np.float32 and store.scores.dtype == np.float32
+
+  # the detections of a class, by image and in their order in the image
+  images, scores, boxes = store.class_detections(1)
+  expected = np.vstack([as_array(d) for d in all_boxes[1]])
+  np.testing.assert_array_equal(images, np.repeat(np.arange(len(all_boxes[1])),
+                                                  [len(d) for d in all_boxes[1]]))
+  np.testing.assert_array_equal(scores, expected[:, 4])
+  np.testing.assert_array_equal(boxes, expected[:, :4])
+
+
+def test_empty():
+  all_boxes = [[[] for _ in range(3)] for _ in range(NUM_CLASSES)]
+  store = detection_store(all_boxes)
+  assert store.num_images == 3 and len(store.scores) == 0
+  assert_same_detections(store, all_boxes)
+  images, scores, boxes = store.class_detections(1)
+  assert images.shape == (0,) and scores.shape == (0,) and boxes.shape == (0, 4)
+
+
+def test_writer_images_out_of_order():
+  rng = np.random.RandomState(1)
+  all_boxes = random_all_boxes(rng)
+  writer = DetectionWriter(len(all_boxes[0]), NUM_CLASSES)
+  for i in rng.permutation(len(all_boxes[0])):
+    writer.add(i, [all_boxes[cls][i] for cls in range(NUM_CLASSES)])
+  assert_same_stores(writer.finish(), detection_store(all_boxes))
+
+
+def test_save_load(tmpdir):
+  rng = np.random.RandomState(2)
+  all_boxes = random_all_boxes(rng)
+  store = detection_store(all_boxes)
+  store.save(str(tmpdir.join('detections.dets')))
+  loaded = DetectionStore.load(str(tmpdir.join('detections.dets')))
+  assert_same_stores(loaded, store)
+  assert_same_detections(loaded, all_boxes)
+  assert_same_stores(load_detections(str(tmpdir)), store)
+
+
+def test_load_detections_pickle(tmpdir):
+  rng = np.random.RandomState(3)
+  all_boxes = random_all_boxes(rng)
+  with open(str(tmpdir.join('detections.pkl')), 'wb') as f:
+    pickle.dump(all_boxes, f)
+  loaded = load_detections(str(tmpdir))
+  for cls in range(NUM_CLASSES):
+    for i in range(len(all_boxes[cls])):
+      np.testing.assert_array_equal(as_array(loaded[cls][i]), as_array(all_boxes[cls][i]))
+
+
+@pytest.mark.parametrize('num_shards', [1, 2, 3])
+def test_merge_shards(num_shards):
+  rng = np.random.RandomState(4)
+  all_boxes = random_all_boxes(rng)
+  num_images = len(all_boxes[0])
+  # every shard covers all the images, and detects some of them
+  shards = []
+  for shard in range(num_shards):
+    writer = DetectionWriter(num_images, NUM_CLASSES)
+    for i in range(shard, num_images, num_shards):
+      writer.add(i, [all_boxes[cls][i] for cls in range(NUM_CLASSES)])
+    shards.append(writer.finish())
+  merged = merge_detection_stores(shards[::-1])
+  assert_same_stores(merged, detection_store(all_boxes))
+  assert_same_detections(merged, all_boxes)
+
+
+def test_merge_mismatched_shards():
+  a = DetectionWriter(3, NUM_CLASSES).finish()
+  b = DetectionWriter(4, NUM_CLASSES).finish()
+  with pytest.raises(AssertionError):
+    merge_detection_stores([a, b])
+
+
+def test_stream_writer(tmpdir):
+  rng = np.random.RandomState(5)
+  all_boxes = random_all_boxes(rng)
+  num_images = len(all_boxes[0])
+  filename = str(tmpdir.join('stream.dets'))
+  writer = DetectionStreamWriter(filename, NUM_CLASSES)
+  # the images left out have no detections
+  for i in range(0, num_images - 2, 2):
+    writer.add(i, [all_boxes[cls][i] for cls in range(NUM_CLASSES)])
+  writer.close(num_images, [('dropped', np.arange(1, num_images, 2, dtype=np.int32))])
+  assert os.listdir(str(tmpdir)) == ['stream.dets']
+
+  expected = [[d if i % 2 == 0 and i < num_images - 2 else [] for i, d in enumerate(dets)]
+              for dets in all_boxes]
+  loaded = DetectionStore.load(filename)
+  assert_same_stores(loaded, detection_store(expected))
+
+
+def test_stream_writer_in_order_and_discard(tmpdir):
+  filename = str(tmpdir.join('stream.dets'))
+  writer = DetectionStreamWriter(filename, NUM_CLASSES)
+  writer.add(2, [[] for _ in range(NUM_CLASSES)])
+  with pytest.raises(AssertionError):
+    writer.add(1, [[] for _ in range(NUM_CLASSES)])
+  writer.discard()
+  assert os.listdir(str(tmpdir)) == []
+
+
+def test_raw_outputs(tmpdir):
+  rng = np.random.RandomState(6)
+  filename = str(tmpdir.join('raw_outputs.arr'))
+  writer = RawOutputWriter(filename)
+  outputs = []
+  for n in [3, 0, 5, 1]:
+    scores = rng.rand(n, NUM_CLASSES)
+    boxes = rng.rand(n, 4 * NUM_CLASSES) * 500.
+    writer.add(scores, boxes)
+    outputs.append((scores, boxes))
+  writer.close()
+
+  raw = RawOutputs(filename)
+  assert raw.num_images == len(outputs)
+  for i, (scores, boxes) in enumerate(outputs):
+    raw_scores, raw_boxes = raw.image(i)
+    assert raw_scores.dtype == np.float32 and raw_scores.shape == scores.shape
+    np.testing.assert_array_equal(raw_scores, scores.astype(np.float32))
+    np.testing.assert_array_equal(raw_boxes, boxes.astype(np.float32))
+
+
+def test_apply_nms_store():
+  test = pytest.importorskip('model.test')
+  rng = np.random.RandomState(7)
+  all_boxes = random_all_boxes(rng)
+  # overlapping copies, to be suppressed
+  for cls in range(1, NUM_CLASSES - 1):
+    for i, dets in enumerate(all_boxes[cls]):
+      if len(dets) > 0:
+        copies = dets + np.array([2., 2., 2., 2., -0.01], dtype=np.float32)
+        all_boxes[cls][i] = np.vstack((dets, copies))
+  nms_store = test.apply_nms(detection_store(all_boxes), 0.3)
+  assert isinstance(nms_store, DetectionStore)
+  assert_same_detections(nms_store, test.apply_nms(all_boxes, 0.3))
@@ -0,0 +1,91 @@
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Check greedy_coverage, the matching of the proposals to the gt boxes of
+# imdb.evaluate_recall, against the loop it replaced.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os.path as osp
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'lib'))
+
+from datasets.imdb import greedy_coverage
+
+
+def original_coverage(overlaps):
+  """The loop of the original evaluate_recall, recording the coverage of
+  every gt box instead of appending it in the order of the matches. It
+  asserted once the proposals ran out (fewer proposals than gt boxes); the
+  boxes left are then returned with a coverage of 0."""
+  overlaps = overlaps.copy()
+  coverage = np.zeros(overlaps.shape[1])
+  for j in range(overlaps.shape[1]):
+    # find which proposal box maximally covers each gt box
+    argmax_overlaps = overlaps.argmax(axis=0)
+    # and get the iou amount of coverage for each gt box
+    max_overlaps = overlaps.max(axis=0)
+    # find which gt box is 'best' covered (i.e. 'best' = most iou)
+    gt_ind = max_overlaps.argmax()
+    gt_ovr = max_overlaps.max()
+    if gt_ovr < 0:
+      assert j == overlaps.shape[0]
+      break
+    # find the proposal box that covers the best covered gt box
+    box_ind = argmax_overlaps[gt_ind]
+    # record the iou coverage of this gt box
+    coverage[gt_ind] = overlaps[box_ind, gt_ind]
+    assert (coverage[gt_ind] == gt_ovr)
+    # mark the proposal box and the gt box as used
+    overlaps[box_ind, :] = -1
+    overlaps[:, gt_ind] = -1
+  return coverage
+
+
+def random_overlaps(rng, levels=None):
+  num_boxes = rng.randint(1, 30)
+  num_gt = rng.randint(1, 12)
+  overlaps = rng.rand(num_boxes, num_gt)
+  # most proposals overlap few of the boxes
+  overlaps[rng.rand(num_boxes, num_gt) < 0.5] = 0.
+  if levels is not None:
+    overlaps = np.floor(overlaps * levels) / levels
+  return overlaps
+
+
+@pytest.mark.parametrize('levels', [None, 2, 4, 10])
+def test_random_overlaps(levels):
+  rng = np.random.RandomState(0 if levels is None else levels)
+  for _ in range(2000):
+    overlaps = random_overlaps(rng, levels)
+    np.testing.assert_array_equal(greedy_coverage(overlaps), original_coverage(overlaps))
+
+
+def test_fewer_proposals_than_boxes():
+  rng = np.random.RandomState(1)
+  for _ in range(500):
+    overlaps = random_overlaps(rng, levels=4)[:rng.randint(1, 4)]
+    overlaps = np.hstack((overlaps, rng.rand(overlaps.shape[0], 4)))
+    assert overlaps.shape[0] < overlaps.shape[1]
+    coverage = greedy_coverage(overlaps)
+    np.testing.assert_array_equal(coverage, original_coverage(overlaps))
+    assert np.sum(coverage > 0) <= overlaps.shape[0]
+
+
+def test_all_tied():
+  for num_boxes, num_gt in [(1, 1), (3, 3), (5, 2), (2, 5)]:
+    for value in [0., 0.5, 1.]:
+      overlaps = np.full((num_boxes, num_gt), value)
+      np.testing.assert_array_equal(greedy_coverage(overlaps), original_coverage(overlaps))
+
+
+def test_no_proposals_or_boxes():
+  np.testing.assert_array_equal(greedy_coverage(np.zeros((0, 3))), np.zeros(3))
+  np.testing.assert_array_equal(greedy_coverage(np.zeros((3, 0))), np.zeros(0))
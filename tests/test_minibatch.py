@@ -0,0 +1,83 @@
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# The ground truth boxes of the training images cropped to cfg.CROP_BAND.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os.path as osp
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'lib'))
+
+cv2 = pytest.importorskip('cv2')
+
+from model.config import cfg
+from roi_data_layer import minibatch
+
+HEIGHT, WIDTH = 200, 300
+# rows [50, 150) of the image
+BAND = [0.25, 0.75]
+
+
+@pytest.fixture
+def band_cfg():
+  saved = cfg.CROP_BAND, cfg.TRAIN.SCALES, cfg.TRAIN.MAX_SIZE, cfg.TRAIN.CROP_BAND_MIN_VISIBLE
+  cfg.CROP_BAND = BAND
+  cfg.TRAIN.SCALES = (HEIGHT,)
+  cfg.TRAIN.MAX_SIZE = 1000
+  cfg.TRAIN.CROP_BAND_MIN_VISIBLE = 0.5
+  yield
+  cfg.CROP_BAND, cfg.TRAIN.SCALES, cfg.TRAIN.MAX_SIZE, cfg.TRAIN.CROP_BAND_MIN_VISIBLE = saved
+
+
+def roidb_entry(tmpdir, boxes):
+  image = str(tmpdir.join('image.png'))
+  cv2.imwrite(image, np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8))
+  boxes = np.array(boxes, dtype=np.uint16).reshape(-1, 4)
+  return {'image': image, 'flipped': False, 'boxes': boxes,
+          'gt_classes': np.ones(len(boxes), dtype=np.int32)}
+
+
+def test_slivers_dropped(tmpdir, band_cfg):
+  entry = roidb_entry(tmpdir, [[10, 60, 50, 100],     # inside
+                               [10, 0, 50, 50],       # 1 of 51 rows in the band
+                               [10, 149, 50, 199],    # 1 of 51 rows in the band
+                               [10, 30, 50, 69],      # 20 of 40 rows in the band
+                               [10, 130, 50, 179],    # 20 of 50 rows in the band
+                               [10, 0, 50, 40]])      # outside
+  blobs = minibatch.get_minibatch([entry], 2)
+  assert blobs['data'].shape[1] == 100
+  np.testing.assert_array_equal(blobs['num_gt'], [2])
+  np.testing.assert_array_equal(blobs['gt_boxes'], [[10, 10, 50, 50, 1],
+                                                    [10, 0, 50, 19, 1]])
+
+
+def test_only_slivers_full_frame(tmpdir, band_cfg):
+  entry = roidb_entry(tmpdir, [[10, 0, 50, 50], [10, 140, 50, 199]])
+  assert minibatch._crop_rows(entry, HEIGHT) is None
+  blobs = minibatch.get_minibatch([entry], 2)
+  # not cropped, every box kept
+  assert blobs['data'].shape[1] == HEIGHT
+  np.testing.assert_array_equal(blobs['gt_boxes'][:, :4], entry['boxes'])
+
+
+def test_no_boxes_cropped(tmpdir, band_cfg):
+  entry = roidb_entry(tmpdir, [])
+  assert minibatch._crop_rows(entry, HEIGHT) == (50, 150)
+
+
+@pytest.mark.parametrize('min_visible', [0., 0.25, 0.5, 1.])
+def test_min_visible(tmpdir, band_cfg, min_visible):
+  cfg.TRAIN.CROP_BAND_MIN_VISIBLE = min_visible
+  # 1, 10, 20, 30 and 40 of 40 rows in the band
+  boxes = np.array([[0, 11, 9, 50], [0, 20, 9, 59], [0, 30, 9, 69],
+                    [0, 40, 9, 79], [0, 50, 9, 89]], dtype=np.float32)
+  keep = minibatch._in_band(boxes, 50, 150)
+  np.testing.assert_array_equal(keep, np.array([1, 10, 20, 30, 40]) >= min_visible * 40)
@@ -0,0 +1,418 @@
+# --------------------------------------------------------
+# Fast/er R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Check the evaluation of the detections against the original voc_eval,
+# copied below as it was before the matching was vectorized: every path
+# (the file-based voc_eval, eval_all_boxes on all_boxes or a DetectionStore,
+# IncrementalEvaluator and the TP/FP of match_detections) must give the
+# same results on the results files imdb writes.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import os.path as osp
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, osp.join(osp.dirname(__file__), '..', 'lib'))
+
+from datasets.imdb import imdb
+from datasets.detection_store import detection_store
+from datasets.voc_eval import voc_ap, parse_rec, parse_rec_bdd
+from datasets.voc_eval import voc_eval, eval_all_boxes, eval_sweep, IncrementalEvaluator
+from datasets.voc_eval import class_ground_truth, match_detections
+
+OVTHRESHS = [0.3, 0.5, 0.7]
+
+
+def original_voc_eval(detpath,
+             annopath,
+             imagesetfile,
+             classname,
+             cachedir,
+             ovthresh=0.5,
+             use_07_metric=False,
+             use_diff=False):
+  """rec, prec, ap = voc_eval(detpath,
+                              annopath,
+                              imagesetfile,
+                              classname,
+                              [ovthresh],
+                              [use_07_metric])
+
+  Top level function that does the PASCAL VOC evaluation.
+
+  detpath: Path to detections
+      detpath.format(classname) should produce the detection results file.
+  annopath: Path to annotations
+      annopath.format(imagename) should be the xml annotations file.
+  imagesetfile: Text file containing the list of images, one image per line.
+  classname: Category name (duh)
+  cachedir: Directory for caching the annotations
+  [ovthresh]: Overlap threshold (default = 0.5)
+  [use_07_metric]: Whether to use VOC07's 11 point AP computation
+      (default False)
+  """
+  # assumes detections are in detpath.format(classname)
+  # assumes annotations are in annopath.format(imagename)
+  # assumes imagesetfile is a text file with each line an image name
+  # cachedir caches the annotations in a pickle file
+
+  if 'train' in imagesetfile:
+    mode = 'train'
+  if 'val' in imagesetfile:
+    mode = 'val'
+
+  # first load gt
+  if not os.path.isdir(cachedir):
+    os.mkdir(cachedir)
+  cachefile = os.path.join(cachedir, '%s_annots.pkl' % os.path.basename(imagesetfile))
+  # read list of images
+  with open(imagesetfile, 'r') as f:
+    lines = f.readlines()
+  imagenames = [x.strip() for x in lines]
+
+
+
+  if not os.path.isfile(cachefile) and 'bdd' in annopath:
+    #load bdd annotations
+    recs = {}
+    with open(annopath, 'r') as f:
+      annots = json.load(f)
+    cc = 0
+    for i, ann in enumerate(annots):
+      imagename = mode+'/'+ann['name']
+      if imagename in imagenames:
+        cc += 1
+        recs[imagename] = parse_rec_bdd(ann['labels'])
+        if i % 100 == 0:
+          print('Reading annotation for {:d}/{:d}'.format(
+            cc , len(imagenames)))
+    print('Reading annotation for {:d}/{:d}'.format(
+            cc , len(imagenames)))
+    # save
+    print('Saving cached annotations to {:s}'.format(cachefile))
+    with open(cachefile, 'wb') as f:
+      pickle.dump(recs, f)
+
+  elif not os.path.isfile(cachefile):
+    # load voc/KITTI annotations
+    recs = {}
+    for i, imagename in enumerate(imagenames):
+      recs[imagename] = parse_rec(annopath.format(imagename))
+      if i % 100 == 0:
+        print('Reading annotation for {:d}/{:d}'.format(
+          i + 1, len(imagenames)))
+    # save
+    print('Saving cached annotations to {:s}'.format(cachefile))
+    with open(cachefile, 'wb') as f:
+      pickle.dump(recs, f)
+  else:
+    # load
+    with open(cachefile, 'rb') as f:
+      try:
+        recs = pickle.load(f)
+      except:
+        recs = pickle.load(f, encoding='bytes')
+
+  # extract gt objects for this class
+  class_recs = {}
+  npos = 0
+  for imagename in imagenames:
+    R = [obj for obj in recs[imagename] if obj['name'] == classname]
+    bbox = np.array([x['bbox'] for x in R])
+    if use_diff:
+      difficult = np.array([False for x in R]).astype(np.bool)
+    else:
+      difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
+    det = [False] * len(R)
+    npos = npos + sum(~difficult)
+    class_recs[imagename] = {'bbox': bbox,
+                             'difficult': difficult,
+                             'det': det}
+
+  # read dets
+  detfile = detpath.format(classname)
+  with open(detfile, 'r') as f:
+    lines = f.readlines()
+
+  splitlines = [x.strip().split(' ') for x in lines]
+  image_ids = [x[0] for x in splitlines]
+  confidence = np.array([float(x[1]) for x in splitlines])
+  BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
+
+  nd = len(image_ids)
+  tp = np.zeros(nd)
+  fp = np.zeros(nd)
+
+  if BB.shape[0] > 0:
+    # sort by confidence
+    sorted_ind = np.argsort(-confidence)
+    sorted_scores = np.sort(-confidence)
+    BB = BB[sorted_ind, :]
+    image_ids = [image_ids[x] for x in sorted_ind]
+
+    tp_ALL = 0
+    # go down dets and mark TPs and FPs
+    for d in range(nd):
+      R = class_recs[image_ids[d]]
+      bb = BB[d, :].astype(float)
+      ovmax = -np.inf
+      BBGT = R['bbox'].astype(float)
+
+      if BBGT.size > 0:
+        # compute overlaps
+        # intersection
+        ixmin = np.maximum(BBGT[:, 0], bb[0])
+        iymin = np.maximum(BBGT[:, 1], bb[1])
+        ixmax = np.minimum(BBGT[:, 2], bb[2])
+        iymax = np.minimum(BBGT[:, 3], bb[3])
+        iw = np.maximum(ixmax - ixmin + 1., 0.)
+        ih = np.maximum(iymax - iymin + 1., 0.)
+        inters = iw * ih
+
+        # union
+        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
+               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
+               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
+
+        overlaps = inters / uni
+        ovmax = np.max(overlaps)
+        jmax = np.argmax(overlaps)
+
+      if ovmax > ovthresh:
+        if not R['difficult'][jmax]:
+          tp_ALL += 1
+          if not R['det'][jmax]:
+            tp[d] = 1.
+            R['det'][jmax] = 1
+          else:
+            fp[d] = 1.
+      else:
+        fp[d] = 1.
+
+  # compute precision recall
+  fp = np.cumsum(fp)
+  tp = np.cumsum(tp)
+  rec = tp / float(npos)
+  # avoid divide by zero in case the first detection matches a difficult
+  # ground truth
+  prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+  ap = voc_ap(rec, prec, use_07_metric)
+  # print(tp_ALL, float(nd))
+  return rec, prec, ap, tp_ALL/float(nd)
+
+
+class ResultsFiles(imdb):
+  """An imdb writing the results files of all_boxes to a directory."""
+  def __init__(self, classes, image_index, output_dir):
+    imdb.__init__(self, 'results_files', classes)
+    self._image_index = image_index
+    self._output_dir = output_dir
+
+  def _get_voc_results_file_template(self):
+    return os.path.join(self._output_dir, 'det_{:s}.txt')
+
+
+def random_boxes(rng, n, size=200.):
+  xy = rng.uniform(0., size, (n, 2))
+  wh = rng.uniform(4., size / 2., (n, 2))
+  return np.round(np.hstack((xy, xy + wh)))
+
+
+def random_dataset(rng, num_images=20, classes=('car', 'person'), p_empty=0.25,
+                   p_difficult=0.2):
+  """recs, imagenames: up to 5 boxes of random classes per image, p_empty
+  of the images having none."""
+  imagenames = ['{:06d}'.format(i) for i in range(num_images)]
+  recs = {}
+  for imagename in imagenames:
+    num_gt = 0 if rng.rand() < p_empty else rng.randint(1, 6)
+    recs[imagename] = [{'name': classes[rng.randint(len(classes))],
+                        'bbox': [int(x) for x in box],
+                        'difficult': int(rng.rand() < p_difficult)}
+                       for box in random_boxes(rng, num_gt)]
+  return recs, imagenames
+
+
+def random_all_boxes(rng, recs, imagenames, classes, score_levels=None, dets_per_gt=3,
+                     num_false=4):
+  """float32 detections of test_net, all_boxes[cls][image]: jittered copies
+  of the ground truth boxes of the class, several per box, and random boxes,
+  with fractional coordinates and scores that the results files round.
+  With score_levels, the scores take that many values, so that many of them
+  are tied."""
+  all_boxes = [[[] for _ in imagenames] for _ in classes]
+  for cls_ind, cls in enumerate(classes):
+    if cls == '__background__':
+      continue
+    for i, imagename in enumerate(imagenames):
+      gt = np.array([obj['bbox'] for obj in recs[imagename] if obj['name'] == cls])
+      boxes = [box + rng.normal(0., 6., 4) for box in gt
+               for _ in range(rng.randint(dets_per_gt + 1))]
+      boxes += list(random_boxes(rng, rng.randint(1, num_false + 1)) + rng.rand(1, 4))
+      scores = rng.rand(len(boxes))
+      if score_levels is not None:
+        scores = np.floor(scores * score_levels) / score_levels
+      dets = np.hstack((np.array(boxes).reshape(-1, 4) - 1., scores[:, np.newaxis]))
+      all_boxes[cls_ind][i] = dets.astype(np.float32)
+  return all_boxes
+
+
+def write_results_files(tmpdir, recs, imagenames, classes, all_boxes):
+  """annopath, imagesetfile, cachedir, detpath = write_results_files(...)
+
+  The arguments of voc_eval for the ground truth recs, cached as
+  load_annotations caches it, and the detections all_boxes, written by
+  imdb._write_voc_results_file."""
+  imagesetfile = str(tmpdir.join('test.txt'))
+  with open(imagesetfile, 'w') as f:
+    f.write(''.join(imagename + '\n' for imagename in imagenames))
+  cachedir = str(tmpdir.mkdir('cache'))
+  with open(os.path.join(cachedir, 'test.txt_annots.pkl'), 'wb') as f:
+    pickle.dump(recs, f)
+  results = ResultsFiles(classes, imagenames, str(tmpdir))
+  results._write_voc_results_file(all_boxes)
+  return str(tmpdir.join('{:s}.xml')), imagesetfile, cachedir, \
+    results._get_voc_results_file_template()
+
+
+def read_results_file(filename):
+  """image_ids, confidence, BB of a results file, read as voc_eval does."""
+  with open(filename, 'r') as f:
+    splitlines = [x.strip().split(' ') for x in f.readlines()]
+  return ([x[0] for x in splitlines], np.array([float(x[1]) for x in splitlines]),
+          np.array([[float(z) for z in x[2:]] for x in splitlines]))
+
+
+def streamed_results(all_boxes, classes, imagenames, recs, ovthresh, use_07_metric,
+                     use_diff):
+  evaluator = IncrementalEvaluator(classes, imagenames, recs, [ovthresh],
+                                   use_07_metric=use_07_metric, use_diff=use_diff)
+  for i in range(len(imagenames)):
+    evaluator.add(i, [all_boxes[c][i] for c in range(len(classes))])
+  return dict((cls, r) for (cls, _, _), r in evaluator.results().items())
+
+
+def assert_same_results(result, expected):
+  """rec, prec, ap and tp_ALL / nd, with the nan of classes without boxes."""
+  for a, b in zip(result, expected):
+    np.testing.assert_equal(a, b)
+
+
+def check_same(tmpdir, recs, imagenames, all_boxes, ovthresh, use_07_metric=False,
+               use_diff=False, classes=('__background__', 'car', 'person')):
+  annopath, imagesetfile, cachedir, detpath = write_results_files(
+    tmpdir, recs, imagenames, classes, all_boxes)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    evaluated = [
+      eval_all_boxes(all_boxes, classes, imagenames, recs, ovthresh, use_07_metric, use_diff),
+      eval_all_boxes(detection_store(all_boxes), classes, imagenames, recs, ovthresh,
+                     use_07_metric, use_diff),
+      streamed_results(all_boxes, classes, imagenames, recs, ovthresh, use_07_metric,
+                       use_diff)]
+
+    for cls in classes[1:]:
+      expected = original_voc_eval(detpath, annopath, imagesetfile, cls, cachedir,
+                                   ovthresh, use_07_metric, use_diff)
+      assert_same_results(voc_eval(detpath, annopath, imagesetfile, cls, cachedir,
+                                   ovthresh, use_07_metric, use_diff), expected)
+      for results in evaluated:
+        assert_same_results(results[cls], expected)
+
+      # the TP and FP of the detections of the file, sorted as voc_eval does
+      image_ids, confidence, BB = read_results_file(detpath.format(cls))
+      class_recs, npos = class_ground_truth(recs, imagenames, cls, use_diff)
+      sorted_ind = np.argsort(-confidence)
+      tp, fp, _ = match_detections(np.asarray(image_ids)[sorted_ind], BB[sorted_ind, :],
+                                   class_recs, ovthresh)
+      tp, fp = np.cumsum(tp), np.cumsum(fp)
+      np.testing.assert_equal(tp / float(npos), expected[0])
+      np.testing.assert_equal(tp / np.maximum(tp + fp, np.finfo(np.float64).eps), expected[1])
+
+
+@pytest.mark.parametrize('ovthresh', OVTHRESHS)
+@pytest.mark.parametrize('seed', range(4))
+def test_random_ground_truth(tmpdir, seed, ovthresh):
+  rng = np.random.RandomState(seed)
+  recs, imagenames = random_dataset(rng)
+  all_boxes = random_all_boxes(rng, recs, imagenames, ('__background__', 'car', 'person'))
+  check_same(tmpdir, recs, imagenames, all_boxes, ovthresh)
+
+
+@pytest.mark.parametrize('score_levels', [4, 1000])
+@pytest.mark.parametrize('ovthresh', OVTHRESHS)
+@pytest.mark.parametrize('seed', range(4))
+def test_tied_scores(tmpdir, seed, ovthresh, score_levels):
+  rng = np.random.RandomState(100 + seed)
+  recs, imagenames = random_dataset(rng)
+  all_boxes = random_all_boxes(rng, recs, imagenames, ('__background__', 'car', 'person'),
+                               score_levels=score_levels)
+  scores = np.concatenate([d[:, -1] for d in all_boxes[1]])
+  assert len(np.unique(np.round(scores, 3))) < len(scores)
+  check_same(tmpdir, recs, imagenames, all_boxes, ovthresh)
+
+
+@pytest.mark.parametrize('use_diff', [False, True])
+@pytest.mark.parametrize('ovthresh', OVTHRESHS)
+def test_difficult(tmpdir, ovthresh, use_diff):
+  rng = np.random.RandomState(200)
+  recs, imagenames = random_dataset(rng, p_difficult=0.5)
+  all_boxes = random_all_boxes(rng, recs, imagenames, ('__background__', 'car', 'person'),
+                               score_levels=8)
+  check_same(tmpdir, recs, imagenames, all_boxes, ovthresh, use_diff=use_diff)
+
+
+@pytest.mark.parametrize('ovthresh', OVTHRESHS)
+def test_images_without_ground_truth(tmpdir, ovthresh):
+  rng = np.random.RandomState(300)
+  recs, imagenames = random_dataset(rng, p_empty=0.6)
+  assert any(len(objs) == 0 for objs in recs.values())
+  all_boxes = random_all_boxes(rng, recs, imagenames, ('__background__', 'car', 'person'))
+  check_same(tmpdir, recs, imagenames, all_boxes, ovthresh)
+
+
+def test_class_without_ground_truth(tmpdir):
+  rng = np.random.RandomState(350)
+  recs, imagenames = random_dataset(rng, classes=('car',))
+  all_boxes = random_all_boxes(rng, recs, imagenames, ('__background__', 'car', 'person'))
+  check_same(tmpdir, recs, imagenames, all_boxes, 0.5)
+
+
+def test_07_metric(tmpdir):
+  rng = np.random.RandomState(400)
+  recs, imagenames = random_dataset(rng)
+  all_boxes = random_all_boxes(rng, recs, imagenames, ('__background__', 'car', 'person'),
+                               score_levels=8)
+  check_same(tmpdir, recs, imagenames, all_boxes, 0.5, use_07_metric=True)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_incremental_evaluator_matches_eval_sweep(seed):
+  rng = np.random.RandomState(700 + seed)
+  classes = ('__background__', 'car', 'person')
+  recs, imagenames = random_dataset(rng)
+  all_boxes = random_all_boxes(rng, recs, imagenames, classes, score_levels=50)
+  ovthreshs = [0.5, 0.75]
+  settings = ['all', 'small', 'medium', 'large']
+
+  evaluator = IncrementalEvaluator(classes, imagenames, recs, ovthreshs,
+                                   settings=settings)
+  # the images may come in any order
+  for i in rng.permutation(len(imagenames)):
+    evaluator.add(i, [all_boxes[c][i] for c in range(len(classes))])
+  # some classes have no box in some area ranges
+  with np.errstate(divide='ignore', invalid='ignore'):
+    results = evaluator.results()
+    expected = eval_sweep(all_boxes, classes, imagenames, recs, ovthreshs,
+                          settings=settings)
+  assert list(results.keys()) == list(expected.keys())
+  for key in expected:
+    assert_same_results(results[key], expected[key])
@@ -0,0 +1,122 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Time one training step with the per-tensor and the grouped optimizer.
+
+Runs forward/backward/step on a synthetic image so no dataset is needed,
+e.g.
+  python tools/bench_train_step.py --net res101 --cfg experiments/cfgs/res101.yml
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg, cfg_from_file, cfg_from_list
+from model.optimizer import param_groups
+from utils.timer import Timer
+import argparse
+import pprint
+import numpy as np
+
+import torch
+
+from nets.factory import build_net
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark a Faster R-CNN training step')
+  parser.add_argument('--cfg', dest='cfg_file',
+            help='optional config file', default=None, type=str)
+  parser.add_argument('--net', dest='net',
+            help='vgg16, res50, res101, res152, mobile',
+            default='res101', type=str)
+  parser.add_argument('--classes', dest='num_classes',
+            help='number of classes including background',
+            default=9, type=int)
+  parser.add_argument('--iters', dest='iters',
+            help='number of timed steps per setting',
+            default=50, type=int)
+  parser.add_argument('--warmup', dest='warmup',
+            help='number of untimed steps per setting',
+            default=5, type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+            help='set config keys', default=None,
+            nargs=argparse.REMAINDER)
+
+  args = parser.parse_args()
+  return args
+
+def synthetic_blobs(num_images, height, width, num_classes, num_gt=5):
+  """Random images and boxes laid out like get_minibatch output."""
+  data = np.random.uniform(-128., 128., (num_images, height, width, 3)).astype(np.float32)
+  im_info = np.array([[height, width, 1., height, width, 3]] * num_images, dtype=np.float32)
+  gt_boxes = []
+  for _ in range(num_images):
+    x1 = np.random.uniform(0, width / 2., num_gt)
+    y1 = np.random.uniform(0, height / 2., num_gt)
+    x2 = x1 + np.random.uniform(32., width / 2., num_gt)
+    y2 = y1 + np.random.uniform(32., height / 2., num_gt)
+    cls = np.random.randint(1, num_classes, num_gt)
+    gt_boxes.append(np.vstack((x1, y1, x2, y2, cls)).T.astype(np.float32))
+  return {'data': data, 'im_info': im_info, 'gt_boxes': np.vstack(gt_boxes),
+          'num_gt': np.array([num_gt] * num_images, dtype=np.int32)}
+
+def per_tensor_groups(net, lr):
+  """The previous layout: one SGD param group per parameter tensor."""
+  params = []
+  for key, value in dict(net.named_parameters()).items():
+    if value.requires_grad:
+      if 'bias' in key:
+        params += [{'params':[value],'lr':lr*(cfg.TRAIN.DOUBLE_BIAS + 1), 'weight_decay': cfg.TRAIN.BIAS_DECAY and cfg.TRAIN.WEIGHT_DECAY or 0}]
+      else:
+        params += [{'params':[value],'lr':lr, 'weight_decay': cfg.TRAIN.WEIGHT_DECAY}]
+  return params
+
+def time_steps(net, optimizer, blobs, iters, warmup):
+  timer = Timer()
+  for i in range(warmup + iters):
+    if i >= warmup:
+      timer.tic()
+    net.train_step_no_return(blobs, optimizer)
+    if i >= warmup:
+      timer.toc()
+  return timer.average_time()
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  print('Using config:')
+  pprint.pprint(cfg)
+
+  np.random.seed(cfg.RNG_SEED)
+  torch.manual_seed(cfg.RNG_SEED)
+
+  # load network
+  net = build_net(args.net, args.num_classes)
+  net.train()
+  net.cuda()
+
+  scale = cfg.TRAIN.SCALES[0]
+  blobs = synthetic_blobs(cfg.TRAIN.IMS_PER_BATCH, scale, int(scale * 1.5),
+                          args.num_classes)
+  lr = cfg.TRAIN.LEARNING_RATE
+
+  per_tensor = torch.optim.SGD(per_tensor_groups(net, lr), momentum=cfg.TRAIN.MOMENTUM)
+  grouped = torch.optim.SGD(param_groups(net.named_parameters(), lr), momentum=cfg.TRAIN.MOMENTUM)
+
+  t_per_tensor = time_steps(net, per_tensor, blobs, args.iters, args.warmup)
+  t_grouped = time_steps(net, grouped, blobs, args.iters, args.warmup)
+
+  print('{:s}: {:d} param groups {:.4f}s/step, {:d} param groups {:.4f}s/step ({:.1f}% faster)' \
+        .format(args.net, len(per_tensor.param_groups), t_per_tensor,
+                len(grouped.param_groups), t_grouped,
+                100. * (t_per_tensor - t_grouped) / t_per_tensor))
@@ -0,0 +1,45 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""Convert a snapshot to the compact checkpoint format, e.g. to ship a
+half precision model without the discriminator to inference workers:
+  python tools/compact_checkpoint.py --model vgg16_iter_70000.pth \
+    --output vgg16_iter_70000_infer.pth --half --exclude D_img
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.checkpoint import load_checkpoint, save_checkpoint
+import argparse
+import os
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Convert a snapshot to the compact format')
+  parser.add_argument('--model', dest='model',
+            help='snapshot to convert', required=True, type=str)
+  parser.add_argument('--output', dest='output',
+            help='compact checkpoint to write', required=True, type=str)
+  parser.add_argument('--half', dest='half',
+            help='store the weights in half precision', action='store_true')
+  parser.add_argument('--exclude', dest='exclude',
+            help='top level modules to leave out, e.g. D_img',
+            default=[], nargs='*')
+
+  args = parser.parse_args()
+  return args
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  state_dict = load_checkpoint(args.model, exclude=args.exclude)
+  state_dict = dict((k, state_dict[k].cpu()) for k in state_dict)
+  save_checkpoint(state_dict, args.output, compact=True, half=args.half)
+  print('Wrote {:d} tensors to {:s} ({:.1f}MB -> {:.1f}MB)'.format(
+        len(state_dict), args.output, os.path.getsize(args.model) / 1024. ** 2,
+        os.path.getsize(args.output) / 1024. ** 2))
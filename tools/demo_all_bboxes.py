@@ -18,7 +18,8 @@ from __future__ import print_function
 
 import _init_paths
 from model.config import cfg
-from model.test import im_detect
+from model.test import im_detect_batch
+from model.checkpoint import load_checkpoint
 from model.nms_wrapper import nms
 
 from utils.timer import Timer
@@ -47,19 +48,9 @@ DATASETS = {'pascal_voc': ('voc_2007_trainval',), 'pascal_voc_0712': ('voc_2007_
 COLORS = [cm.tab10(i) for i in np.linspace(0., 1., 10)]
 
 
-def demo(net, image_name):
-    """Detect object classes in an image using pre-computed object proposals."""
-
-    # Load the demo image
-    im_file = os.path.join(cfg.DATA_DIR, 'demo', image_name)
-    im = cv2.imread(im_file)
-
-    # Detect all object classes and regress object bounds
-    timer = Timer()
-    timer.tic()
-    scores, boxes = im_detect(net, im)
-    timer.toc()
-    print('Detection took {:.3f}s for {:d} object proposals'.format(timer.total_time(), boxes.shape[0]))
+def demo(image_name, im, scores, boxes):
+    """Show the detections of im_detect_batch in an image."""
+    print('{:d} object proposals'.format(boxes.shape[0]))
 
     # Visualize detections for each class
     thresh = 0.8  # CONF_THRESH
@@ -114,6 +105,8 @@ def parse_args():
                         choices=NETS.keys(), default='res101')
     parser.add_argument('--dataset', dest='dataset', help='Trained dataset [pascal_voc pascal_voc_0712]',
                         choices=DATASETS.keys(), default='pascal_voc_0712')
+    parser.add_argument('--ims_per_batch', dest='ims_per_batch', help='images per forward pass',
+                        default=1, type=int)
     args = parser.parse_args()
 
     return args
@@ -122,6 +115,7 @@ def parse_args():
 if __name__ == '__main__':
     cfg.TEST.HAS_RPN = True  # Use RPN for proposals
     args = parse_args()
+    cfg.TEST.IMS_PER_BATCH = args.ims_per_batch
 
     # model path
     demonet = args.demo_net
@@ -142,7 +136,7 @@ if __name__ == '__main__':
         raise NotImplementedError
     net.create_architecture(21, tag='default', anchor_scales=[8, 16, 32])
 
-    net.load_state_dict(torch.load(saved_model))
+    net.load_state_dict(load_checkpoint(saved_model, exclude=['D_img']))
 
     net.eval()
     net.cuda()
@@ -152,9 +146,18 @@ if __name__ == '__main__':
     im_names = [i for i in os.listdir('data/demo/')  # Pull in all jpgs
                 if i.lower().endswith(".jpg")]
 
-    for im_name in im_names:
+    # Load the demo images and detect all object classes and regress object
+    # bounds in all of them, batched
+    ims = [cv2.imread(os.path.join(cfg.DATA_DIR, 'demo', im_name)) for im_name in im_names]
+    timer = Timer()
+    timer.tic()
+    detections = im_detect_batch(net, ims)
+    timer.toc()
+    print('Detection took {:.3f}s for {:d} images'.format(timer.total_time(), len(ims)))
+
+    for im_name, im, (scores, boxes) in zip(im_names, ims, detections):
         print('~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~')
         print('Demo for data/demo/{}'.format(im_name))
-        demo(net, im_name)
+        demo(im_name, im, scores, boxes)
 
     plt.show()
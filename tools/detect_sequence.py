@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+Detect the objects of an image sequence: the frames of a video file or the
+images of a directory, in name order (e.g. dash-cam footage).
+
+The frames are decoded and preprocessed ahead on background threads, run
+through the network --ims_per_batch at a time and post-processed on
+another thread, and their detections are streamed to a detection store
+file (see datasets.detection_store), the frame being the image index.
+
+With --fps, the sequence is read as a live stream of that many frames per
+second (by default the frame rate of a video): the frames the pipeline
+cannot keep up with are dropped, so that the frames detected stay in time.
+Otherwise every frame is detected, as fast as possible. The dropped frames
+have no detections, and their indices are saved in the 'dropped' array of
+the file.
+
+  ./tools/detect_sequence.py --model output/res50/kitti_train/default/x.pth \
+    --net res50 --imdb kitti_val --source drive.mp4 --fps 30
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.test import prepare_image, detect_prepared, class_detections, limit_detections
+from model.checkpoint import load_checkpoint
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from datasets.detection_store import DetectionStreamWriter
+from utils.pipeline import Prefetcher, Worker
+from utils.timer import StageTimer
+import argparse
+import itertools
+import os, sys
+import time
+
+import cv2
+import numpy as np
+
+from nets.factory import build_net
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.ppm')
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Detect the objects of a video '
+                                   'or image sequence')
+  parser.add_argument('--cfg', dest='cfg_file',
+                      help='optional config file', default=None, type=str)
+  parser.add_argument('--model', dest='model',
+                      help='model to detect with',
+                      default=None, type=str)
+  parser.add_argument('--net', dest='net',
+                      help='vgg16, res50, res101, res152, mobile',
+                      default='res50', type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset the model detects the classes of',
+                      default='voc_2007_test', type=str)
+  parser.add_argument('--source', dest='source',
+                      help='video file, or directory of the frames',
+                      default=None, type=str)
+  parser.add_argument('--output', dest='output',
+                      help='detection store file, <source>.dets by default',
+                      default=None, type=str)
+  parser.add_argument('--fps', dest='fps',
+                      help='read the frames as a stream of this rate, dropping '
+                      'the ones not kept up with; 0 for the rate of a video, '
+                      '-1 to detect every frame',
+                      default=-1, type=float)
+  parser.add_argument('--ims_per_batch', dest='ims_per_batch',
+                      help='frames per forward pass (TEST.IMS_PER_BATCH by default)',
+                      default=None, type=int)
+  parser.add_argument('--max_frames', dest='max_frames',
+                      help='stop after this many frames, 0 for all',
+                      default=0, type=int)
+  parser.add_argument('--num_dets', dest='max_per_image',
+                      help='max number of detections per frame',
+                      default=100, type=int)
+  parser.add_argument('--thresh', dest='thresh',
+                      help='score threshold of the detections',
+                      default=0.05, type=float)
+  parser.add_argument('--report', dest='report',
+                      help='seconds between progress reports',
+                      default=10., type=float)
+  parser.add_argument('--set', dest='set_cfgs',
+                      help='set config keys', default=None,
+                      nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+def _video_frames(filename):
+  capture = cv2.VideoCapture(filename)
+  if not capture.isOpened():
+    raise IOError('Cannot open the video {:s}'.format(filename))
+  try:
+    index = 0
+    while True:
+      ok, frame = capture.read()
+      if not ok:
+        return
+      yield index, frame
+      index += 1
+  finally:
+    capture.release()
+
+
+def open_sequence(source):
+  """frames, fps = open_sequence(source)
+
+  frames yields the (index, frame) pairs of the sequence, frame being the
+  decoded image of a video or the path of the image file of a directory,
+  read by load_frame; fps is the frame rate of a video, None for a
+  directory."""
+  if os.path.isdir(source):
+    names = sorted(name for name in os.listdir(source)
+                   if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS)
+    return enumerate(os.path.join(source, name) for name in names), None
+
+  capture = cv2.VideoCapture(source)
+  fps = capture.get(cv2.CAP_PROP_FPS) if capture.isOpened() else 0.
+  capture.release()
+  return _video_frames(source), fps or None
+
+
+def pace_frames(frames, fps, dropped):
+  """Yield the (index, frame) pairs of frames as a stream of fps frames per
+  second read by a slower pipeline would: a frame is dropped, and its index
+  appended to dropped, if the next frame is due by the time the pipeline
+  asks for it. A pipeline faster than the stream does not wait for it."""
+  start = None
+  for k, (index, frame) in enumerate(frames):
+    now = time.time()
+    if start is None:
+      start = now
+    if now >= start + (k + 1) / fps:
+      dropped.append(index)
+      continue
+    yield index, frame
+
+
+def load_frame(item):
+  index, frame = item
+  if not isinstance(frame, np.ndarray):
+    frame = cv2.imread(frame)
+    if frame is None:
+      raise IOError('Cannot read the image {:s}'.format(item[1]))
+  return index, frame.shape, prepare_image(frame)
+
+
+def detect_sequence(net, frames, output, num_classes, fps=None, ims_per_batch=1,
+                    max_frames=0, thresh=0.05, max_per_image=100, report=10.):
+  """Detect the objects of the (index, frame) pairs of frames and stream
+  their detections to the detection store file output, the frames the
+  pipeline cannot keep up with at fps frames per second being dropped if
+  fps is set. Returns the statistics of the run."""
+  dropped = []
+  if max_frames > 0:
+    frames = itertools.islice(frames, max_frames)
+  if fps:
+    frames = pace_frames(frames, fps, dropped)
+
+  writer = DetectionStreamWriter(output, num_classes)
+  stages = StageTimer()
+
+  def post(indices, detections):
+    start = time.time()
+    for index, (scores, boxes) in zip(indices, detections):
+      writer.add(index, limit_detections(
+        class_detections(scores, boxes, thresh, cfg.TEST.NMS, cfg.TEST.BBOX_VOTE), max_per_image))
+    stages.add('post', time.time() - start, len(indices))
+
+  poster = Worker(post, depth=cfg.TEST.PIPELINE_DEPTH)
+  loader = Prefetcher(load_frame, frames, threads=cfg.TEST.LOADER_THREADS,
+                      ahead=cfg.TEST.PIPELINE_DEPTH)
+  start = time.time()
+  last_report, last_detected = start, 0
+  detected = 0
+  last_index = -1
+  batch = []
+
+  def run(batch):
+    forward_start = time.time()
+    detections = detect_prepared(net, [prepared for _, _, prepared in batch],
+                                 [im_shape for _, im_shape, _ in batch])
+    stages.add('forward', time.time() - forward_start, len(batch))
+    poster.put([index for index, _, _ in batch], detections)
+
+  try:
+    wait_start = time.time()
+    for item in loader:
+      stages.add('wait', time.time() - wait_start)
+      batch.append(item)
+      last_index = item[0]
+      if len(batch) == ims_per_batch:
+        run(batch)
+        detected += len(batch)
+        batch = []
+
+      now = time.time()
+      if report > 0 and now - last_report >= report:
+        print('frame {:d}: {:d} detected, {:d} dropped, {:.1f} fps'
+              .format(last_index, detected, len(dropped),
+                      (detected - last_detected) / (now - last_report)))
+        last_report, last_detected = now, detected
+      wait_start = time.time()
+    if batch:
+      run(batch)
+      detected += len(batch)
+    poster.close()
+  except BaseException:
+    writer.discard()
+    raise
+  elapsed = time.time() - start
+
+  num_frames = max([last_index] + dropped) + 1
+  writer.close(num_frames, [('dropped', np.array(sorted(dropped), dtype=np.int32))])
+  return {'frames': num_frames, 'detected': detected, 'dropped': len(dropped),
+          'seconds': elapsed, 'fps': detected / max(elapsed, 1e-6),
+          'stages': stages.summary()}
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  imdb = get_imdb(args.imdb_name)
+  frames, video_fps = open_sequence(args.source)
+  if args.fps == 0 and video_fps is None:
+    raise ValueError('--fps 0 needs a video whose frame rate is known')
+  fps = video_fps if args.fps == 0 else (args.fps if args.fps > 0 else None)
+  output = args.output or os.path.splitext(args.source.rstrip('/'))[0] + '.dets'
+
+  net = build_net(args.net, imdb.num_classes)
+  net.load_state_dict(load_checkpoint(args.model, exclude=['D_img']))
+  net.eval()
+  net.cuda()
+  print('Loaded network {:s}'.format(args.model))
+
+  stats = detect_sequence(net, frames, output, imdb.num_classes, fps=fps,
+                          ims_per_batch=args.ims_per_batch or cfg.TEST.IMS_PER_BATCH,
+                          max_frames=args.max_frames, thresh=args.thresh,
+                          max_per_image=args.max_per_image, report=args.report)
+
+  print('{:d} frames in {:.1f}s: {:d} detected, {:d} dropped'
+        .format(stats['frames'], stats['seconds'], stats['detected'], stats['dropped']))
+  print('Sustained {:.1f} fps{:s}'.format(
+    stats['fps'], ' (stream at {:.1f} fps)'.format(fps) if fps else ''))
+  print('Per frame: {:s}'.format(stats['stages']))
+  print('Wrote the detections to {:s}'.format(output))
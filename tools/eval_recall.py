@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Recall of saved proposals for several proposal budgets and area ranges,
+# e.g. to pick TEST.RPN_POST_NMS_TOP_N.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from datasets.factory import get_imdb
+import pickle
+import sys, argparse
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Evaluate proposal recall')
+  parser.add_argument('proposals', nargs=1, help='pickled list of the (N x 4 '
+                      'or N x 5) proposals of every image, best first',
+                      type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset the proposals are on',
+                      default='voc_2007_test', type=str)
+  parser.add_argument('--limits', dest='limits',
+                      help='proposal budgets, 0 for all the proposals',
+                      default=[50, 100, 300, 1000, 2000], type=int, nargs='+')
+  parser.add_argument('--areas', dest='areas',
+                      help='area ranges of the ground truth boxes',
+                      default=['all', 'small', 'medium', 'large'], nargs='+')
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  imdb = get_imdb(args.imdb_name)
+  with open(args.proposals[0], 'rb') as f:
+    proposals = [p[:, :4] for p in pickle.load(f)]
+  limits = [limit if limit > 0 else None for limit in args.limits]
+  results = imdb.evaluate_recall_sweep(proposals, areas=args.areas,
+                                       limits=limits)
+
+  print(('{:>10s}' + ' {:>8s}' * 3).format('area', 'limit', 'AR', 'R@0.5'))
+  for (area, limit), r in results.items():
+    print(('{:>10s} {:>8s}' + ' {:8.4f}' * 2).format(
+      area, str(limit or 'all'), r['ar'], r['recalls'][0]))
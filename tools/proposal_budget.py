@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Report the speed versus mAP trade-off of the adaptive proposal budget
+# (TEST.RPN_ADAPTIVE) on evaluation splits: every setting of the RPN
+# objectness threshold and of the min / max number of proposals is run
+# through the network, next to the fixed TEST.RPN_POST_NMS_TOP_N budget,
+# and the time per image, RoIs per image, images skipping the second stage
+# and mAP are printed and saved to proposal_budget.pkl.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.test import prepare_image, detect_prepared, class_detections, limit_detections
+from model.checkpoint import load_checkpoint
+from model.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
+from datasets.factory import get_imdb
+from utils.pipeline import Prefetcher
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+import argparse
+import itertools
+import os, sys
+import time
+
+import cv2
+import numpy as np
+
+from nets.factory import build_net
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Speed versus mAP of the '
+                                   'adaptive proposal budget')
+  parser.add_argument('--cfg', dest='cfg_file',
+                      help='optional config file', default=None, type=str)
+  parser.add_argument('--model', dest='model',
+                      help='model to test',
+                      default=None, type=str)
+  parser.add_argument('--net', dest='net',
+                      help='vgg16, res50, res101, res152, mobile',
+                      default='res50', type=str)
+  parser.add_argument('--imdb', dest='imdb_names',
+                      help='datasets to evaluate',
+                      default=['voc_2007_test'], type=str, nargs='+')
+  parser.add_argument('--score', dest='score_threshs',
+                      help='RPN objectness thresholds',
+                      default=[0.3, 0.5, 0.7, 0.9], type=float, nargs='+')
+  parser.add_argument('--min', dest='min_proposals',
+                      help='min numbers of proposals of an image',
+                      default=[16], type=int, nargs='+')
+  parser.add_argument('--max', dest='max_proposals',
+                      help='max numbers of proposals of an image',
+                      default=[300], type=int, nargs='+')
+  parser.add_argument('--num_images', dest='num_images',
+                      help='only test the first images of every dataset, 0 for all',
+                      default=0, type=int)
+  parser.add_argument('--num_dets', dest='max_per_image',
+                      help='max number of detections per image',
+                      default=100, type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+                      help='set config keys', default=None,
+                      nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+def run_budget(net, imdb, num_images, budget, max_per_image=100):
+  """Detect the first num_images images of imdb with the proposal budget,
+  (score_thresh, min_proposals, max_proposals) or None for the fixed one,
+  and return the time per image of the network, the proposal statistics
+  and the mAP."""
+  cfg.TEST.RPN_ADAPTIVE = budget is not None
+  if budget is not None:
+    cfg.TEST.RPN_SCORE_THRESH, cfg.TEST.RPN_MIN_PROPOSALS, cfg.TEST.RPN_MAX_PROPOSALS = budget
+
+  def load(i):
+    im = cv2.imread(imdb.image_path_at(i))
+    return i, prepare_image(im), im.shape
+
+  evaluator = imdb.streaming_evaluator()
+  net.proposal_stats(reset=True)
+  forward_time = 0.
+  for i, prepared, im_shape in Prefetcher(load, range(num_images),
+                                          threads=cfg.TEST.LOADER_THREADS,
+                                          ahead=cfg.TEST.PIPELINE_DEPTH):
+    start = time.time()
+    # the outputs are copied to the host, the device is done
+    (scores, boxes), = detect_prepared(net, [prepared], [im_shape])
+    forward_time += time.time() - start
+    evaluator.add(i, limit_detections(
+      class_detections(scores, boxes, 0., cfg.TEST.NMS, cfg.TEST.BBOX_VOTE), max_per_image))
+
+  stats = net.proposal_stats()
+  with np.errstate(divide='ignore', invalid='ignore'):
+    ap = evaluator.mean_ap()
+  return {'imdb': imdb.name, 'budget': budget, 'time': forward_time / max(num_images, 1),
+          'rois': stats['rois'] / float(max(stats['images'], 1)),
+          'skipped': stats['skipped'] / float(max(stats['images'], 1)), 'ap': ap}
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  imdbs = [get_imdb(name) for name in args.imdb_names]
+  for imdb in imdbs:
+    imdb.competition_mode(False)
+    if imdb.streaming_evaluator() is None:
+      print('{} cannot be evaluated image by image'.format(imdb.name))
+      sys.exit(1)
+
+  net = build_net(args.net, imdbs[0].num_classes)
+  net.load_state_dict(load_checkpoint(args.model, exclude=['D_img']))
+  net.eval()
+  net.cuda()
+  print('Loaded network {:s}'.format(args.model))
+
+  budgets = [None] + [budget for budget in itertools.product(
+    args.score_threshs, args.min_proposals, args.max_proposals) if budget[1] <= budget[2]]
+  weights_filename = os.path.splitext(os.path.basename(args.model))[0]
+  for imdb in imdbs:
+    num_images = min(args.num_images or imdb.num_images, imdb.num_images)
+    # the first forward passes initialize the device
+    run_budget(net, imdb, min(num_images, 8), None, args.max_per_image)
+    results = [run_budget(net, imdb, num_images, budget, args.max_per_image)
+               for budget in budgets]
+
+    output_dir = get_output_dir(imdb, weights_filename)
+    with open(os.path.join(output_dir, 'proposal_budget.pkl'), 'wb') as f:
+      pickle.dump(results, f, pickle.HIGHEST_PROTOCOL)
+
+    fixed = results[0]
+    print('{:s}, {:d} images'.format(imdb.name, num_images))
+    print(('{:>8s}' * 9).format('score', 'min', 'max', 'RoIs/im', 'skipped',
+                                'ms/im', 'speedup', 'AP@{:g}'.format(cfg.TEST.EVAL_OVTHRESHS[0]),
+                                'dAP'))
+    for r in results:
+      budget = ('{:8.2f}{:8d}{:8d}'.format(*r['budget']) if r['budget'] is not None
+                else '{:>8s}{:>8s}{:8d}'.format('fixed', '-', cfg.TEST.RPN_POST_NMS_TOP_N))
+      print(budget + '{:8.1f}{:8.1%}{:8.1f}{:8.2f}{:8.4f}{:+8.4f}'.format(
+        r['rois'], r['skipped'], r['time'] * 1000, fixed['time'] / max(r['time'], 1e-9),
+        r['ap'], r['ap'] - fixed['ap']))
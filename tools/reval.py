@@ -16,7 +16,7 @@ import _init_paths
 from model.test import apply_nms
 from model.config import cfg
 from datasets.factory import get_imdb
-import pickle
+from datasets.detection_store import load_detections
 import os, sys, argparse
 import numpy as np
 
@@ -51,8 +51,7 @@ def from_dets(imdb_name, output_dir, args):
   imdb = get_imdb(imdb_name)
   imdb.competition_mode(args.comp_mode)
   imdb.config['matlab_eval'] = args.matlab_eval
-  with open(os.path.join(output_dir, 'detections.pkl'), 'rb') as f:
-    dets = pickle.load(f)
+  dets = load_detections(output_dir)
 
   if args.apply_nms:
     print('Applying NMS to all detections')
@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""
+Local detection server, and a load generator to benchmark it.
+
+The server loads a snapshot once and answers POST /detect requests whose
+body is an encoded image (JPEG, PNG, ...) with the JSON detections of the
+image. Concurrent requests are run through the network together, in
+batches of up to --max_batch images closed at most --max_wait ms after
+their first request. GET /stats returns the number of batches and images.
+
+  ./tools/serve.py --model output/res50/cityscapes_train/default/x.pth \
+    --net res50 --imdb cityscapes_val --port 8000
+  curl --data-binary @image.jpg 'http://127.0.0.1:8000/detect?thresh=0.5'
+  ./tools/serve.py --bench --images data/demo --port 8000 --concurrency 8
+
+--unix PATH serves (or benchmarks) on a Unix socket instead of a TCP port.
+
+With --workers N, the server forks N worker processes that accept the
+connections of the same socket, each pinned to its own CPUs (and GPU with
+--gpus). The weights are loaded from one memory-mapped compact checkpoint,
+without the discriminator, whose pages the workers share: a torch.save
+snapshot is converted once into --weights_cache (shared memory by default).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.test import prepare_image, detect_prepared, class_detections, limit_detections
+from model.checkpoint import load_checkpoint, shared_checkpoint
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from utils.pipeline import MicroBatcher
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn, UnixStreamServer
+  import http.client as httplib
+  from urllib.parse import urlparse, parse_qs
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn, UnixStreamServer
+  import httplib
+  from urlparse import urlparse, parse_qs
+import argparse
+import json
+import multiprocessing
+import os, sys
+import signal
+import socket
+import tempfile
+import threading
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+from nets.factory import build_net
+
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Serve a Fast R-CNN network, '
+                                   'or benchmark the server')
+  parser.add_argument('--cfg', dest='cfg_file',
+                      help='optional config file', default=None, type=str)
+  parser.add_argument('--model', dest='model',
+                      help='model to serve',
+                      default=None, type=str)
+  parser.add_argument('--net', dest='net',
+                      help='vgg16, res50, res101, res152, mobile',
+                      default='res50', type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset the model detects the classes of',
+                      default='voc_2007_test', type=str)
+  parser.add_argument('--host', dest='host',
+                      help='address to serve on',
+                      default='127.0.0.1', type=str)
+  parser.add_argument('--port', dest='port',
+                      help='TCP port to serve on',
+                      default=8000, type=int)
+  parser.add_argument('--unix', dest='unix',
+                      help='Unix socket to serve on instead of the TCP port',
+                      default=None, type=str)
+  parser.add_argument('--max_batch', dest='max_batch',
+                      help='max number of images per forward pass',
+                      default=8, type=int)
+  parser.add_argument('--max_wait', dest='max_wait',
+                      help='max ms a request waits for others to batch with',
+                      default=10., type=float)
+  parser.add_argument('--num_dets', dest='max_per_image',
+                      help='max number of detections per image',
+                      default=100, type=int)
+  parser.add_argument('--thresh', dest='thresh',
+                      help='score threshold of the detections, unless the '
+                      'request sets one',
+                      default=0.5, type=float)
+  parser.add_argument('--workers', dest='workers',
+                      help='worker processes serving the socket',
+                      default=1, type=int)
+  parser.add_argument('--cpus_per_worker', dest='cpus_per_worker',
+                      help='CPUs (and threads) of every worker, 0 to split the '
+                      'CPUs evenly among several workers',
+                      default=0, type=int)
+  parser.add_argument('--gpus', dest='gpus',
+                      help='GPUs the workers take in turn',
+                      default=None, nargs='+', type=str)
+  parser.add_argument('--weights_cache', dest='weights_cache',
+                      help='directory of the compact copies of torch.save snapshots',
+                      default='/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                      type=str)
+  parser.add_argument('--verbose', dest='verbose',
+                      help='log every request',
+                      action='store_true')
+  parser.add_argument('--bench', dest='bench',
+                      help='benchmark a running server instead of serving',
+                      action='store_true')
+  parser.add_argument('--images', dest='images',
+                      help='directory of the images the benchmark sends',
+                      default='data/demo', type=str)
+  parser.add_argument('--concurrency', dest='concurrency',
+                      help='concurrent clients of the benchmark',
+                      default=8, type=int)
+  parser.add_argument('--requests', dest='requests',
+                      help='requests of the benchmark',
+                      default=200, type=int)
+  parser.add_argument('--warmup', dest='warmup',
+                      help='requests sent before the benchmark starts timing',
+                      default=8, type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+                      help='set config keys', default=None,
+                      nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+class Detector(object):
+  """Detect the objects of encoded images, the concurrent calls of detect
+  sharing forward passes. Decoding, preprocessing and NMS run on the
+  threads of the callers."""
+
+  def __init__(self, net, classes, max_batch=8, max_wait=0.01, max_per_image=100):
+    self._net = net
+    self._classes = classes
+    self._max_per_image = max_per_image
+    self._batcher = MicroBatcher(self._forward, max_batch, max_wait)
+
+  def _forward(self, items):
+    return detect_prepared(self._net, [prepared for prepared, _ in items],
+                           [im_shape for _, im_shape in items])
+
+  def detect(self, data, thresh):
+    start = time.time()
+    im = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if im is None:
+      raise ValueError('The request body is not an image')
+    scores, boxes = self._batcher((prepare_image(im), im.shape))
+    image_dets = limit_detections(
+      class_detections(scores, boxes, thresh, cfg.TEST.NMS, cfg.TEST.BBOX_VOTE), self._max_per_image)
+
+    detections = []
+    for j in range(1, len(image_dets)):
+      for det in image_dets[j]:
+        detections.append({'class': self._classes[j], 'score': float(det[4]),
+                           'bbox': [float(x) for x in det[:4]]})
+    detections.sort(key=lambda d: -d['score'])
+    return {'detections': detections, 'width': im.shape[1], 'height': im.shape[0],
+            'time': time.time() - start}
+
+  def stats(self):
+    stats = self._batcher.stats()
+    stats['worker'] = os.getpid()
+    return stats
+
+
+def make_handler(detector, default_thresh, verbose=False):
+  class DetectionHandler(BaseHTTPRequestHandler):
+    # keep the connections alive between the requests of a client
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+      # the clients of a Unix socket have no address
+      return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+      if verbose:
+        BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send_json(self, code, obj):
+      body = json.dumps(obj).encode('utf-8')
+      self.send_response(code)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def do_GET(self):
+      if urlparse(self.path).path == '/stats':
+        self._send_json(200, detector.stats())
+      else:
+        self._send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+      url = urlparse(self.path)
+      data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+      if url.path != '/detect':
+        self._send_json(404, {'error': 'unknown path {}'.format(self.path)})
+        return
+      try:
+        thresh = float(parse_qs(url.query).get('thresh', [default_thresh])[0])
+        self._send_json(200, detector.detect(data, thresh))
+      except ValueError as e:
+        self._send_json(400, {'error': str(e)})
+      except Exception as e:
+        self._send_json(500, {'error': str(e)})
+
+  return DetectionHandler
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+  daemon_threads = True
+
+  def server_bind(self):
+    # the socket of a previous server
+    if os.path.exists(self.server_address):
+      os.remove(self.server_address)
+    UnixStreamServer.server_bind(self)
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+  def __init__(self, path):
+    httplib.HTTPConnection.__init__(self, 'localhost')
+    self._path = path
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self._path)
+
+
+def connect(args):
+  if args.unix:
+    return UnixHTTPConnection(args.unix)
+  return httplib.HTTPConnection(args.host, args.port)
+
+
+def bench(args):
+  """Send args.requests images from args.concurrency clients and report
+  the throughput and the latencies."""
+  names = sorted(f for f in os.listdir(args.images)
+                 if os.path.splitext(f)[1].lower() in ('.jpg', '.jpeg', '.png'))
+  assert names, 'No images in {}'.format(args.images)
+  images = []
+  for name in names:
+    with open(os.path.join(args.images, name), 'rb') as f:
+      images.append(f.read())
+
+  lock = threading.Lock()
+  state = {'next': 0, 'errors': 0}
+  latencies = []
+
+  def client(num_requests):
+    conn = connect(args)
+    while True:
+      with lock:
+        n = state['next']
+        if n >= num_requests:
+          break
+        state['next'] += 1
+      start = time.time()
+      conn.request('POST', '/detect', images[n % len(images)],
+                   {'Content-Type': 'application/octet-stream'})
+      response = conn.getresponse()
+      response.read()
+      latency = time.time() - start
+      with lock:
+        if response.status != 200:
+          state['errors'] += 1
+        latencies.append(latency)
+    conn.close()
+
+  def run(num_requests):
+    state['next'] = 0
+    del latencies[:]
+    clients = [threading.Thread(target=client, args=(num_requests,))
+               for _ in range(args.concurrency)]
+    start = time.time()
+    for c in clients:
+      c.start()
+    for c in clients:
+      c.join()
+    return time.time() - start
+
+  run(args.warmup)
+  stats = json.loads(get_stats(args))
+  state['errors'] = 0
+  elapsed = run(args.requests)
+  after = json.loads(get_stats(args))
+
+  lat_ms = np.array(latencies) * 1000.
+  # the counts of a single worker, when several serve the socket
+  same_worker = after['worker'] == stats['worker']
+  batches = max(after['batches'] - stats['batches'], 1)
+  print('{:d} requests from {:d} clients in {:.2f}s, {:d} errors'.format(
+    len(lat_ms), args.concurrency, elapsed, state['errors']))
+  print('throughput {:.1f} images/s, {:s} images per batch'.format(
+    len(lat_ms) / elapsed, '{:.2f}'.format((after['items'] - stats['items']) / float(batches))
+    if same_worker else 'n/a'))
+  print('latency p50 {:.1f}ms p99 {:.1f}ms max {:.1f}ms'.format(
+    np.percentile(lat_ms, 50), np.percentile(lat_ms, 99), lat_ms.max()))
+
+
+def get_stats(args):
+  conn = connect(args)
+  conn.request('GET', '/stats')
+  body = conn.getresponse().read().decode('utf-8')
+  conn.close()
+  return body
+
+
+def list_cpus():
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(multiprocessing.cpu_count()))
+
+
+def serve(args, classes, weights, server, worker, cpus=None):
+  """Load the network and serve the socket of server, in worker k, pinned
+  with its threads to cpus."""
+  if cpus:
+    if hasattr(os, 'sched_setaffinity'):
+      os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(len(cpus))
+    cv2.setNumThreads(len(cpus))
+  if args.gpus:
+    # before CUDA is initialized in this process
+    os.environ['CUDA_VISIBLE_DEVICES'] = args.gpus[worker % len(args.gpus)]
+
+  net = build_net(args.net, len(classes))
+  net.eval()
+  net.cuda()
+  # copied from the shared pages of the memory-mapped weights to the device,
+  # without a private copy on the host
+  net.load_state_dict(load_checkpoint(weights, exclude=['D_img']))
+
+  detector = Detector(net, classes, max_batch=args.max_batch,
+                      max_wait=args.max_wait / 1000., max_per_image=args.max_per_image)
+  server.RequestHandlerClass = make_handler(detector, args.thresh, args.verbose)
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.bench:
+    bench(args)
+    sys.exit(0)
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  imdb = get_imdb(args.imdb_name)
+  # read by every worker, through the page cache
+  weights = shared_checkpoint(args.model, args.weights_cache, exclude=['D_img'])
+  print('Serving the weights of {:s}'.format(weights))
+
+  # bound before forking, the workers accept the connections of the socket
+  if args.unix:
+    server = ThreadingUnixHTTPServer(args.unix, BaseHTTPRequestHandler)
+    print('Serving on {:s}'.format(args.unix))
+  else:
+    server = ThreadingHTTPServer((args.host, args.port), BaseHTTPRequestHandler)
+    print('Serving on http://{:s}:{:d}'.format(args.host, args.port))
+
+  if args.workers == 1:
+    cpus = list_cpus()[:args.cpus_per_worker] if args.cpus_per_worker > 0 else None
+    try:
+      serve(args, imdb.classes, weights, server, 0, cpus)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+    sys.exit(0)
+
+  cpus = list_cpus()
+  per_worker = args.cpus_per_worker or max(len(cpus) // args.workers, 1)
+  workers = {}
+  for k in range(args.workers):
+    worker_cpus = [cpus[(k * per_worker + j) % len(cpus)] for j in range(per_worker)]
+    pid = os.fork()
+    if pid == 0:
+      status = 0
+      try:
+        serve(args, imdb.classes, weights, server, k, worker_cpus)
+      except KeyboardInterrupt:
+        pass
+      except Exception:
+        traceback.print_exc()
+        status = 1
+      finally:
+        os._exit(status)
+    workers[pid] = k
+    print('Worker {:d} (pid {:d}) on CPUs {}'.format(k, pid, worker_cpus))
+
+  try:
+    while workers:
+      pid, status = os.wait()
+      print('Worker {:d} exited with status {:d}'.format(workers.pop(pid), status))
+  except KeyboardInterrupt:
+    for pid in workers:
+      os.kill(pid, signal.SIGTERM)
+  finally:
+    server.server_close()
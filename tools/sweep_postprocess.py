@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Fast R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Evaluate other score thresholds, NMS thresholds and max_per_image settings
+# on the raw outputs a test_net run saved with TEST.SAVE_RAW_OUTPUTS, without
+# running the network again.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.test import class_detections, limit_detections
+from model.config import cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from datasets.detection_store import RawOutputs
+from datasets.voc_eval import COCO_OVTHRESHS
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+import itertools
+import multiprocessing
+import os, sys, argparse
+import numpy as np
+
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Sweep the post-processing '
+                                   'of saved raw detector outputs')
+  parser.add_argument('output_dir', nargs=1, help='results directory of test_net, '
+                      'with raw_outputs.arr', type=str)
+  parser.add_argument('--cfg', dest='cfg_file',
+                      help='optional config file', default=None, type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset to evaluate',
+                      default='voc_2007_test', type=str)
+  parser.add_argument('--thresh', dest='threshs',
+                      help='score thresholds of the detections',
+                      default=[0.], type=float, nargs='+')
+  parser.add_argument('--nms', dest='nms_threshs',
+                      help='NMS thresholds',
+                      default=[0.3], type=float, nargs='+')
+  parser.add_argument('--num_dets', dest='max_per_image',
+                      help='max numbers of detections per image, 0 for no limit',
+                      default=[100], type=int, nargs='+')
+  parser.add_argument('--workers', dest='workers',
+                      help='processes, 0 for one per core',
+                      default=0, type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+                      help='set config keys', default=None,
+                      nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+# The dataset and the raw outputs of the workers, shared copy-on-write when
+# the pool forks
+_sweep_data = {}
+
+
+def _init_sweep_worker(data):
+  _sweep_data.update(data)
+  # the jobs already use every core
+  torch.set_num_threads(1)
+
+
+def _sweep_job(job):
+  """Replay the post-processing of every image with the score threshold
+  and NMS threshold of job, once for all the max_per_image settings."""
+  thresh, nms_thresh, limits = job
+  imdb, raw = _sweep_data['imdb'], _sweep_data['raw']
+  evaluators = [imdb.streaming_evaluator() for _ in limits]
+  num_dets = np.zeros(len(limits), dtype=np.int64)
+  for i in range(raw.num_images):
+    scores, boxes = raw.image(i)
+    image_dets = class_detections(scores, boxes, thresh, nms_thresh)
+    for k, max_per_image in enumerate(limits):
+      dets = limit_detections(image_dets, max_per_image)
+      evaluators[k].add(i, dets)
+      num_dets[k] += sum(len(d) for d in dets)
+
+  results = []
+  for k, max_per_image in enumerate(limits):
+    evaluator = evaluators[k]
+    with np.errstate(divide='ignore', invalid='ignore'):
+      ap = evaluator.mean_ap()
+      # the COCO-style AP, when the dataset evaluates every threshold
+      coco_ap = np.mean([evaluator.mean_ap(ovthresh=t) for t in COCO_OVTHRESHS]) \
+        if all(t in evaluator.ovthreshs for t in COCO_OVTHRESHS) else np.nan
+    results.append({'thresh': thresh, 'nms': nms_thresh,
+                    'max_per_image': max_per_image, 'ap': ap, 'coco_ap': coco_ap,
+                    'dets_per_image': num_dets[k] / float(max(raw.num_images, 1))})
+  return results
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  output_dir = args.output_dir[0]
+  imdb = get_imdb(args.imdb_name)
+  imdb.competition_mode(False)
+  evaluator = imdb.streaming_evaluator()
+  if evaluator is None:
+    print('{} cannot be evaluated image by image'.format(imdb.name))
+    sys.exit(1)
+  raw = RawOutputs(os.path.join(output_dir, 'raw_outputs.arr'))
+  assert raw.num_images == imdb.num_images, \
+    'raw_outputs.arr holds {:d} images, {} has {:d}'.format(
+      raw.num_images, imdb.name, imdb.num_images)
+
+  jobs = [(thresh, nms_thresh, args.max_per_image)
+          for thresh, nms_thresh in itertools.product(args.threshs, args.nms_threshs)]
+  workers = min(args.workers or multiprocessing.cpu_count(), len(jobs))
+  data = {'imdb': imdb, 'raw': raw}
+  if workers > 1:
+    pool = multiprocessing.Pool(workers, initializer=_init_sweep_worker,
+                                initargs=(data,))
+    try:
+      results = list(itertools.chain.from_iterable(pool.map(_sweep_job, jobs)))
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    _sweep_data.update(data)
+    results = list(itertools.chain.from_iterable(map(_sweep_job, jobs)))
+
+  with open(os.path.join(output_dir, 'postprocess_sweep.pkl'), 'wb') as f:
+    pickle.dump(results, f, pickle.HIGHEST_PROTOCOL)
+
+  print(('{:>8s}' * 6).format('thresh', 'nms', 'dets', 'dets/im',
+                              'AP@{:g}'.format(evaluator.ovthreshs[0]), 'AP'))
+  for r in sorted(results, key=lambda r: -r['ap']):
+    print(('{:8.3f}{:8.3f}{:>8s}{:8.1f}{:8.4f}{:8.4f}').format(
+      r['thresh'], r['nms'], str(r['max_per_image'] or 'all'),
+      r['dets_per_image'], r['ap'], r['coco_ap']))
@@ -8,13 +8,15 @@ from __future__ import division
 from __future__ import print_function
 
 import _init_paths
-from model.test import test_net
+from model.test import test_net, merge_shards
+from model.checkpoint import load_checkpoint
 from model.config import cfg, cfg_from_file, cfg_from_list
 from datasets.factory import get_imdb
 import datasets.imdb
 import argparse
 import pprint
 import time, os, sys
+import subprocess
 
 from nets.vgg16 import vgg16
 from nets.resnet_v1 import resnetv1
@@ -46,6 +48,22 @@ def parse_args():
   parser.add_argument('--net', dest='net',
                       help='vgg16, res50, res101, res152, mobile',
                       default='res50', type=str)
+  parser.add_argument('--shards', dest='num_shards',
+                      help='split the images among this many test processes',
+                      default=1, type=int)
+  parser.add_argument('--shard', dest='shard',
+                      help='only test this shard and save its detections, '
+                      'without --shard the shards are launched and merged',
+                      default=None, type=int)
+  parser.add_argument('--merge', dest='merge',
+                      help='only merge and evaluate the saved shards',
+                      action='store_true')
+  parser.add_argument('--threads', dest='threads',
+                      help='threads of every test process, 0 for the default',
+                      default=0, type=int)
+  parser.add_argument('--gpus', dest='gpus',
+                      help='GPUs the launched shards take in turn',
+                      default=None, nargs='+', type=str)
   parser.add_argument('--set', dest='set_cfgs',
                         help='set config keys', default=None,
                         nargs=argparse.REMAINDER)
@@ -85,6 +103,33 @@ if __name__ == '__main__':
   imdb = get_imdb(args.imdb_name)
   imdb.competition_mode(args.comp_mode)
 
+  if args.merge:
+    merge_shards(imdb, filename, args.num_shards)
+    sys.exit(0)
+
+  if args.num_shards > 1 and args.shard is None:
+    # Run every shard in its own process, each loading the model, and
+    # merge their detections once they are all done
+    workers = []
+    for k in range(args.num_shards):
+      env = dict(os.environ)
+      if args.threads > 0:
+        env['OMP_NUM_THREADS'] = str(args.threads)
+      if args.gpus:
+        env['CUDA_VISIBLE_DEVICES'] = args.gpus[k % len(args.gpus)]
+      # before the other arguments, --set takes all the ones after it
+      workers.append(subprocess.Popen([sys.executable, sys.argv[0], '--shard', str(k)] +
+                                      sys.argv[1:], env=env))
+    failed = [k for k, w in enumerate(workers) if w.wait() != 0]
+    if failed:
+      print('Shards {} failed'.format(failed))
+      sys.exit(1)
+    merge_shards(imdb, filename, args.num_shards)
+    sys.exit(0)
+
+  if args.threads > 0:
+    torch.set_num_threads(args.threads)
+
   # load network
   if args.net == 'vgg16':
     net = vgg16()
@@ -111,11 +156,14 @@ if __name__ == '__main__':
 
   if args.model:
     print(('Loading model check point from {:s}').format(args.model))
-    net.load_state_dict(torch.load(args.model))
+    net.load_state_dict(load_checkpoint(args.model, exclude=['D_img']))
     print('Loaded.')
   else:
     print(('Loading initial weights from {:s}').format(args.weight))
     print('Loaded.')
 
-  test_net(net, imdb, filename, max_per_image=args.max_per_image)
+  assert args.shard is None or 0 <= args.shard < args.num_shards, \
+    '--shard must be below --shards'
+  shard = (args.shard, args.num_shards) if args.shard is not None else None
+  test_net(net, imdb, filename, max_per_image=args.max_per_image, shard=shard)
   # os.system("mv ./pr/pr.png ./pr/%s.png" % args.model[args.model.rfind('/')+1:][18:-4])